@@ -19,6 +19,7 @@ from pathlib import Path
 
 from app.utils import (
     load_config,
+    save_hash_cache,
     sha256_file,
     timestamp,
     ensure_dir,
@@ -95,13 +96,14 @@ def create_backup(stage: str, label: str = "") -> dict:
                 ensure_dir(dest_path.parent)
                 shutil.copy2(str(filepath), str(dest_path))
 
+                size = filepath.stat().st_size
                 file_info = {
                     "path": str(rel_path),
-                    "size": filepath.stat().st_size,
+                    "size": size,
                     "hash": sha256_file(filepath),
                 }
                 manifest["files"].append(file_info)
-                manifest["total_size_bytes"] += filepath.stat().st_size
+                manifest["total_size_bytes"] += size
                 total_files += 1
 
     # Guardar manifest del backup
@@ -230,6 +232,7 @@ def main():
     if args.action == "create":
         print_header("CREAR BACKUP")
         create_backup(args.stage, args.label)
+        save_hash_cache()
 
     elif args.action == "list":
         print_header("BACKUPS DISPONIBLES")
@@ -8,21 +8,28 @@ respetando las reglas de integridad estructural (§6).
 Salida: data/04_chunks/chunks.jsonl
 
 Uso:
-    python -m app.chunk
+    python -m app.chunk [--full] [--workers N]
     make chunk
 """
 
+import argparse
 import json
+import multiprocessing
+import os
 import re
 import sys
-import uuid
 from pathlib import Path
 
 import yaml
 
+from app.ledger import PipelineLedger, config_hash
+from app.tagging import MetadataTagger, get_tagger
+from app.tokenizer import TokenCounter, get_token_counter
 from app.utils import (
     load_config,
     require_pdfs,
+    save_hash_cache,
+    sha256_file,
     sha256_text,
     ensure_dir,
     print_header,
@@ -34,13 +41,22 @@ from app.utils import (
 
 RE_HEADER = re.compile(r"^(#{1,6})\s+(.+)$", re.MULTILINE)
 RE_PAGE_MARKER = re.compile(r"<!--\s*page:\s*(\d+)\s*-->")
-RE_CODE_BLOCK = re.compile(r"```[\s\S]*?```")
+RE_CODE_FENCE = re.compile(r"^\s*```")
 RE_TABLE_ROW = re.compile(r"^\|.*\|$")
+RE_TABLE_SEPARATOR = re.compile(r"^\|[\s:|-]+\|$")
 RE_LIST_ITEM = re.compile(r"^\s*[-*+]\s+|^\s*\d+\.\s+")
 
-# Patrones para tags de seguridad
-RE_CVE = re.compile(r"CVE-\d{4}-\d{4,}")
-RE_ATTACK = re.compile(r"T\d{4}(?:\.\d{3})?")
+# Cortes para micro-chunks, de más a menos preferible: línea, frase, palabra.
+# Los párrafos empiezan por la frase; tablas, listas y código por la línea.
+MICRO_SPLIT_LEVELS = (
+    re.compile(r"\n"),
+    re.compile(r"(?<=[.!?;:])\s+"),
+    re.compile(r"\s+"),
+)
+
+# Versión del algoritmo de chunking: incrementar al cambiar create_chunks
+# para invalidar los chunks reutilizados por el pipeline incremental
+CHUNKER_VERSION = 6
 
 
 def load_chunking_config() -> dict:
@@ -50,11 +66,6 @@ def load_chunking_config() -> dict:
         return yaml.safe_load(f)
 
 
-def estimate_tokens(text: str) -> int:
-    """Estimación rápida de tokens (1 token ≈ 4 chars para español)."""
-    return max(1, len(text) // 4)
-
-
 def extract_page_numbers(text: str) -> tuple[int | None, int | None]:
     """Extrae números de página del texto (de marcadores <!-- page: N -->)."""
     pages = [int(m) for m in RE_PAGE_MARKER.findall(text)]
@@ -67,65 +78,21 @@ def detect_language(text: str) -> str:
     """Detecta idioma básico (ES/EN) por heurística."""
     es_words = {"de", "en", "la", "el", "los", "las", "del", "que", "para", "por",
                 "con", "una", "se", "es", "al", "como", "más", "pero", "su", "ya"}
-    words = set(text.lower().split()[:200])
+    # Solo las primeras 200 palabras: no partir todo el texto
+    words = set(text.lower().split(maxsplit=200)[:200])
     es_count = len(words & es_words)
     return "es" if es_count > 5 else "en"
 
 
-def detect_doc_type(text: str, filename: str) -> str:
-    """Intenta inferir el tipo de documento."""
-    lower = (text[:2000] + filename).lower()
-    type_hints = {
-        "política": "politica",
-        "policy": "politica",
-        "runbook": "runbook",
-        "procedimiento": "procedimiento",
-        "procedure": "procedimiento",
-        "guía": "guia",
-        "guide": "guia",
-        "manual": "guia",
-        "norma": "normativa",
-        "reglamento": "normativa",
-        "regulation": "normativa",
-        "estándar": "normativa",
-        "standard": "normativa",
-        "informe": "reporte",
-        "report": "reporte",
-    }
-    for keyword, doc_type in type_hints.items():
-        if keyword in lower:
-            return doc_type
-    return "guia"  # default
-
-
-def extract_security_tags(text: str) -> list[str]:
-    """Extrae tags de seguridad (CVE, ATT&CK, etc.)."""
-    tags = []
-    tags.extend(RE_CVE.findall(text))
-    tags.extend(RE_ATTACK.findall(text))
-    return list(set(tags))
-
-
-def detect_frameworks(text: str) -> list[str]:
-    """Detecta marcos de seguridad mencionados."""
-    frameworks_patterns = {
-        "ENS": r"\bENS\b",
-        "CCN-STIC": r"\bCCN[-\s]?STIC\b",
-        "NIST": r"\bNIST\b",
-        "CIS": r"\bCIS\b",
-        "OWASP": r"\bOWASP\b",
-        "ISO 27001": r"\bISO\s*27001\b",
-        "ISO 27002": r"\bISO\s*27002\b",
-        "ENISA": r"\bENISA\b",
-        "RGPD": r"\bRGPD\b|GDPR",
-        "NIS2": r"\bNIS\s*2\b",
-        "CISA": r"\bCISA\b",
-    }
-    found = []
-    for name, pattern in frameworks_patterns.items():
-        if re.search(pattern, text, re.IGNORECASE):
-            found.append(name)
-    return found
+def make_chunk_id(doc_id: str, section_path: str, ordinal: int, content: str) -> str:
+    """
+    ID de chunk determinista derivado de doc_id, sección, ordinal y hash del contenido.
+
+    Un documento sin cambios produce siempre los mismos IDs, lo que permite
+    cachés de embeddings, indexación incremental y diffs entre iteraciones.
+    """
+    key = "\x1f".join([doc_id, section_path, str(ordinal), sha256_text(content)])
+    return sha256_text(key)[:16]
 
 
 def split_by_headers(text: str) -> list[dict]:
@@ -174,23 +141,371 @@ def split_by_headers(text: str) -> list[dict]:
     return sections
 
 
-def should_merge_section(section: dict, config: dict) -> bool:
-    """Determina si una sección es demasiado pequeña y debería fusionarse."""
-    tokens = estimate_tokens(section.get("content", ""))
-    return tokens < config.get("min_tokens", 300) // 2
+def _is_transparent(line: str) -> bool:
+    """Líneas en blanco o marcadores de página: no cortan una tabla o lista."""
+    return not line.strip() or RE_PAGE_MARKER.fullmatch(line.strip()) is not None
+
+
+def split_blocks(text: str) -> list[tuple[int, int, str]]:
+    """
+    Tokenizador de bloques Markdown para el chunker.
+
+    Returns:
+        Bloques (inicio, fin, tipo) sobre `text`, en orden, sin las líneas en
+        blanco que los separan. Tipos:
+            code       ``` ... ``` completo (incluidas líneas en blanco)
+            table      filas |...| consecutivas
+            list       ítems consecutivos con sus líneas de continuación
+            paragraph  líneas hasta una línea en blanco o el inicio de otro bloque
+        Un salto de página (<!-- page: N -->) dentro de una tabla o lista no la corta.
+    """
+    lines = text.splitlines(keepends=True)
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line))
+
+    def _next_content(j: int) -> int:
+        while j < len(lines) and _is_transparent(lines[j]):
+            j += 1
+        return j
+
+    def _continues_list(line: str) -> bool:
+        return RE_LIST_ITEM.match(line) is not None or line[:1] in (" ", "\t")
+
+    blocks = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        if not stripped:
+            i += 1
+            continue
+
+        start = i
+        if RE_CODE_FENCE.match(line):
+            kind = "code"
+            i += 1
+            while i < len(lines) and not RE_CODE_FENCE.match(lines[i]):
+                i += 1
+            i = min(i + 1, len(lines))  # incluir la valla de cierre
+        elif RE_TABLE_ROW.match(stripped):
+            kind = "table"
+            i += 1
+            while i < len(lines):
+                j = _next_content(i)
+                if j < len(lines) and RE_TABLE_ROW.match(lines[j].strip()):
+                    i = j + 1
+                else:
+                    break
+        elif RE_LIST_ITEM.match(line):
+            kind = "list"
+            i += 1
+            while i < len(lines):
+                if lines[i].strip() and not _is_transparent(lines[i]) \
+                        and not RE_CODE_FENCE.match(lines[i]) \
+                        and not RE_TABLE_ROW.match(lines[i].strip()):
+                    i += 1  # ítem o continuación pegada
+                    continue
+                j = _next_content(i)
+                if j < len(lines) and j > i and _continues_list(lines[j]):
+                    i = j + 1
+                else:
+                    break
+        else:
+            kind = "paragraph"
+            i += 1
+            while i < len(lines):
+                nxt = lines[i]
+                if (not nxt.strip() or RE_CODE_FENCE.match(nxt)
+                        or RE_TABLE_ROW.match(nxt.strip()) or RE_LIST_ITEM.match(nxt)):
+                    break
+                i += 1
+
+        end = starts[i]
+        while end > starts[start] and text[end - 1].isspace():
+            end -= 1
+        blocks.append((starts[start], end, kind))
+    return blocks
+
+
+def _table_cells(row: str) -> list[str]:
+    return [cell.strip() for cell in row.strip().strip("|").split("|")]
+
+
+def serialize_table_rows(table: str) -> list[str]:
+    """
+    large_table_strategy=serialize_rows: cada fila como "Columna: valor; ..."
+    para que cualquier grupo de filas se entienda sin la cabecera.
+    Los marcadores de página se conservan como líneas propias.
+    """
+    header = None
+    rows = []
+    for line in table.splitlines():
+        stripped = line.strip()
+        if not RE_TABLE_ROW.match(stripped):
+            if stripped:
+                rows.append(stripped)
+            continue
+        if RE_TABLE_SEPARATOR.match(stripped):
+            continue
+        if header is None:
+            header = _table_cells(stripped)
+            continue
+        values = _table_cells(stripped)
+        rows.append("; ".join(f"{name}: {value}" if name else value
+                              for name, value in zip(header, values) if value))
+    return rows
+
+
+def _list_items(block: str) -> list[str]:
+    """Ítems de una lista, cada uno con sus líneas de continuación."""
+    items = []
+    for line in block.split("\n"):
+        if RE_LIST_ITEM.match(line) or not items:
+            items.append(line)
+        else:
+            items[-1] += "\n" + line
+    return [item.strip("\n") for item in items if item.strip()]
+
+
+def _group_units(units: list[str], max_tokens: int, counter: TokenCounter,
+                 separator: str = "\n") -> list[str]:
+    """Agrupa unidades consecutivas (filas, ítems) en trozos de hasta max_tokens."""
+    groups, current, total = [], [], 0
+    for unit, tokens in zip(units, counter.count_batch(units)):
+        if current and total + tokens > max_tokens:
+            groups.append(separator.join(current))
+            current, total = [], 0
+        current.append(unit)
+        total += tokens
+    if current:
+        groups.append(separator.join(current))
+    return groups
+
+
+def split_prose(text: str, max_tokens: int, counter: TokenCounter,
+                level: int = 1) -> list[str]:
+    """
+    Trozos consecutivos de hasta max_tokens de un párrafo (o ítem de lista)
+    que no cabe en un chunk: se corta entre frases y, si una frase sola
+    excede, entre palabras (MICRO_SPLIT_LEVELS desde `level`). Cada trozo
+    conserva el texto original entre sus piezas.
+    """
+    pieces = []
+    start = end = None
+    for a, b, tokens in _fit_spans(text, [(0, len(text))], max_tokens, counter, level):
+        if start is not None and counter.count(text[start:b]) > max_tokens:
+            pieces.append(text[start:end])
+            start = None
+        if start is None:
+            start = a
+        end = b
+    if start is not None:
+        pieces.append(text[start:end])
+    return pieces
+
+
+def split_section_blocks(content: str, max_tokens: int, splitting: dict,
+                         counter: TokenCounter) -> list[str]:
+    """
+    Unidades atómicas de una sección demasiado grande para un chunk.
+
+    Según chunking.yml → splitting:
+        preserve_code_blocks  el bloque de código nunca se corta (aunque exceda)
+        preserve_tables       la tabla es una unidad; si excede max_tokens se
+                              serializa por filas (serialize_rows) o se deja
+                              entera (keep_whole)
+        preserve_lists        la lista es una unidad; si excede se corta entre ítems
+    Lo no preservado se divide por líneas en blanco, como un párrafo. Los
+    párrafos e ítems que no caben solos se cortan por frases (split_prose).
+    """
+    preserve = {
+        "code": splitting.get("preserve_code_blocks", True),
+        "table": splitting.get("preserve_tables", True),
+        "list": splitting.get("preserve_lists", True),
+    }
+    def _fit_prose(parts: list[str], level: int = 1) -> list[str]:
+        fitted = []
+        for part, tokens in zip(parts, counter.count_batch(parts)):
+            if tokens > max_tokens:
+                fitted.extend(split_prose(part, max_tokens, counter, level))
+            else:
+                fitted.append(part)
+        return fitted
+
+    units = []
+    for start, end, kind in split_blocks(content):
+        block = content[start:end]
+        if kind == "paragraph" or not preserve[kind]:
+            units.extend(_fit_prose([p for p in block.split("\n\n") if p.strip()]))
+            continue
+        units.append(block)
+        if kind in ("table", "list") and counter.count(block) > max_tokens:
+            if kind == "list":
+                # Ítems multilínea: primero por líneas, luego por frases
+                items = _fit_prose(_list_items(block), level=0)
+                units[-1:] = _group_units(items, max_tokens, counter)
+            elif splitting.get("large_table_strategy", "serialize_rows") == "serialize_rows":
+                units[-1:] = _group_units(serialize_table_rows(block), max_tokens, counter)
+    return units
+
+
+class ChunkAccumulator:
+    """
+    Texto de un chunk en construcción.
+
+    Lleva los tokens, el rango de páginas y si hay texto no vacío de forma
+    incremental, de modo que decidir si cabe otra parte es O(1) y el texto
+    se une una sola vez al emitir el chunk.
+    """
+
+    __slots__ = ("parts", "part_tokens", "length", "token_count", "page_start", "page_end",
+                 "has_text")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.parts: list[str] = []
+        self.part_tokens: list[int] = []
+        self.length = 0
+        self.token_count = 0
+        self.page_start: int | None = None
+        self.page_end: int | None = None
+        self.has_text = False
+
+    def tokens(self) -> int:
+        return max(1, self.token_count)
+
+    def tokens_with(self, tokens: int) -> int:
+        """Tokens si se añadiera una parte de `tokens` tokens."""
+        return max(1, self.token_count + tokens)
+
+    def fits(self, text: str, tokens: int, max_tokens: int, counter: TokenCounter) -> bool:
+        """
+        ¿Cabe `text` sin pasar de max_tokens? La suma por partes no cuenta los
+        separadores ni el redondeo de cada parte: cerca del límite se cuenta
+        el texto unido.
+        """
+        total = self.tokens_with(tokens)
+        if total > max_tokens:
+            return False
+        if not self.length or total + len(self.parts) + 2 <= max_tokens:
+            return True
+        return counter.count(f"{self.text()}\n\n{text}") <= max_tokens
+
+    def append(self, text: str, tokens: int):
+        if self.length:
+            self.parts.append("\n\n")
+            self.length += 2
+        self.parts.append(text)
+        self.part_tokens.append(tokens)
+        self.length += len(text)
+        self.token_count += tokens
+        if text and not text.isspace():
+            self.has_text = True
+        for page in RE_PAGE_MARKER.findall(text):
+            page = int(page)
+            if self.page_start is None or page < self.page_start:
+                self.page_start = page
+            if self.page_end is None or page > self.page_end:
+                self.page_end = page
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def tail(self, max_tokens: int, counter: TokenCounter) -> tuple[str, int] | None:
+        """
+        Final del texto con como máximo `max_tokens` tokens, para solapar con
+        el chunk siguiente: partes completas si caben y, si no, las últimas
+        líneas completas (filas, ítems) o palabras de la última parte. Nunca
+        se solapa un trozo de un bloque de código.
+        """
+        if max_tokens <= 0 or not self.parts:
+            return None
+        texts = self.parts[::2]  # sin los separadores
+        keep, total = 0, 0
+        for tokens in reversed(self.part_tokens):
+            if total + tokens > max_tokens:
+                break
+            keep += 1
+            total += tokens
+        if keep == len(texts):
+            return None  # solaparía el chunk entero
+        if keep:
+            return "\n\n".join(texts[-keep:]), total
+
+        last, last_tokens = texts[-1], self.part_tokens[-1]
+        if "```" in last:
+            return None
+        if "\n" in last:
+            lines = last.split("\n")
+            counts = counter.count_batch(lines)
+            keep, total = 0, 0
+            for tokens in reversed(counts):
+                if total + tokens > max_tokens:
+                    break
+                keep += 1
+                total += tokens
+            text = "\n".join(lines[len(lines) - keep:]).strip() if keep else ""
+        else:
+            start = len(last) - len(last) * max_tokens // max(last_tokens, 1)
+            cut = last.find(" ", start)
+            text = last[cut:].strip() if cut >= 0 else ""
+        return (text, counter.count(text)) if text else None
+
+
+def _new_chunk(doc_id: str, source_file: str, section_path: str, text: str,
+               page_start: int | None, page_end: int | None, tokens: int) -> dict:
+    return {
+        "doc_id": doc_id,
+        "chunk_id": None,  # asignado al final (make_chunk_id)
+        "source_file": source_file,
+        "section_path": section_path,
+        "page_start": page_start,
+        "page_end": page_end,
+        "lang": detect_language(text),
+        "content": text.strip(),
+        "tokens_est": tokens,
+    }
+
+
+def _emit(acc: ChunkAccumulator, doc_id: str, source_file: str, section_path: str) -> dict:
+    return _new_chunk(doc_id, source_file, section_path, acc.text(),
+                      acc.page_start, acc.page_end, acc.tokens())
 
 
 def create_chunks(sections: list[dict], doc_id: str, source_file: str,
-                  config: dict) -> list[dict]:
+                  config: dict, doc_type: str,
+                  tagger: MetadataTagger | None = None,
+                  counter: TokenCounter | None = None,
+                  splitting: dict | None = None) -> list[dict]:
     """
     Crea chunks a partir de secciones, respetando tamaños y reglas de integridad.
+
+    Lineal en el tamaño del documento: los tokens y páginas de cada chunk en
+    construcción se acumulan por partes (ChunkAccumulator). Los tokens se
+    cuentan por lotes con `counter` (tokenizador del embedder o estimación).
+    Las secciones grandes se dividen por bloques Markdown (split_section_blocks)
+    sin cortar tablas, listas ni bloques de código; overlap_tokens solo se
+    aplica entre los trozos de una misma sección dividida, nunca entre
+    secciones distintas (el solape quedaría citado con otra sección).
+    Los metadatos de seguridad salen de una sola pasada del tagger por chunk;
+    los marcos del documento son la unión de los de sus chunks.
     """
     max_tokens = config.get("max_tokens", 900)
     min_tokens = config.get("min_tokens", 300)
     overlap_tokens = config.get("overlap_tokens", 100)
+    if config.get("overlap_percent"):
+        overlap_tokens = max_tokens * config["overlap_percent"] // 100
+    if counter is None:
+        counter = get_token_counter()
+
+    contents = [c for c in (s.get("content", "").strip() for s in sections) if c]
+    section_tokens = dict(zip(contents, counter.count_batch(contents)))
 
     chunks = []
-    buffer_text = ""
+    buffer = ChunkAccumulator()
     buffer_breadcrumb = ""
 
     for section in sections:
@@ -199,134 +514,378 @@ def create_chunks(sections: list[dict], doc_id: str, source_file: str,
             continue
 
         breadcrumb = section.get("breadcrumb", "")
-        tokens = estimate_tokens(content)
+        tokens = section_tokens[content]
 
         # Si el buffer + sección cabe en max_tokens, acumular
-        if buffer_text:
-            combined_tokens = estimate_tokens(buffer_text + "\n\n" + content)
-            if combined_tokens <= max_tokens:
-                buffer_text += "\n\n" + content
+        if buffer.length:
+            if buffer.fits(content, tokens, max_tokens, counter):
+                buffer.append(content, tokens)
                 continue
 
             # Emitir buffer como chunk
-            page_start, page_end = extract_page_numbers(buffer_text)
-            chunk = {
-                "doc_id": doc_id,
-                "chunk_id": str(uuid.uuid4())[:12],
-                "source_file": source_file,
-                "section_path": buffer_breadcrumb,
-                "page_start": page_start,
-                "page_end": page_end,
-                "lang": detect_language(buffer_text),
-                "content": buffer_text.strip(),
-                "tokens_est": estimate_tokens(buffer_text),
-            }
-            chunks.append(chunk)
-            buffer_text = ""
+            chunks.append(_emit(buffer, doc_id, source_file, buffer_breadcrumb))
+            buffer.reset()
 
         # Si la sección es muy pequeña, bufferizar
         if tokens < min_tokens:
-            buffer_text = content
+            buffer.append(content, tokens)
             buffer_breadcrumb = breadcrumb
             continue
 
         # Si la sección cabe en max_tokens, emitir directamente
         if tokens <= max_tokens:
             page_start, page_end = extract_page_numbers(content)
-            chunk = {
-                "doc_id": doc_id,
-                "chunk_id": str(uuid.uuid4())[:12],
-                "source_file": source_file,
-                "section_path": breadcrumb,
-                "page_start": page_start,
-                "page_end": page_end,
-                "lang": detect_language(content),
-                "content": content.strip(),
-                "tokens_est": tokens,
-            }
-            chunks.append(chunk)
+            chunks.append(_new_chunk(doc_id, source_file, breadcrumb, content,
+                                     page_start, page_end, tokens))
         else:
-            # Sección demasiado grande: dividir por párrafos
-            paragraphs = content.split("\n\n")
-            current_chunk_text = ""
-
-            for para in paragraphs:
-                para_tokens = estimate_tokens(para)
-                current_tokens = estimate_tokens(current_chunk_text)
-
-                if current_tokens + para_tokens <= max_tokens:
-                    current_chunk_text += ("\n\n" if current_chunk_text else "") + para
-                else:
-                    if current_chunk_text.strip():
-                        page_start, page_end = extract_page_numbers(current_chunk_text)
-                        chunk = {
-                            "doc_id": doc_id,
-                            "chunk_id": str(uuid.uuid4())[:12],
-                            "source_file": source_file,
-                            "section_path": breadcrumb,
-                            "page_start": page_start,
-                            "page_end": page_end,
-                            "lang": detect_language(current_chunk_text),
-                            "content": current_chunk_text.strip(),
-                            "tokens_est": estimate_tokens(current_chunk_text),
-                        }
-                        chunks.append(chunk)
-
-                    current_chunk_text = para
+            # Sección demasiado grande: dividir por bloques, repitiendo al
+            # inicio de cada trozo ~overlap_tokens del final del anterior
+            current = ChunkAccumulator()
+            paras = split_section_blocks(content, max_tokens, splitting or {}, counter)
+
+            for para, para_tokens in zip(paras, counter.count_batch(paras)):
+                if current.fits(para, para_tokens, max_tokens, counter):
+                    current.append(para, para_tokens)
+                    continue
+                overlap = None
+                if current.has_text:
+                    chunks.append(_emit(current, doc_id, source_file, breadcrumb))
+                    overlap = current.tail(overlap_tokens, counter)
+                current.reset()
+                if overlap and counter.count(f"{overlap[0]}\n\n{para}") <= max_tokens:
+                    current.append(*overlap)
+                current.append(para, para_tokens)
 
             # Último fragmento
-            if current_chunk_text.strip():
-                page_start, page_end = extract_page_numbers(current_chunk_text)
-                chunk = {
-                    "doc_id": doc_id,
-                    "chunk_id": str(uuid.uuid4())[:12],
-                    "source_file": source_file,
-                    "section_path": breadcrumb,
-                    "page_start": page_start,
-                    "page_end": page_end,
-                    "lang": detect_language(current_chunk_text),
-                    "content": current_chunk_text.strip(),
-                    "tokens_est": estimate_tokens(current_chunk_text),
-                }
-                chunks.append(chunk)
+            if current.has_text:
+                chunks.append(_emit(current, doc_id, source_file, breadcrumb))
 
     # Emitir buffer restante
-    if buffer_text.strip():
-        page_start, page_end = extract_page_numbers(buffer_text)
-        chunk = {
-            "doc_id": doc_id,
-            "chunk_id": str(uuid.uuid4())[:12],
-            "source_file": source_file,
-            "section_path": buffer_breadcrumb,
-            "page_start": page_start,
-            "page_end": page_end,
-            "lang": detect_language(buffer_text),
-            "content": buffer_text.strip(),
-            "tokens_est": estimate_tokens(buffer_text),
-        }
-        chunks.append(chunk)
+    if buffer.has_text:
+        chunks.append(_emit(buffer, doc_id, source_file, buffer_breadcrumb))
 
     # Enriquecer con metadatos
-    full_text = "\n".join(s.get("content", "") for s in sections)
-    doc_type = detect_doc_type(full_text, source_file)
-    frameworks = detect_frameworks(full_text)
-
+    if tagger is None:
+        tagger = get_tagger()
+    doc_frameworks = []
     for chunk in chunks:
+        frameworks, chunk["security_tags"] = tagger.tag(chunk["content"])
+        doc_frameworks.extend(frameworks)
+    frameworks = tagger.order_frameworks(doc_frameworks)
+
+    for ordinal, chunk in enumerate(chunks):
+        chunk["chunk_id"] = make_chunk_id(doc_id, chunk["section_path"], ordinal,
+                                          chunk["content"])
         chunk["doc_type"] = doc_type
-        chunk["frameworks"] = frameworks if frameworks else []
-        chunk["security_tags"] = extract_security_tags(chunk["content"])
+        chunk["frameworks"] = frameworks
         chunk["version"] = "1.0"
 
     return chunks
 
 
-def main():
+def _fit_spans(text: str, spans: list[tuple[int, int]], limit: int,
+               counter: TokenCounter, level: int = 0) -> list[tuple[int, int, int]]:
+    """
+    Subdivide los tramos [inicio, fin) de `text` que superan `limit` tokens
+    por líneas, frases y palabras (MICRO_SPLIT_LEVELS, desde `level`).
+
+    Returns:
+        Tramos (inicio, fin, tokens) en orden.
+    """
+    result = []
+    for (start, end), tokens in zip(spans, counter.count_batch([text[a:b] for a, b in spans])):
+        if tokens <= limit or level == len(MICRO_SPLIT_LEVELS):
+            result.append((start, end, tokens))
+            continue
+        pieces, pos = [], start
+        for m in MICRO_SPLIT_LEVELS[level].finditer(text, start, end):
+            if m.start() > pos:
+                pieces.append((pos, m.start()))
+            pos = m.end()
+        if pos < end:
+            pieces.append((pos, end))
+        result.extend(_fit_spans(text, pieces, limit, counter, level + 1))
+    return result
+
+
+def create_micro_chunks(parents: list[dict], micro_tokens: int, counter: TokenCounter,
+                        tagger: MetadataTagger) -> list[dict]:
+    """
+    Small-to-big: divide cada chunk padre en micro-chunks de como máximo
+    `micro_tokens` tokens, enlazados por `parent_id`.
+
+    Los micro-chunks son trozos literales del padre (sin solapamiento) y son
+    lo que se indexa; el padre es lo que se entrega al LLM.
+
+    Returns:
+        Padres y micro-chunks intercalados (cada padre seguido de los suyos).
+    """
+    chunks = []
+    for parent in parents:
+        parent["chunk_type"] = "parent"
+        chunks.append(parent)
+        content = parent["content"]
+        markers = [(m.start(), int(m.group(1))) for m in RE_PAGE_MARKER.finditer(content)]
+        spans = []
+        for start, end, kind in split_blocks(content):
+            spans.extend(_fit_spans(content, [(start, end)], micro_tokens, counter,
+                                    1 if kind == "paragraph" else 0))
+
+        groups, group, total, last_end = [], None, 0, 0
+        for start, end, tokens in spans:
+            if group is not None and total + tokens > micro_tokens:
+                groups.append((group, last_end, total))
+                group, total = None, 0
+            if group is None:
+                group = start
+            total += tokens
+            last_end = end
+        if group is not None:
+            groups.append((group, last_end, total))
+
+        for ordinal, (start, end, tokens) in enumerate(groups):
+            text = content[start:end].strip()
+            # Página vigente al inicio del tramo + marcadores dentro del tramo
+            before = [page for pos, page in markers if pos < start]
+            pages = before[-1:] + [page for pos, page in markers if start <= pos < end]
+            child = {
+                "doc_id": parent["doc_id"],
+                "chunk_id": make_chunk_id(parent["chunk_id"], parent["section_path"],
+                                          ordinal, text),
+                "source_file": parent["source_file"],
+                "section_path": parent["section_path"],
+                "page_start": min(pages) if pages else parent["page_start"],
+                "page_end": max(pages) if pages else parent["page_end"],
+                "lang": parent["lang"],
+                "content": text,
+                "tokens_est": max(1, tokens),
+                "security_tags": tagger.tag(text)[1],
+                "doc_type": parent["doc_type"],
+                "frameworks": parent["frameworks"],
+                "version": parent["version"],
+                "chunk_type": "child",
+                "parent_id": parent["chunk_id"],
+            }
+            chunks.append(child)
+    return chunks
+
+
+class PreviousChunksReader:
+    """
+    Lectura en streaming del chunks.jsonl anterior, documento a documento.
+
+    El archivo se escribe en el orden de los Markdown de entrada, así que
+    basta avanzar en paralelo (merge) para recuperar los chunks de un
+    documento sin cargar el corpus entero en memoria. Los documentos que ya
+    no se piden (eliminados o rechunkeados) se saltan.
+    """
+
+    def __init__(self, path: Path | None):
+        self._file = open(path, "r", encoding="utf-8") if path and path.exists() else None
+        self._pending: tuple[str, dict] | None = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._file:
+            self._file.close()
+        return False
+
+    def _next(self) -> tuple[str, dict] | None:
+        if self._pending is not None:
+            item, self._pending = self._pending, None
+            return item
+        if self._file is None:
+            return None
+        for line in self._file:
+            if line.strip():
+                return line, json.loads(line)
+        return None
+
+    def take(self, source_file: str) -> list[tuple[str, dict]] | None:
+        """
+        Líneas (texto JSON, chunk) del documento, o None si no está en el
+        archivo anterior a partir de la posición actual.
+        """
+        found = []
+        while (item := self._next()) is not None:
+            name = item[1]["source_file"]
+            if name < source_file:
+                continue
+            if name > source_file:
+                self._pending = item
+                break
+            found.append(item)
+        return found or None
+
+
+class ChunkQA:
+    """Métricas QA de chunks acumuladas al vuelo (sin retener los chunks)."""
+
+    def __init__(self, counter: TokenCounter | None = None):
+        self.counter = counter
+        self.total_chunks = 0
+        self.total_tokens = 0
+        self.min_tokens = None
+        self.max_tokens = None
+        self.over_window = 0
+        self.parent_chunks = 0
+        self.by_doc_type: dict[str, int] = {}
+        self.by_language: dict[str, int] = {}
+
+    def add(self, chunk: dict):
+        if chunk.get("chunk_type") == "parent":
+            # Solo contexto para el LLM: las métricas son de lo que se indexa
+            self.parent_chunks += 1
+            return
+        tokens = chunk["tokens_est"]
+        self.total_chunks += 1
+        self.total_tokens += tokens
+        self.min_tokens = tokens if self.min_tokens is None else min(self.min_tokens, tokens)
+        self.max_tokens = tokens if self.max_tokens is None else max(self.max_tokens, tokens)
+        if self.counter and self.counter.window and tokens > self.counter.window:
+            self.over_window += 1
+        dt = chunk.get("doc_type", "unknown")
+        self.by_doc_type[dt] = self.by_doc_type.get(dt, 0) + 1
+        lang = chunk.get("lang", "unknown")
+        self.by_language[lang] = self.by_language.get(lang, 0) + 1
+
+    def to_dict(self, files_processed: int) -> dict:
+        return {
+            "total_chunks": self.total_chunks,
+            "parent_chunks": self.parent_chunks,
+            "files_processed": files_processed,
+            "avg_tokens": round(self.total_tokens / max(self.total_chunks, 1)),
+            "min_tokens": self.min_tokens or 0,
+            "max_tokens": self.max_tokens or 0,
+            "by_doc_type": self.by_doc_type,
+            "by_language": self.by_language,
+            "tokenizer": self.counter.name if self.counter else "estimate",
+            "embedder_window": self.counter.window if self.counter else None,
+            "over_embedder_window": self.over_window,
+        }
+
+
+def _chunk_document(task: tuple) -> tuple[list[dict], str]:
+    """Tarea de worker: chunkea un Markdown limpio (sin imprimir)."""
+    md_file, chunking_config = task
+    with open(md_file, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    doc_id = sha256_text(md_file.name)[:16]
+    tagger = get_tagger(chunking_config)
+    doc_type = tagger.doc_type(text, md_file.name)
+    tokenizer_config = chunking_config.get("tokenizer") or {}
+    counter = get_token_counter(tokenizer_config)
+
+    # Seleccionar config por tipo de documento
+    defaults = chunking_config.get("defaults", {})
+    type_config = chunking_config.get("by_doc_type", {}).get(doc_type, defaults)
+    fit_window = tokenizer_config.get("fit_embedder_window", False) and counter.window
+
+    # Small-to-big: los chunks normales pasan a ser padres de parent_chunk_tokens
+    # y lo que se indexa (y se ajusta a la ventana) son sus micro-chunks
+    small_to_big = chunking_config.get("small_to_big") or {}
+    if small_to_big.get("enabled"):
+        max_tokens = small_to_big.get("parent_chunk_tokens", 700)
+        micro_tokens = small_to_big.get("micro_chunk_tokens", 160)
+        if fit_window:
+            micro_tokens = min(micro_tokens, counter.window)
+    else:
+        max_tokens = type_config.get("max_tokens", 900)
+        if fit_window and counter.window < max_tokens:
+            # El solape conserva su proporción respecto al tamaño configurado
+            overlap = type_config.get("overlap_tokens", 100) * counter.window // max_tokens
+            type_config = {**type_config, "overlap_tokens": overlap}
+            max_tokens = counter.window
+    type_config = {**type_config, "max_tokens": max_tokens,
+                   "min_tokens": min(type_config.get("min_tokens", 300), max_tokens)}
+
+    sections = split_by_headers(text)
+    chunks = create_chunks(sections, doc_id, md_file.name, type_config, doc_type,
+                           tagger, counter, chunking_config.get("splitting"))
+    if small_to_big.get("enabled"):
+        chunks = create_micro_chunks(chunks, micro_tokens, counter, tagger)
+    return chunks, doc_type
+
+
+def resolve_tokenizer(chunking_config: dict, embeddings_config: dict) -> TokenCounter:
+    """
+    Completa chunking_config["tokenizer"] con el modelo de embeddings y
+    comprueba que su tokenizador carga. Si no está disponible se cae a la
+    estimación antes de lanzar los workers (y el cambio invalida los chunks
+    vía rules_hash).
+    """
+    tokenizer_config = dict(chunking_config.get("tokenizer") or {})
+    tokenizer_config.setdefault("backend", "embedder")
+    tokenizer_config["max_seq_length"] = embeddings_config.get("max_seq_length")
+    if tokenizer_config["backend"] == "embedder":
+        tokenizer_config["model_name"] = embeddings_config.get(
+            "model_name", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+        counter = get_token_counter(tokenizer_config)
+        if not counter.exact:
+            print("  [WARN] Tokenizador del embedder no disponible (transformers). "
+                  "Se estima 1 token ≈ 4 caracteres.")
+            tokenizer_config["backend"] = "estimate"
+            tokenizer_config.pop("model_name")
+    chunking_config["tokenizer"] = tokenizer_config
+
+    counter = get_token_counter(tokenizer_config)
+    window = f", ventana del embedder: {counter.window}" if counter.window else ""
+    print(f"  Tokenizador: {counter.name}{window}")
+
+    # Tamaños configurados que el embedder truncará (fit_embedder_window es opcional)
+    if counter.window and not tokenizer_config.get("fit_embedder_window"):
+        small_to_big = chunking_config.get("small_to_big") or {}
+        if small_to_big.get("enabled"):
+            key, largest = "micro_chunk_tokens", small_to_big.get("micro_chunk_tokens", 160)
+            remedy = "Reduzca micro_chunk_tokens"
+        else:
+            type_configs = [chunking_config.get("defaults", {}),
+                            *(chunking_config.get("by_doc_type") or {}).values()]
+            key, largest = "max_tokens", max(c.get("max_tokens", 900) for c in type_configs)
+            remedy = "Active small_to_big"
+        if largest > counter.window:
+            print(f"  [WARN] {key}={largest} supera la ventana del embedder "
+                  f"({counter.window} tokens): el texto que la exceda no se indexa por "
+                  f"embeddings. {remedy} o tokenizer.fit_embedder_window en chunking.yml.")
+    return counter
+
+
+def run_chunking(tasks: list[tuple], workers: int):
+    """
+    Chunkea documentos en un pool de procesos.
+
+    Returns:
+        Iterador de (chunks, doc_type) en el mismo orden que `tasks`.
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        yield from map(_chunk_document, tasks)
+        return
+    with multiprocessing.Pool(processes=min(workers, len(tasks))) as pool:
+        yield from pool.imap(_chunk_document, tasks)
+
+
+def main(full: bool = False, workers: int | None = None):
+    """
+    Chunkea los Markdown limpios, reutilizando los chunks de documentos sin cambios.
+
+    Los documentos pendientes se reparten en un pool de procesos y los chunks
+    se escriben en streaming a chunks.jsonl, en el orden de los archivos.
+
+    Args:
+        full: Si True, rechunkea todos los documentos ignorando el ledger.
+        workers: Procesos en paralelo (None = chunking.workers o nº de CPUs).
+    """
     print_header("CHUNKING DE MARKDOWN")
     require_pdfs("chunking")
 
     config = load_config()
+    if workers is None:
+        workers = config.get("chunking", {}).get("workers") or os.cpu_count() or 1
     chunking_config = load_chunking_config()
-    defaults = chunking_config.get("defaults", {})
+    counter = resolve_tokenizer(chunking_config, config.get("embeddings", {}))
 
     input_dir = PROJECT_ROOT / config["paths"]["clean_md"]
     output_dir = PROJECT_ROOT / config["paths"]["chunks"]
@@ -339,61 +898,103 @@ def main():
         print("  Ejecute primero: make clean")
         return
 
-    print(f"  Procesando {len(md_files)} archivo(s)...\n")
-
-    all_chunks = []
     chunks_output = output_dir / "chunks.jsonl"
+    tmp_output = chunks_output.with_name(chunks_output.name + ".tmp")
 
-    for md_file in md_files:
-        with open(md_file, "r", encoding="utf-8") as f:
-            text = f.read()
-
-        doc_id = sha256_text(md_file.name)[:16]
-        doc_type = detect_doc_type(text, md_file.name)
-
-        # Seleccionar config por tipo de documento
-        type_config = chunking_config.get("by_doc_type", {}).get(doc_type, defaults)
-
-        sections = split_by_headers(text)
-        chunks = create_chunks(sections, doc_id, md_file.name, type_config)
+    # Incremental: reutilizar chunks de documentos cuyo Markdown limpio
+    # y configuración de chunking no han cambiado
+    ledger = PipelineLedger()
+    rules_hash = config_hash({"version": CHUNKER_VERSION, "config": chunking_config})
+    plan, tasks = [], []
+    near_duplicates = 0
 
-        print(f"  📦 {md_file.name}: {len(chunks)} chunks "
-              f"(tipo: {doc_type}, tokens: "
-              f"{sum(c['tokens_est'] for c in chunks)})")
-
-        all_chunks.extend(chunks)
-
-    # Escribir JSONL
-    with open(chunks_output, "w", encoding="utf-8") as f:
-        for chunk in all_chunks:
-            f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+    for md_file in md_files:
+        entry = ledger.doc(md_file.stem)
+        if entry.get("near_duplicate_of"):
+            # Marcado por extract (dedup.near_duplicates): no se indexa dos veces
+            for key in ("chunked_from", "chunking_rules", "chunk_ids"):
+                entry.pop(key, None)
+            near_duplicates += 1
+            continue
 
-    print(f"\n  Total: {len(all_chunks)} chunks → {chunks_output.name}")
+        input_hash = sha256_file(md_file)
+        reuse = (not full and entry.get("chunked_from") == input_hash
+                 and entry.get("chunking_rules") == rules_hash)
+        plan.append((md_file, input_hash, reuse))
+        if not reuse:
+            tasks.append((md_file, chunking_config))
+
+    print(f"  Procesando {len(tasks)} archivo(s) ({len(plan) - len(tasks)} sin cambios, "
+          f"workers={min(workers, max(len(tasks), 1))})...\n")
+
+    qa = ChunkQA(counter)
+    seen_ids: set[str] = set()
+    duplicates = []
+    reused = 0
+
+    with PreviousChunksReader(None if full else chunks_output) as previous, \
+            open(tmp_output, "w", encoding="utf-8") as out:
+        results = run_chunking(tasks, workers)
+        for md_file, input_hash, reuse in plan:
+            lines = previous.take(md_file.name) if reuse else None
+            if lines is not None:
+                reused += 1
+            else:
+                # Pendiente (o ausente del chunks.jsonl anterior): chunkear
+                if reuse:
+                    chunks, doc_type = _chunk_document((md_file, chunking_config))
+                else:
+                    chunks, doc_type = next(results)
+                lines = [(json.dumps(c, ensure_ascii=False) + "\n", c) for c in chunks]
+
+                print(f"  📦 {md_file.name}: {len(chunks)} chunks "
+                      f"(tipo: {doc_type}, tokens: "
+                      f"{sum(c['tokens_est'] for c in chunks)})")
+
+                entry = ledger.doc(md_file.stem)
+                entry["chunked_from"] = input_hash
+                entry["chunking_rules"] = rules_hash
+                entry["chunk_ids"] = [c["chunk_id"] for c in chunks]
+
+            for line, chunk in lines:
+                if chunk["chunk_id"] in seen_ids:
+                    duplicates.append(chunk["chunk_id"])
+                seen_ids.add(chunk["chunk_id"])
+                qa.add(chunk)
+                out.write(line)
+
+    if reused:
+        print(f"  ♻ {reused} documento(s) sin cambios: chunks reutilizados")
+    if near_duplicates:
+        print(f"  ≈ {near_duplicates} documento(s) casi duplicado(s) omitido(s)")
+    if qa.over_window:
+        print(f"  [WARN] {qa.over_window} chunk(s) superan la ventana del embedder "
+              f"({counter.window} tokens) y se truncarán al indexar. "
+              "Active tokenizer.fit_embedder_window o small_to_big en chunking.yml.")
+
+    if duplicates:
+        tmp_output.unlink(missing_ok=True)
+        print(f"[ERROR] Colisión de chunk_id: {', '.join(sorted(set(duplicates))[:5])}")
+        print("  Colisión de hash truncado: no se escribe chunks.jsonl.")
+        sys.exit(1)
+
+    os.replace(tmp_output, chunks_output)
+    print(f"\n  Total: {qa.total_chunks} chunks → {chunks_output.name}")
+    ledger.save()
+    save_hash_cache()
 
     # Escribir métricas QA
     qa_output = output_dir / "chunks_qa.json"
-    qa_data = {
-        "total_chunks": len(all_chunks),
-        "files_processed": len(md_files),
-        "avg_tokens": round(sum(c["tokens_est"] for c in all_chunks) / max(len(all_chunks), 1)),
-        "min_tokens": min((c["tokens_est"] for c in all_chunks), default=0),
-        "max_tokens": max((c["tokens_est"] for c in all_chunks), default=0),
-        "by_doc_type": {},
-        "by_language": {},
-    }
-
-    for chunk in all_chunks:
-        dt = chunk.get("doc_type", "unknown")
-        qa_data["by_doc_type"][dt] = qa_data["by_doc_type"].get(dt, 0) + 1
-        lang = chunk.get("lang", "unknown")
-        qa_data["by_language"][lang] = qa_data["by_language"].get(lang, 0) + 1
-
     with open(qa_output, "w", encoding="utf-8") as f:
-        json.dump(qa_data, f, indent=2, ensure_ascii=False)
+        json.dump(qa.to_dict(len(md_files)), f, indent=2, ensure_ascii=False)
 
     print(f"  Métricas QA → {qa_output.name}")
     print("  Siguiente paso: make index")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Chunking de Markdown")
+    parser.add_argument("--full", action="store_true")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    main(full=args.full, workers=args.workers)
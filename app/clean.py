@@ -9,80 +9,262 @@ Aplica reglas anti-ruido (§4.1) al Markdown extraído:
 - Repara guiones de salto de línea
 - Preserva bloques de código, rutas, CVEs, comandos (§4.2)
 
+Es incremental (solo limpia archivos cuyo hash de entrada o versión de
+reglas cambió) y reparte los archivos pendientes en un pool de procesos.
+
 Uso:
-    python -m app.clean
+    python -m app.clean [--full] [--workers N]
     make clean
 """
 
+import argparse
+import multiprocessing
+import os
 import re
-import sys
 from pathlib import Path
 from collections import Counter
 
+from app.ledger import PipelineLedger, config_hash
 from app.utils import (
     load_config,
     require_pdfs,
+    register_file_hash,
+    save_hash_cache,
+    sha256_file,
+    HashingWriter,
     ensure_dir,
     print_header,
     PROJECT_ROOT,
 )
 
+# Incrementar al cambiar cualquier regla de limpieza: invalida las salidas previas
+CLEANER_VERSION = 2
+
 
-# ── Patrones anti-ruido ────────────────────────────────────
+# ── Patrones anti-ruido (aplicados línea a línea) ──────────
 
 # Dot leaders: "CAPÍTULO 3 .................................. 45"
-RE_DOT_LEADERS = re.compile(
-    r"^.*?\.{4,}\s*\d*\s*$", re.MULTILINE
-)
+# El grupo indica si la línea termina en número de página.
+RE_DOT_LEADER_LINE = re.compile(r".*\.{4,}\s*(\d*)\s*")
 
 # Secuencias de espacios inútiles (más de 3 espacios seguidos)
 RE_EXCESS_SPACES = re.compile(r"[ \t]{4,}")
 
-# Múltiples líneas en blanco (más de 2)
-RE_EXCESS_NEWLINES = re.compile(r"\n{4,}")
+# Línea con solo un número (tras un dot leader se absorbe con cualquier longitud)
+RE_NUMBER_LINE = re.compile(r"\s*\d+\s*")
 
-# Guiones de salto de línea: "imple-\nmentación" → "implementación"
-RE_HYPHEN_BREAK = re.compile(r"(\w)-\n(\w)")
+# Numeración de página suelta: solo un número de hasta 4 cifras en una línea
+RE_PAGE_NUMBER_LINE = re.compile(r"\s*\d{1,4}\s*")
+
+# Carácter de palabra para reparar "imple-\nmentación" → "implementación"
+RE_WORD_CHAR = re.compile(r"\w")
 
 # Líneas que son solo espacios/tabs
-RE_BLANK_LINES = re.compile(r"^[ \t]+$", re.MULTILINE)
+RE_BLANK_LINE = re.compile(r"[ \t]+")
+
+
+def _is_blank(line: str) -> bool:
+    return not line or line.isspace()
+
+
+def _is_repeat_candidate(stripped: str) -> bool:
+    # Solo líneas no vacías y que no sean headers Markdown ni marcadores
+    return bool(stripped) and not stripped.startswith("#") and not stripped.startswith("<!--")
+
+
+# ── Motor de limpieza por líneas ───────────────────────────
+#
+# Cada regla es un generador sobre líneas; encadenados recorren el documento
+# una sola vez (más un recuento previo para el conjunto de líneas repetidas).
+# Reproducen exactamente la salida y las métricas de las antiguas
+# sustituciones multilínea sobre el texto completo, incluidas sus
+# particularidades: un dot leader o un número de página se llevan consigo
+# las líneas en blanco contiguas y dejan una única línea vacía, y
+# repeated_lines_removed cuenta también las apariciones de cada línea
+# repetida como subcadena de otras (``_count_repeated``). Solo si una línea
+# repetida aparece al final de otra más larga se aplica la sustitución
+# antigua sobre el texto completo (``_replace_repeated``).
+
+
+def _skip_blank(lines: list[str], k: int) -> int:
+    while k < len(lines) and _is_blank(lines[k]):
+        k += 1
+    return k
+
+
+def _drop_dot_leaders(lines: list[str], metrics: dict) -> list[str]:
+    """Regla 1: dot leaders (y el número de página de la línea siguiente, si lo hay)."""
+    out = []
+    i, n = 0, len(lines)
+    while i < n:
+        m = RE_DOT_LEADER_LINE.fullmatch(lines[i])
+        if not m:
+            out.append(lines[i])
+            i += 1
+            continue
+        metrics["dot_leaders_removed"] += 1
+        k = _skip_blank(lines, i + 1)
+        if k == n:
+            end = n
+        elif not m.group(1) and RE_NUMBER_LINE.fullmatch(lines[k]):
+            after = _skip_blank(lines, k + 1)
+            end = n if after == n else after
+        else:
+            end = k
+        out.append("")
+        i = end
+    return out
+
+
+def _count_repeated(lines: list[str], repeated: list[str]) -> int | None:
+    """
+    Recuento de ``repeated_lines_removed`` idéntico al de las antiguas
+    sustituciones: para cada línea repetida, en orden, ``text.count`` sobre
+    el texto del que ya se quitaron las anteriores. Cuenta también las
+    apariciones como subcadena de otras líneas (p. ej. "3" dentro de
+    ``<!-- page: 3 -->``).
 
-# Numeración de página suelta: solo un número en una línea
-RE_PAGE_NUMBER = re.compile(r"^\s*\d{1,4}\s*$", re.MULTILINE)
+    Returns:
+        El recuento, o None si alguna línea repetida aparece al final de
+        otra línea más larga: ahí ``text.replace(línea + "\\n")`` no equivale
+        a quitar líneas completas y hay que usar ``_replace_repeated``.
+    """
+    # Solo las líneas que contienen alguna repetida necesitan recuento propio
+    pattern = re.compile("|".join(map(re.escape, sorted(repeated, key=len, reverse=True))))
+    order = {line: k for k, line in enumerate(repeated)}
+    last = len(lines) - 1
+    multiplicity = Counter(lines[:last])
+
+    total = 0
+    for line in set(lines):
+        if not pattern.search(line):
+            continue
+        occurrences = [(k, line.count(r)) for k, r in enumerate(repeated) if r in line]
+        if any(line.endswith(repeated[k]) and line[:-len(repeated[k])].strip()
+               for k, _ in occurrences):
+            return None
+        # Una línea completa repetida deja de contar para las que van detrás
+        stripped = line.strip()
+        removed_at = order.get(stripped) if line.endswith(stripped) else None
+        in_text = sum(n for k, n in occurrences if removed_at is None or k <= removed_at)
+        total += in_text * multiplicity[line]
+        if line == lines[last]:
+            total += sum(n for _, n in occurrences)  # sin salto: nunca se elimina
+    return total
 
 
-def detect_repeated_headers_footers(text: str, threshold: int = 3) -> list[str]:
-    """
-    Detecta líneas que se repiten demasiadas veces (cabeceras/pies).
+def _replace_repeated(lines: list[str], repeated: list[str], metrics: dict) -> list[str]:
+    """Regla 2 con las sustituciones antiguas sobre el texto completo (caso raro)."""
+    text = "\n".join(lines)
+    for line in repeated:
+        metrics["repeated_lines_removed"] += text.count(line)
+        text = text.replace(line + "\n", "")
+    return text.split("\n")
 
-    Args:
-        text: Texto completo del documento.
-        threshold: Número mínimo de repeticiones para considerar ruido.
 
-    Returns:
-        Lista de líneas repetitivas a eliminar.
+def _drop_repeated(lines: list[str], repeated: set[str]):
     """
-    lines = text.split("\n")
-    counter = Counter()
+    Regla 2: cabeceras/pies repetidos (el recuento es ``_count_repeated``).
 
-    for line in lines:
+    Se elimina la línea y su salto; si la línea tenía sangría, la sangría
+    queda unida a la siguiente. Con espacios finales, o en la última línea
+    (sin salto), no se elimina.
+    """
+    carry = ""
+    last = len(lines) - 1
+    for idx, line in enumerate(lines):
+        if carry:
+            line, carry = carry + line, ""
         stripped = line.strip()
-        # Solo contar líneas no vacías y que no sean headers Markdown
-        if stripped and not stripped.startswith("#") and not stripped.startswith("<!--"):
-            counter[stripped] += 1
-
-    # Líneas que aparecen más veces que el umbral
-    repeated = [line for line, count in counter.items() if count >= threshold]
-    return repeated
+        if stripped in repeated and idx < last and line.endswith(stripped):
+            carry = line[:len(line) - len(stripped)]
+            continue
+        yield line
 
 
-def is_code_block(lines: list[str], idx: int) -> bool:
-    """Determina si la línea está dentro de un bloque de código."""
+def _join_hyphen_breaks(lines, metrics: dict):
+    """Regla 3: une palabras partidas con guion al final de línea."""
+    current = None
+    consumed = -1  # índice del último carácter ya usado por una unión previa
+    for line in lines:
+        if current is None:
+            current = line
+            continue
+        if (len(current) - 2 > consumed and current.endswith("-")
+                and line and RE_WORD_CHAR.match(current[-2]) and RE_WORD_CHAR.match(line[0])):
+            consumed = len(current) - 1
+            current = current[:-1] + line
+            metrics["hyphen_breaks_fixed"] += 1
+            continue
+        yield current
+        current, consumed = line, -1
+    if current is not None:
+        yield current
+
+
+def _collapse_spaces(lines, metrics: dict):
+    """Reglas 4 y 5: espacios excesivos fuera de código y líneas solo de espacios."""
     in_code = False
-    for i in range(idx):
-        if lines[i].strip().startswith("```"):
+    for line in lines:
+        if line.strip().startswith("```"):
             in_code = not in_code
-    return in_code
+        if not in_code:
+            new_line = RE_EXCESS_SPACES.sub(" ", line)
+            if new_line != line:
+                metrics["excess_spaces_collapsed"] += 1
+            line = new_line
+        if RE_BLANK_LINE.fullmatch(line):
+            line = ""
+        yield line
+
+
+def _drop_page_numbers(lines):
+    """
+    Regla 6: números de página sueltos.
+
+    Cada número se lleva las líneas en blanco que lo rodean y deja una línea
+    vacía. Dos números seguidos comparten esa línea vacía solo si entre ellos
+    queda una línea totalmente vacía (comportamiento del antiguo `\\s*` multilínea).
+    """
+    run = []          # líneas en blanco pendientes
+    in_match = False  # tras un número, absorbiendo las líneas en blanco siguientes
+    for line in lines:
+        if _is_blank(line):
+            run.append(line)
+            continue
+        is_number = RE_PAGE_NUMBER_LINE.fullmatch(line) is not None
+        if in_match:
+            if is_number and run and run[-1] == "":
+                run = []
+                continue
+            yield ""
+            run, in_match = [], is_number
+            if not is_number:
+                yield line
+            continue
+        if is_number:
+            run, in_match = [], True
+            continue
+        yield from run
+        run = []
+        yield line
+    if in_match:
+        yield ""
+    else:
+        yield from run
+
+
+def _collapse_blank_lines(lines):
+    """Regla 7: como máximo dos líneas vacías seguidas."""
+    empty = 0
+    for line in lines:
+        if line == "":
+            empty += 1
+            if empty > 2:
+                continue
+        else:
+            empty = 0
+        yield line
 
 
 def clean_markdown(text: str) -> tuple[str, dict]:
@@ -101,49 +283,26 @@ def clean_markdown(text: str) -> tuple[str, dict]:
         "excess_spaces_collapsed": 0,
     }
 
-    # 1. Eliminar dot leaders
-    matches = RE_DOT_LEADERS.findall(text)
-    metrics["dot_leaders_removed"] = len(matches)
-    text = RE_DOT_LEADERS.sub("", text)
-
-    # 2. Detectar y eliminar headers/footers repetitivos
-    repeated = detect_repeated_headers_footers(text)
-    for line in repeated:
-        count_before = text.count(line)
-        text = text.replace(line + "\n", "")
-        metrics["repeated_lines_removed"] += count_before
-
-    # 3. Reparar guiones de salto de línea
-    fixed = RE_HYPHEN_BREAK.findall(text)
-    metrics["hyphen_breaks_fixed"] = len(fixed)
-    text = RE_HYPHEN_BREAK.sub(r"\1\2", text)
-
-    # 4. Colapsar espacios excesivos (fuera de bloques de código)
-    lines = text.split("\n")
-    cleaned_lines = []
-    in_code = False
-    for line in lines:
-        if line.strip().startswith("```"):
-            in_code = not in_code
-        if not in_code:
-            new_line = RE_EXCESS_SPACES.sub(" ", line)
-            if new_line != line:
-                metrics["excess_spaces_collapsed"] += 1
-            line = new_line
-        cleaned_lines.append(line)
-    text = "\n".join(cleaned_lines)
-
-    # 5. Limpiar líneas que son solo espacios
-    text = RE_BLANK_LINES.sub("", text)
-
-    # 6. Eliminar números de página sueltos
-    text = RE_PAGE_NUMBER.sub("", text)
-
-    # 7. Colapsar saltos de línea excesivos
-    text = RE_EXCESS_NEWLINES.sub("\n\n\n", text)
+    # 1. Dot leaders; el conjunto de líneas repetidas se calcula sobre su salida
+    lines = _drop_dot_leaders(text.split("\n"), metrics)
+    counter = Counter(stripped for stripped in (line.strip() for line in lines)
+                      if _is_repeat_candidate(stripped))
+    repeated = [line for line, count in counter.items() if count >= 3]
+
+    # 2-7. Resto de reglas en una sola pasada encadenada
+    removed = _count_repeated(lines, repeated) if repeated else 0
+    if removed is None:
+        stream = _replace_repeated(lines, repeated, metrics)
+    else:
+        metrics["repeated_lines_removed"] = removed
+        stream = _drop_repeated(lines, set(repeated))
+    stream = _join_hyphen_breaks(stream, metrics)
+    stream = _collapse_spaces(stream, metrics)
+    stream = _drop_page_numbers(stream)
+    stream = _collapse_blank_lines(stream)
 
     # 8. Trim final
-    text = text.strip() + "\n"
+    text = "\n".join(stream).strip() + "\n"
 
     metrics["clean_chars"] = len(text)
     metrics["reduction_percent"] = round(
@@ -153,11 +312,49 @@ def clean_markdown(text: str) -> tuple[str, dict]:
     return text, metrics
 
 
-def main():
+def _clean_file(task: tuple) -> dict:
+    """Tarea de worker: limpia un archivo y escribe la salida (sin imprimir)."""
+    md_file, output_file = task
+    with open(md_file, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    clean_text, metrics = clean_markdown(text)
+    metrics["file"] = md_file.name
+
+    with HashingWriter(output_file) as writer:
+        writer.write(clean_text)
+    metrics["output_hash"] = writer.hexdigest()
+    return metrics
+
+
+def run_cleaning(tasks: list[tuple], workers: int):
+    """
+    Limpia los archivos en un pool de procesos.
+
+    Returns:
+        Iterador de métricas en el mismo orden que `tasks`.
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        yield from map(_clean_file, tasks)
+        return
+    with multiprocessing.Pool(processes=min(workers, len(tasks))) as pool:
+        yield from pool.imap(_clean_file, tasks)
+
+
+def main(full: bool = False, workers: int | None = None):
+    """
+    Limpia los Markdown extraídos nuevos o modificados (según el ledger).
+
+    Args:
+        full: Si True, limpia todos los archivos ignorando el ledger.
+        workers: Procesos en paralelo (None = cleaning.workers o nº de CPUs).
+    """
     print_header("LIMPIEZA DE MARKDOWN")
     require_pdfs("limpieza")
 
     config = load_config()
+    if workers is None:
+        workers = config.get("cleaning", {}).get("workers") or os.cpu_count() or 1
     input_dir = PROJECT_ROOT / config["paths"]["extracted_md"]
     output_dir = PROJECT_ROOT / config["paths"]["clean_md"]
     ensure_dir(output_dir)
@@ -169,31 +366,56 @@ def main():
         print("  Ejecute primero: make extract")
         return
 
-    print(f"  Procesando {len(md_files)} archivo(s)...\n")
-
-    all_metrics = []
+    ledger = PipelineLedger()
+    rules_hash = config_hash({"version": CLEANER_VERSION})
+    tasks, input_hashes = [], {}
+    skipped = 0
     for md_file in md_files:
-        with open(md_file, "r", encoding="utf-8") as f:
-            text = f.read()
+        input_hash = sha256_file(md_file)
+        entry = ledger.doc(md_file.stem)
+        output_file = output_dir / md_file.name
 
-        clean_text, metrics = clean_markdown(text)
-        metrics["file"] = md_file.name
+        if (not full and entry.get("cleaned_from") == input_hash
+                and entry.get("cleaning_rules") == rules_hash
+                and output_file.exists()
+                and entry.get("cleaned_hash") == sha256_file(output_file)):
+            skipped += 1
+            continue
+        tasks.append((md_file, output_file))
+        input_hashes[md_file.stem] = input_hash
 
-        output_file = output_dir / md_file.name
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(clean_text)
+    print(f"  Procesando {len(tasks)} archivo(s) ({skipped} sin cambios, "
+          f"workers={min(workers, max(len(tasks), 1))})...\n")
 
-        print(f"  📝 {md_file.name}: {metrics['reduction_percent']}% reducido "
+    all_metrics = []
+    for metrics in run_cleaning(tasks, workers):
+        stem = Path(metrics["file"]).stem
+        entry = ledger.doc(stem)
+        entry["cleaned_from"] = input_hashes[stem]
+        entry["cleaning_rules"] = rules_hash
+        entry["cleaned_hash"] = metrics.pop("output_hash")
+        # El hash se calculó en el worker: registrarlo en la caché de este proceso
+        register_file_hash(output_dir / metrics["file"], entry["cleaned_hash"])
+
+        print(f"  📝 {metrics['file']}: {metrics['reduction_percent']}% reducido "
               f"({metrics['dot_leaders_removed']} dot-leaders, "
               f"{metrics['hyphen_breaks_fixed']} guiones reparados)")
 
         all_metrics.append(metrics)
 
+    ledger.save()
+    save_hash_cache()
+
     # Resumen
     total_reduction = sum(m["reduction_percent"] for m in all_metrics) / max(len(all_metrics), 1)
-    print(f"\n  Reducción media: {total_reduction:.1f}%")
+    print(f"\n  Limpiados: {len(all_metrics)}, sin cambios: {skipped}")
+    print(f"  Reducción media: {total_reduction:.1f}%")
     print("  Siguiente paso: make chunk")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Limpieza de Markdown")
+    parser.add_argument("--full", action="store_true")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    main(full=args.full, workers=args.workers)
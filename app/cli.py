@@ -2,13 +2,15 @@
 """
 app/cli.py — Entry point CLI del sistema RAG
 
-Subcomandos: ingest, extract, clean, chunk, index, pipeline,
-             query, status, backup, restore, reports, evals, manifest
+Subcomandos: ingest, extract, clean, chunk, index, pipeline, watch,
+             query, serve, status, backup, restore, reports, evals, manifest
 
 Uso:
     python -m app.cli status
     python -m app.cli pipeline
+    python -m app.cli watch
     python -m app.cli query "¿Cómo configurar MFA?"
+    python -m app.cli serve --port 8765
 """
 
 import argparse
@@ -29,26 +31,31 @@ def cmd_ingest(args):
 
 def cmd_extract(args):
     from app.extract import main
-    main()
+    main(full=args.full, workers=args.workers, timeout=args.timeout)
 
 
 def cmd_clean(args):
     from app.clean import main
-    main()
+    main(full=args.full, workers=args.workers)
 
 
 def cmd_chunk(args):
     from app.chunk import main
-    main()
+    main(full=args.full, workers=args.workers)
 
 
 def cmd_index(args):
     from app.index import main
-    main()
+    main(full=args.full)
 
 
 def cmd_pipeline(args):
-    """Ejecuta el pipeline completo: backup → ingest → extract → clean → chunk → index → reports → manifest."""
+    """
+    Ejecuta el pipeline completo: backup → ingest → extract → clean → chunk → index → reports → manifest.
+
+    Es incremental: cada etapa solo reprocesa los documentos cuyo hash de
+    entrada cambió (ver app/ledger.py), salvo con --full.
+    """
     require_pdfs("pipeline completo")
     print_header("PIPELINE COMPLETO")
 
@@ -62,19 +69,19 @@ def cmd_pipeline(args):
 
     print("\n── Paso 3/8: Extracción ──")
     from app.extract import main as extract_main
-    extract_main()
+    extract_main(full=args.full)
 
     print("\n── Paso 4/8: Limpieza ──")
     from app.clean import main as clean_main
-    clean_main()
+    clean_main(full=args.full)
 
     print("\n── Paso 5/8: Chunking ──")
     from app.chunk import main as chunk_main
-    chunk_main()
+    chunk_main(full=args.full)
 
     print("\n── Paso 6/8: Indexación ──")
     from app.index import main as index_main
-    index_main()
+    index_main(full=args.full)
 
     print("\n── Paso 7/8: Reportes ──")
     from app.reports import main as reports_main
@@ -98,6 +105,24 @@ def cmd_query(args):
     main()
 
 
+def cmd_watch(args):
+    from app.watch import watch
+    watch(force_poll=args.poll, debounce_s=args.debounce,
+          settle_s=args.settle, once=args.once)
+
+
+def cmd_serve(args):
+    from app.server import main
+    sys.argv = ["server", "--host", args.host, "--port", str(args.port)]
+    if args.socket:
+        sys.argv.extend(["--socket", args.socket])
+    if args.no_llm:
+        sys.argv.append("--no-llm")
+    if args.reload_check is not None:
+        sys.argv.extend(["--reload-check", str(args.reload_check)])
+    main()
+
+
 def cmd_backup(args):
     from app.backup import main
     sys.argv = ["backup", "create", "--stage", args.stage]
@@ -145,17 +170,41 @@ def main():
 
     sub.add_parser("status", help="Estado del sistema")
     sub.add_parser("ingest", help="Ingestar PDFs nuevos")
-    sub.add_parser("extract", help="Extraer PDF → Markdown")
-    sub.add_parser("clean", help="Limpiar Markdown")
-    sub.add_parser("chunk", help="Chunkear Markdown")
-    sub.add_parser("index", help="Indexar (FAISS + BM25)")
-    sub.add_parser("pipeline", help="Pipeline completo")
+    for name, help_text in [
+        ("extract", "Extraer PDF → Markdown"),
+        ("clean", "Limpiar Markdown"),
+        ("chunk", "Chunkear Markdown"),
+        ("index", "Indexar (FAISS + BM25)"),
+        ("pipeline", "Pipeline completo (incremental)"),
+    ]:
+        stage_parser = sub.add_parser(name, help=help_text)
+        stage_parser.add_argument("--full", action="store_true",
+                                  help="Reprocesar todo ignorando el ledger incremental")
+        if name in ("extract", "clean", "chunk"):
+            stage_parser.add_argument("--workers", type=int, default=None,
+                                      help="Procesos en paralelo (por defecto: nº de CPUs)")
+        if name == "extract":
+            stage_parser.add_argument("--timeout", type=float, default=None,
+                                      help="Segundos máximos por documento")
 
     q_parser = sub.add_parser("query", help="Consulta RAG")
     q_parser.add_argument("question", help="Pregunta")
     q_parser.add_argument("--mode", default="query", choices=["query", "audit", "design"])
     q_parser.add_argument("--json", action="store_true")
 
+    s_parser = sub.add_parser("serve", help="Servidor RAG persistente (HTTP/socket Unix)")
+    s_parser.add_argument("--host", default="127.0.0.1")
+    s_parser.add_argument("--port", type=int, default=8765)
+    s_parser.add_argument("--socket", default=None)
+    s_parser.add_argument("--no-llm", action="store_true")
+    s_parser.add_argument("--reload-check", type=float, default=None)
+
+    w_parser = sub.add_parser("watch", help="Ingesta continua de incoming_pdfs/ (pipeline incremental)")
+    w_parser.add_argument("--poll", action="store_true")
+    w_parser.add_argument("--debounce", type=float, default=None)
+    w_parser.add_argument("--settle", type=float, default=None)
+    w_parser.add_argument("--once", action="store_true")
+
     b_parser = sub.add_parser("backup", help="Crear backup")
     b_parser.add_argument("--stage", required=True)
     b_parser.add_argument("--label", default="")
@@ -175,7 +224,9 @@ def main():
     commands = {
         "status": cmd_status, "ingest": cmd_ingest, "extract": cmd_extract,
         "clean": cmd_clean, "chunk": cmd_chunk, "index": cmd_index,
-        "pipeline": cmd_pipeline, "query": cmd_query, "backup": cmd_backup,
+        "pipeline": cmd_pipeline, "watch": cmd_watch,
+        "query": cmd_query, "serve": cmd_serve,
+        "backup": cmd_backup,
         "backup-list": cmd_backup_list, "restore": cmd_restore,
         "reports": cmd_reports, "evals": cmd_evals, "manifest": cmd_manifest,
     }
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+app/dedup.py — Detección de documentos casi duplicados (MinHash + LSH)
+
+Los duplicados exactos se descartan en la ingesta por hash de contenido;
+este módulo detecta versiones casi idénticas del mismo documento (otra
+edición del PDF, portada distinta...) comparando el texto extraído:
+
+    texto → shingles de k palabras → firma MinHash (num_perm enteros)
+          → bandas LSH para candidatos → similitud Jaccard estimada
+
+Las firmas son deterministas (crc32 + permutaciones con semilla fija),
+por lo que pueden guardarse en el ledger y reutilizarse entre ejecuciones.
+"""
+
+import zlib
+
+import numpy as np
+
+MINHASH_SEED = 1
+_MASK32 = np.uint64(0xFFFFFFFF)
+_BLOCK = 16384  # shingles por bloque (limita memoria: BLOCK × num_perm)
+
+
+def _permutations(num_perm: int) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(MINHASH_SEED)
+    a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def shingle_hashes(text: str, shingle_size: int = 5) -> np.ndarray:
+    """Hashes crc32 únicos de los shingles de `shingle_size` palabras."""
+    words = text.lower().split()
+    if len(words) < shingle_size:
+        shingles = [" ".join(words)] if words else []
+    else:
+        shingles = (" ".join(words[i:i + shingle_size])
+                    for i in range(len(words) - shingle_size + 1))
+    hashes = {zlib.crc32(s.encode("utf-8")) for s in shingles}
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+def minhash_signature(text: str, num_perm: int = 128, shingle_size: int = 5) -> list[int]:
+    """
+    Firma MinHash del texto.
+
+    Returns:
+        Lista de `num_perm` enteros de 32 bits (vacía si el texto no tiene palabras).
+    """
+    hashes = shingle_hashes(text, shingle_size)
+    if len(hashes) == 0:
+        return []
+    a, b = _permutations(num_perm)
+    signature = np.full(num_perm, 0xFFFFFFFF, dtype=np.uint64)
+    for start in range(0, len(hashes), _BLOCK):
+        block = hashes[start:start + _BLOCK, None]
+        # a, x < 2^32 → a·x + b < 2^64: sin desbordamiento en uint64
+        permuted = (block * a + b) & _MASK32
+        np.minimum(signature, permuted.min(axis=0), out=signature)
+    return signature.astype(np.uint32).tolist()
+
+
+def estimate_jaccard(sig_a: list[int], sig_b: list[int]) -> float:
+    """Similitud Jaccard estimada como fracción de posiciones coincidentes."""
+    if not sig_a or len(sig_a) != len(sig_b):
+        return 0.0
+    return float(np.mean(np.asarray(sig_a) == np.asarray(sig_b)))
+
+
+def find_near_duplicates(signatures: dict[str, list[int]], threshold: float = 0.9,
+                         bands: int = 32) -> dict[str, tuple[str, float]]:
+    """
+    Agrupa documentos casi duplicados mediante LSH por bandas.
+
+    Args:
+        signatures: {nombre_documento: firma MinHash}.
+        threshold: Jaccard estimada mínima para considerar duplicado.
+        bands: Número de bandas LSH (debe dividir la longitud de la firma).
+
+    Returns:
+        {duplicado: (original, similitud)}. El original de cada grupo es el
+        primer documento en orden alfabético; nunca se marca como duplicado.
+    """
+    names = sorted(n for n, sig in signatures.items() if sig)
+    if not names:
+        return {}
+    num_perm = len(signatures[names[0]])
+    rows = max(num_perm // bands, 1)
+
+    buckets: dict[tuple, list[str]] = {}
+    for name in names:
+        sig = signatures[name]
+        for band in range(0, num_perm, rows):
+            key = (band, tuple(sig[band:band + rows]))
+            buckets.setdefault(key, []).append(name)
+
+    duplicates: dict[str, tuple[str, float]] = {}
+    for name in names:
+        if name in duplicates:
+            continue
+        candidates = set()
+        sig = signatures[name]
+        for band in range(0, num_perm, rows):
+            candidates.update(buckets[(band, tuple(sig[band:band + rows]))])
+        for other in sorted(candidates):
+            if other <= name or other in duplicates:
+                continue
+            similarity = estimate_jaccard(sig, signatures[other])
+            if similarity >= threshold:
+                duplicates[other] = (name, round(similarity, 3))
+    return duplicates
+
+
+def update_near_duplicates(ledger, text_dir, dedup_config: dict) -> dict[str, tuple[str, float]]:
+    """
+    Recalcula las marcas `near_duplicate_of` del ledger a partir del texto
+    extraído en `text_dir` (<stem>.md).
+
+    Las firmas se guardan en el ledger junto al hash del Markdown del que
+    salen, así que solo se recalculan para documentos nuevos o modificados.
+    Con la detección desactivada se limpian las marcas existentes.
+    """
+    enabled = dedup_config.get("near_duplicates", False)
+    num_perm = dedup_config.get("num_perm", 128)
+    shingle_size = dedup_config.get("shingle_size", 5)
+    params = [num_perm, shingle_size]
+
+    signatures = {}
+    for name, entry in ledger.documents.items():
+        entry.pop("near_duplicate_of", None)
+        if not enabled:
+            entry.pop("minhash", None)
+            continue
+        text_file = text_dir / f"{name}.md"
+        extracted_hash = entry.get("extracted_hash")
+        if not extracted_hash or not text_file.exists():
+            continue
+        cached = entry.get("minhash", {})
+        if cached.get("from") == extracted_hash and cached.get("params") == params:
+            signatures[name] = cached["signature"]
+            continue
+        with open(text_file, "r", encoding="utf-8") as f:
+            signature = minhash_signature(f.read(), num_perm, shingle_size)
+        entry["minhash"] = {"from": extracted_hash, "params": params,
+                            "signature": signature}
+        signatures[name] = signature
+
+    if not enabled:
+        return {}
+
+    duplicates = find_near_duplicates(signatures, dedup_config.get("threshold", 0.9),
+                                      dedup_config.get("bands", 32))
+    for name, (original, similarity) in duplicates.items():
+        ledger.doc(name)["near_duplicate_of"] = {"document": original,
+                                                  "similarity": similarity}
+    return duplicates
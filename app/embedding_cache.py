@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+app/embedding_cache.py — Caché persistente de embeddings
+
+Asocia SHA-256(contenido) → vector float32 para un modelo y un valor de
+`normalize` concretos, de modo que la reindexación solo codifica los
+chunks nuevos o modificados.
+
+Estructura en disco (un subdirectorio por modelo + normalize):
+    indexes/embedding_cache/<clave>/keys.npy      hashes hex (S64), una fila por vector
+    indexes/embedding_cache/<clave>/vectors.npy   float32 (N, dim), memory-mapped
+    indexes/embedding_cache/<clave>/meta.json     modelo, normalize, dimensión,
+                                                  num_vectors y SHA-256 de keys.npy
+
+meta.json se escribe el último y valida el par keys/vectors: si la
+escritura se interrumpió entre los dos reemplazos, el digest no coincide
+y la caché se descarta en lugar de asociar claves a vectores ajenos.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from app.utils import ensure_dir, sha256_text
+
+
+class EmbeddingCache:
+    """Caché content-hash → embedding respaldada por arrays .npy."""
+
+    def __init__(self, root: Path, model_name: str, normalize: bool):
+        self.model_name = model_name
+        self.normalize = bool(normalize)
+        namespace = sha256_text(f"{model_name}|normalize={self.normalize}")[:16]
+        self.directory = root / namespace
+        self.keys = np.empty(0, dtype="S64")
+        self.vectors = None
+        self._rows: dict[bytes, int] = {}
+
+        keys_path = self.directory / "keys.npy"
+        vectors_path = self.directory / "vectors.npy"
+        meta_path = self.directory / "meta.json"
+        if keys_path.exists() and vectors_path.exists():
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                meta = {}
+            keys = np.load(keys_path, allow_pickle=False)
+            vectors = np.load(vectors_path, mmap_mode="r", allow_pickle=False)
+            if (meta.get("num_vectors") == len(keys) == len(vectors)
+                    and meta.get("keys_sha256") == self._digest(keys)):
+                self.keys = keys
+                self.vectors = vectors
+                self._rows = {k: i for i, k in enumerate(self.keys.tolist())}
+            else:
+                print("  [WARN] Caché de embeddings inconsistente. Se ignora.")
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @staticmethod
+    def _digest(keys: np.ndarray) -> str:
+        return hashlib.sha256(np.ascontiguousarray(keys).tobytes()).hexdigest()
+
+    @staticmethod
+    def content_key(text: str) -> bytes:
+        return sha256_text(text).encode("ascii")
+
+    def lookup(self, keys: list[bytes]) -> tuple[list[int], np.ndarray, list[int]]:
+        """
+        Busca cada clave en la caché.
+
+        Returns:
+            Tupla (posiciones con acierto, sus vectores float32, posiciones sin cachear).
+        """
+        hit_positions, hit_rows, missing = [], [], []
+        for pos, key in enumerate(keys):
+            row = self._rows.get(key)
+            if row is None:
+                missing.append(pos)
+            else:
+                hit_positions.append(pos)
+                hit_rows.append(row)
+        if hit_rows:
+            vectors = np.asarray(self.vectors[np.array(hit_rows)], dtype=np.float32)
+        else:
+            vectors = np.empty((0, 0), dtype=np.float32)
+        return hit_positions, vectors, missing
+
+    def save(self, keys: list[bytes], vectors: np.ndarray):
+        """
+        Reescribe la caché con exactamente estas entradas (las del corpus actual),
+        de forma atómica para no romper lectores con el archivo mapeado.
+        """
+        ensure_dir(self.directory)
+        unique = {}
+        for pos, key in enumerate(keys):
+            unique.setdefault(key, pos)
+        rows = list(unique.values())
+        keys_arr = np.array(list(unique.keys()), dtype="S64")
+        vectors_arr = np.ascontiguousarray(vectors[rows], dtype=np.float32)
+
+        for name, arr in (("keys", keys_arr), ("vectors", vectors_arr)):
+            tmp = self.directory / f"{name}.tmp.npy"
+            np.save(tmp, arr, allow_pickle=False)
+            os.replace(tmp, self.directory / f"{name}.npy")
+
+        # El último: publica el par keys/vectors recién escrito
+        meta = {
+            "model_name": self.model_name,
+            "normalize": self.normalize,
+            "dimension": int(vectors_arr.shape[1]) if vectors_arr.ndim == 2 else 0,
+            "num_vectors": len(keys_arr),
+            "keys_sha256": self._digest(keys_arr),
+        }
+        tmp = self.directory / "meta.tmp.json"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, self.directory / "meta.json")
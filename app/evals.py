@@ -30,8 +30,7 @@ GOLDEN_SET = [
 ]
 
 
-def evaluate_retrieval(engine, query, expected_kw):
-    results = engine.hybrid_search(query)
+def evaluate_retrieval(results, expected_kw):
     all_content = " ".join(r.get("content", "").lower() for r in results)
     hits = sum(1 for kw in expected_kw if kw.lower() in all_content)
     coverage = hits / max(len(expected_kw), 1)
@@ -53,9 +52,11 @@ def main():
 
     results = []
     t0 = time.time()
-    for q in GOLDEN_SET:
+    # Todas las preguntas en un lote: un encode y una búsqueda por índice
+    retrieved = engine.hybrid_search_batch([q["query"] for q in GOLDEN_SET])
+    for q, hits in zip(GOLDEN_SET, retrieved):
         print(f"  🔍 [{q['id']}] {q['query'][:50]}...")
-        r = evaluate_retrieval(engine, q["query"], q["expected_keywords"])
+        r = evaluate_retrieval(hits, q["expected_keywords"])
         r.update({"id": q["id"], "domain": q["domain"]})
         results.append(r)
         s = "✓" if r["keyword_coverage"] > 0.5 else "⚠"
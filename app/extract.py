@@ -6,31 +6,66 @@ Convierte PDFs de data/01_raw_pdfs/ a Markdown en data/02_extracted_md/.
 Usa PyMuPDF (fitz) para extracción de texto con metadata de páginas.
 
 Uso:
-    python -m app.extract
+    python -m app.extract [--workers N] [--timeout S] [--full]
     make extract
 """
 
-import json
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
 import sys
+import time
+from collections import deque
 from pathlib import Path
 
+from app.dedup import update_near_duplicates
+from app.ledger import PipelineLedger
 from app.utils import (
+    HashingWriter,
     load_config,
     require_pdfs,
+    register_file_hash,
+    save_hash_cache,
     sha256_file,
     ensure_dir,
     print_header,
     PROJECT_ROOT,
 )
 
+# Tamaño de bloque al unir tramos de páginas (caracteres)
+COPY_BLOCK_CHARS = 1 << 20
 
-def extract_pdf_to_markdown(pdf_path: Path, output_dir: Path) -> dict:
+
+def markdown_header(pdf_path: Path, pages: int, source_hash: str) -> str:
+    """Cabecera del Markdown extraído (título + metadatos de origen)."""
+    return (f"# {pdf_path.stem}\n"
+            f"<!-- source: {pdf_path.name} -->\n"
+            f"<!-- pages: {pages} -->\n"
+            f"<!-- hash: {source_hash} -->\n\n")
+
+
+def page_blocks(doc, start: int, end: int):
+    """Genera el Markdown de las páginas [start, end) que tienen texto."""
+    for page_num in range(start, end):
+        text = doc[page_num].get_text("text")
+        if text.strip():
+            yield (f"<!-- page: {page_num + 1} -->\n"
+                   f"## Página {page_num + 1}\n\n"
+                   f"{text}\n\n")
+
+
+def extract_pdf_to_markdown(pdf_path: Path, output_dir: Path,
+                            source_hash: str | None = None,
+                            verbose: bool = True) -> dict:
     """
     Extrae texto de un PDF y lo guarda como Markdown.
 
     Args:
         pdf_path: Ruta al archivo PDF.
         output_dir: Directorio de salida para el Markdown.
+        source_hash: SHA-256 del PDF si ya se conoce (evita recalcularlo).
+        verbose: Imprimir el resultado (desactivado en los workers del pool).
 
     Returns:
         Diccionario con metadatos de la extracción.
@@ -49,54 +84,351 @@ def extract_pdf_to_markdown(pdf_path: Path, output_dir: Path) -> dict:
         "characters": 0,
         "status": "pending",
     }
+    t0 = time.time()
 
     try:
         doc = fitz.open(str(pdf_path))
         metadata["pages"] = len(doc)
 
-        lines = []
-        lines.append(f"# {pdf_path.stem}\n")
-        lines.append(f"<!-- source: {pdf_path.name} -->\n")
-        lines.append(f"<!-- pages: {len(doc)} -->\n")
-        lines.append(f"<!-- hash: {sha256_file(pdf_path)} -->\n\n")
+        # Escritura en streaming: memoria constante sea cual sea el tamaño del PDF
+        with HashingWriter(output_file) as writer:
+            writer.write(markdown_header(pdf_path, len(doc),
+                                         source_hash or sha256_file(pdf_path)))
+            for block in page_blocks(doc, 0, len(doc)):
+                writer.write(block)
 
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            text = page.get_text("text")
+        doc.close()
 
-            if text.strip():
-                lines.append(f"<!-- page: {page_num + 1} -->\n")
-                lines.append(f"## Página {page_num + 1}\n\n")
-                lines.append(text)
-                lines.append("\n\n")
+        metadata["characters"] = writer.characters
+        metadata["output_hash"] = writer.hexdigest()
+        metadata["status"] = "ok"
 
-        doc.close()
+    except Exception as e:
+        metadata["status"] = "error"
+        metadata["error"] = str(e)
 
-        content = "".join(lines)
-        metadata["characters"] = len(content)
+    metadata["elapsed_s"] = round(time.time() - t0, 2)
+    if verbose:
+        print_extraction_result(metadata)
+    return metadata
 
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(content)
 
-        metadata["status"] = "ok"
-        print(f"    ✓ {pdf_path.name} → {output_file.name} "
-              f"({metadata['pages']} págs, {metadata['characters']} chars)")
+def extract_page_range(pdf_path: Path, start: int, end: int, part_file: Path) -> dict:
+    """
+    Extrae las páginas [start, end) de un PDF a un archivo parcial.
+
+    Cada worker abre el documento por su cuenta; ``assemble_parts`` une
+    después las partes en orden bajo la cabecera del documento.
+    """
+    import fitz  # PyMuPDF
 
+    metadata = {
+        "source_file": pdf_path.name,
+        "output_file": part_file.name,
+        "pages": end - start,
+        "characters": 0,
+        "status": "pending",
+    }
+    t0 = time.time()
+    try:
+        doc = fitz.open(str(pdf_path))
+        with open(part_file, "w", encoding="utf-8") as f:
+            for block in page_blocks(doc, start, end):
+                f.write(block)
+                metadata["characters"] += len(block)
+        doc.close()
+        metadata["status"] = "ok"
     except Exception as e:
         metadata["status"] = "error"
-        metadata["error"] = str(e)
-        print(f"    ✗ {pdf_path.name}: {e}")
+        metadata["error"] = f"págs. {start + 1}-{end}: {e}"
+    metadata["elapsed_s"] = round(time.time() - t0, 2)
+    return metadata
+
 
+def assemble_parts(job: dict, part_results: list[dict]) -> dict:
+    """Une en orden las partes de un PDF dividido por páginas (o informa del fallo)."""
+    pdf_path = job["pdf"]
+    output_file = job["output_dir"] / f"{pdf_path.stem}.md"
+    part_files = [task[3][2] for task in job["tasks"]]
+    metadata = {
+        "source_file": pdf_path.name,
+        "output_file": output_file.name,
+        "pages": job["pages"],
+        "characters": 0,
+        "status": "ok",
+        "page_tasks": len(part_files),
+        "elapsed_s": round(sum(r.get("elapsed_s", 0) for r in part_results), 2),
+    }
+
+    failed = [r for r in part_results if r["status"] != "ok"]
+    if failed:
+        metadata["status"] = "timeout" if any(r["status"] == "timeout" for r in failed) else "error"
+        metadata["error"] = "; ".join(r.get("error", r["status"]) for r in failed)
+    else:
+        with HashingWriter(output_file) as writer:
+            writer.write(markdown_header(pdf_path, job["pages"], job["source_hash"]))
+            for part_file in part_files:
+                with open(part_file, "r", encoding="utf-8") as part:
+                    for block in iter(lambda: part.read(COPY_BLOCK_CHARS), ""):
+                        writer.write(block)
+        metadata["characters"] = writer.characters
+        metadata["output_hash"] = writer.hexdigest()
+
+    remove_parts(part_files)
     return metadata
 
 
-def main():
+def remove_parts(part_files: list[Path]):
+    """Borra los archivos parciales y su directorio .parts/ si queda vacío."""
+    for part_file in part_files:
+        part_file.unlink(missing_ok=True)
+    if part_files:
+        try:
+            part_files[0].parent.rmdir()
+        except OSError:
+            pass  # aún contiene tramos de otros documentos en curso
+
+
+def print_extraction_result(metadata: dict):
+    """Imprime una línea de resultado de extracción."""
+    if metadata["status"] == "ok":
+        parts = f", {metadata['page_tasks']} tramos" if metadata.get("page_tasks") else ""
+        print(f"    ✓ {metadata['source_file']} → {metadata['output_file']} "
+              f"({metadata['pages']} págs, {metadata['characters']} chars, "
+              f"{metadata['elapsed_s']}s{parts})")
+    else:
+        print(f"    ✗ {metadata['source_file']}: {metadata.get('error', metadata['status'])}")
+
+
+def plan_job(pdf_path: Path, output_dir: Path, source_hash: str,
+             split_pages: int | None, pages_per_task: int) -> dict:
+    """
+    Planifica la extracción de un PDF: una tarea para el documento entero o,
+    si supera ``split_pages`` páginas, una tarea por tramo de ``pages_per_task``.
+
+    Tareas: (pdf_path, output_dir, source_hash, None | (start, end, part_file)).
+    """
+    job = {"pdf": pdf_path, "output_dir": output_dir, "source_hash": source_hash,
+           "pages": 0, "tasks": [(pdf_path, output_dir, source_hash, None)]}
+    if not split_pages:
+        return job
+
+    import fitz  # PyMuPDF
+    try:
+        with fitz.open(str(pdf_path)) as doc:
+            pages = len(doc)
+    except Exception:
+        return job  # el error se reportará al extraer
+
+    if pages <= split_pages:
+        return job
+
+    parts_dir = ensure_dir(output_dir / ".parts")
+    job["pages"] = pages
+    job["tasks"] = [
+        (pdf_path, output_dir, source_hash,
+         (start, min(start + pages_per_task, pages),
+          parts_dir / f"{pdf_path.stem}.{start:06d}.part"))
+        for start in range(0, pages, pages_per_task)
+    ]
+    return job
+
+
+def _extract_task(task: tuple) -> dict:
+    """Tarea de worker: documento completo o tramo de páginas, sin imprimir."""
+    pdf_path, output_dir, source_hash, page_range = task
+    if page_range is None:
+        return extract_pdf_to_markdown(pdf_path, output_dir, source_hash, verbose=False)
+    start, end, part_file = page_range
+    return extract_page_range(pdf_path, start, end, part_file)
+
+
+def _finish_job(job: dict, results: list[dict]) -> dict:
+    if job["tasks"][0][3] is None:
+        return results[0]
+    return assemble_parts(job, results)
+
+
+def _failed_result(task: tuple, status: str, error: str) -> dict:
+    pdf_path, _, _, page_range = task
+    where = f" (págs. {page_range[0] + 1}-{page_range[1]})" if page_range else ""
+    return {
+        "source_file": pdf_path.name,
+        "output_file": f"{pdf_path.stem}.md",
+        "pages": 0,
+        "characters": 0,
+        "status": status,
+        "error": f"{error}{where}",
+    }
+
+
+def _timeout_result(task: tuple, timeout: float) -> dict:
+    return _failed_result(task, "timeout", f"tiempo agotado ({timeout:.0f}s)")
+
+
+def _worker_loop(conn):
+    """Bucle de un worker: recibe tareas por su pipe hasta recibir None."""
+    while (task := conn.recv()) is not None:
+        try:
+            result = _extract_task(task)
+        except Exception as e:
+            result = _failed_result(task, "error", str(e) or type(e).__name__)
+        conn.send(result)
+
+
+def _start_worker() -> dict:
+    conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_worker_loop, args=(child_conn,), daemon=True)
+    process.start()
+    child_conn.close()
+    return {"process": process, "conn": conn, "task": None, "started": 0.0}
+
+
+def _stop_worker(worker: dict):
+    worker["process"].kill()
+    worker["process"].join()
+    worker["conn"].close()
+
+
+def _run_tasks_in_pool(tasks: list[tuple], processes: int, timeout: float | None):
+    """
+    Ejecuta las tareas en ``processes`` workers propios, una por worker, de
+    modo que el plazo de cada tarea cuenta desde que empieza.
+
+    Si una tarea agota ``timeout`` (o su worker muere), solo ese worker se
+    mata y se sustituye por otro; las demás tareas en curso siguen.
+
+    Yields:
+        (índice de la tarea, resultado) en orden de finalización.
+    """
+    pending = deque(range(len(tasks)))
+    workers = [_start_worker() for _ in range(processes)]
+    try:
+        while True:
+            for worker in workers:
+                if worker["task"] is None and pending:
+                    worker["task"] = pending.popleft()
+                    worker["started"] = time.monotonic()
+                    worker["conn"].send(tasks[worker["task"]])
+            busy = [w for w in workers if w["task"] is not None]
+            if not busy:
+                return
+
+            wait = None
+            if timeout:
+                wait = max(min(w["started"] for w in busy) + timeout - time.monotonic(), 0)
+            ready = multiprocessing.connection.wait([w["conn"] for w in busy], timeout=wait)
+
+            now = time.monotonic()
+            for slot, worker in enumerate(workers):
+                i = worker["task"]
+                if i is None:
+                    continue
+                if worker["conn"] in ready:
+                    try:
+                        result = worker["conn"].recv()
+                    except EOFError:
+                        result = _failed_result(tasks[i], "error", "el worker terminó inesperadamente")
+                        _stop_worker(worker)
+                        workers[slot] = _start_worker()
+                    worker["task"] = None
+                    yield i, result
+                elif timeout and now - worker["started"] >= timeout:
+                    # Matar solo al worker bloqueado
+                    _stop_worker(worker)
+                    workers[slot] = _start_worker()
+                    yield i, _timeout_result(tasks[i], timeout)
+    finally:
+        for worker in workers:
+            _stop_worker(worker)
+
+
+def run_extraction(jobs: list[dict], workers: int, timeout: float | None) -> list[dict]:
+    """
+    Extrae los PDFs en un pool de procesos, devolviendo resultados en orden.
+
+    Los PDFs grandes llegan ya divididos en tramos de páginas (``plan_job``),
+    así que el documento más largo también se reparte entre los workers.
+    Cada tarea dispone de ``timeout`` segundos desde que empieza a
+    ejecutarse, también con un solo worker. Si se agota, el documento se
+    marca como error, se borran sus archivos temporales y se conserva su
+    extracción anterior.
+
+    Args:
+        jobs: Documentos planificados con ``plan_job``.
+        workers: Número de procesos (1 sin timeout = secuencial, sin pool).
+        timeout: Segundos por tarea (None = sin límite).
+    """
+    num_tasks = sum(len(job["tasks"]) for job in jobs)
+    results = []
+
+    if not timeout and (workers <= 1 or num_tasks <= 1):
+        for job in jobs:
+            result = _finish_job(job, [_extract_task(t) for t in job["tasks"]])
+            print_extraction_result(result)
+            results.append(result)
+        return results
+
+    tasks = [task for job in jobs for task in job["tasks"]]
+    task_results = [None] * len(tasks)
+    first_task, offset = [], 0
+    for job in jobs:
+        first_task.append(offset)
+        offset += len(job["tasks"])
+
+    # Cada documento se ensambla e imprime en orden en cuanto acaban sus tareas
+    for i, result in _run_tasks_in_pool(tasks, max(min(workers, num_tasks), 1), timeout):
+        task_results[i] = result
+        while len(results) < len(jobs):
+            job = jobs[len(results)]
+            start = first_task[len(results)]
+            job_results = task_results[start:start + len(job["tasks"])]
+            if any(r is None for r in job_results):
+                break
+            result = _finish_job(job, job_results)
+            print_extraction_result(result)
+            results.append(result)
+
+    # Restos de documentos abortados; la extracción anterior (si la hay) se conserva
+    for job, result in zip(jobs, results):
+        if result["status"] == "timeout":
+            output_file = job["output_dir"] / result["output_file"]
+            output_file.with_name(output_file.name + ".tmp").unlink(missing_ok=True)
+            remove_parts([task[3][2] for task in job["tasks"] if task[3] is not None])
+
+    return results
+
+
+def main(full: bool = False, workers: int | None = None, timeout: float | None = None):
+    """
+    Extrae los PDFs nuevos o modificados (según el ledger de pipeline).
+
+    Args:
+        full: Si True, reextrae todos los PDFs ignorando el ledger.
+        workers: Procesos en paralelo (None = CONFIG.yml o nº de CPUs).
+        timeout: Segundos máximos por tarea (None = CONFIG.yml).
+    """
     print_header("EXTRACCIÓN PDF → MARKDOWN")
     require_pdfs("extracción")
 
+    try:
+        import fitz  # noqa: F401  (comprobar antes de lanzar workers)
+    except ImportError:
+        print("[ERROR] PyMuPDF no instalado. Ejecute: pip install pymupdf")
+        sys.exit(1)
+
     config = load_config()
+    extraction_config = config.get("pdf_extraction", {})
+    if workers is None:
+        workers = extraction_config.get("workers") or os.cpu_count() or 1
+    if timeout is None:
+        timeout = extraction_config.get("timeout_s")
+    split_pages = extraction_config.get("split_pages")
+    pages_per_task = extraction_config.get("pages_per_task", 100)
+
     raw_dir = PROJECT_ROOT / config["paths"]["raw_pdfs"]
     output_dir = PROJECT_ROOT / config["paths"]["extracted_md"]
+    clean_dir = PROJECT_ROOT / config["paths"]["clean_md"]
     ensure_dir(output_dir)
 
     pdfs = sorted(
@@ -108,19 +440,72 @@ def main():
         print("  Ejecute primero: make ingest")
         return
 
-    print(f"  Procesando {len(pdfs)} PDF(s)...\n")
+    # Documentos eliminados de 01_raw_pdfs/: borrar sus derivados
+    ledger = PipelineLedger()
+    removed = ledger.prune({p.stem for p in pdfs}, [output_dir, clean_dir])
+    for name in removed:
+        print(f"  🗑 {name}: PDF eliminado, derivados borrados")
 
-    results = []
+    jobs = []
+    skipped = 0
     for pdf in pdfs:
-        result = extract_pdf_to_markdown(pdf, output_dir)
-        results.append(result)
+        source_hash = sha256_file(pdf)
+        entry = ledger.doc(pdf.stem)
+        output_file = output_dir / f"{pdf.stem}.md"
+
+        if (not full and entry.get("source_hash") == source_hash
+                and output_file.exists()
+                and entry.get("extracted_hash") == sha256_file(output_file)):
+            skipped += 1
+            continue
+        # Los PDFs grandes se dividen en tramos de páginas solo si hay paralelismo
+        jobs.append(plan_job(pdf, output_dir, source_hash,
+                             split_pages if workers > 1 else None, pages_per_task))
+
+    num_tasks = sum(len(job["tasks"]) for job in jobs)
+    print(f"  Procesando {len(jobs)} PDF(s) en {num_tasks} tarea(s) ({skipped} sin cambios, "
+          f"workers={min(workers, max(num_tasks, 1))}"
+          f"{f', timeout={timeout}s' if timeout else ''})...\n")
+
+    t0 = time.time()
+    results = run_extraction(jobs, workers, timeout)
+    wall_time = time.time() - t0
+
+    for job, result in zip(jobs, results):
+        if result["status"] == "ok":
+            entry = ledger.doc(job["pdf"].stem)
+            entry["source_file"] = job["pdf"].name
+            entry["source_hash"] = job["source_hash"]
+            entry["extracted_hash"] = result["output_hash"]
+            # El hash pudo calcularse en un worker: registrarlo en este proceso
+            register_file_hash(job["output_dir"] / result["output_file"], result["output_hash"])
+
+    # Casi duplicados (MinHash sobre el texto extraído): chunk los omite
+    near_duplicates = update_near_duplicates(ledger, output_dir, config.get("dedup", {}))
+    ledger.save()
+    save_hash_cache()
 
     # Resumen
-    ok = sum(1 for r in results if r["status"] == "ok")
-    errors = sum(1 for r in results if r["status"] == "error")
-    print(f"\n  Resultado: {ok} extraído(s), {errors} error(es).")
+    ok = [r for r in results if r["status"] == "ok"]
+    failed = [r for r in results if r["status"] != "ok"]
+    cpu_time = sum(r.get("elapsed_s", 0) for r in results)
+    print(f"\n  Resultado: {len(ok)} extraído(s), {skipped} sin cambios, "
+          f"{len(failed)} error(es).")
+    if ok:
+        print(f"  Páginas: {sum(r['pages'] for r in ok)}, "
+              f"caracteres: {sum(r['characters'] for r in ok)}")
+    print(f"  Tiempo: {wall_time:.1f}s (suma por documento: {cpu_time:.1f}s)")
+    for r in failed:
+        print(f"    ✗ {r['source_file']}: {r.get('error', r['status'])}")
+    for name, (original, similarity) in sorted(near_duplicates.items()):
+        print(f"    ≈ {name}: casi duplicado de {original} (Jaccard≈{similarity})")
     print("  Siguiente paso: make clean")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Extracción PDF → Markdown")
+    parser.add_argument("--full", action="store_true")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None)
+    args = parser.parse_args()
+    main(full=args.full, workers=args.workers, timeout=args.timeout)
@@ -4,22 +4,37 @@ app/index.py — Indexación vectorial (FAISS) y BM25
 
 Construye índices a partir de chunks.jsonl para búsqueda RAG.
 
+Cada indexación escribe una build nueva en su propio subdirectorio
+(indexes/vector/<build>/, indexes/bm25/<build>/, indexes/metadata/<build>/) y solo al terminar la
+publica reescribiendo de forma atómica el puntero indexes/current.json.
+Los lectores (servidor, plan) resuelven los directorios a partir del
+puntero: nunca ven archivos a medio escribir ni arrays de dos builds
+distintas, y los que tienen mapeada una build anterior la conservan
+hasta recargar.
+
 Uso:
     python -m app.index
     make index
 """
 
 import json
-import pickle
+import os
+import shutil
 import sys
 import time
+from collections import Counter
+from datetime import datetime
 from pathlib import Path
 
 import numpy as np
 
+from app.embedding_cache import EmbeddingCache
+from app.ledger import PipelineLedger, config_hash
 from app.utils import (
     load_config,
     require_pdfs,
+    save_hash_cache,
+    sha256_file,
     ensure_dir,
     print_header,
     PROJECT_ROOT,
@@ -37,9 +52,146 @@ def load_chunks(chunks_path: Path) -> list[dict]:
     return chunks
 
 
-def build_vector_index(chunks: list[dict], config: dict) -> dict:
+VECTOR_INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+def create_faiss_index(embeddings: np.ndarray, vector_config: dict):
+    """
+    Crea (y entrena si procede) el índice FAISS según retrieval.yml → vector_index.
+
+    Todos los tipos usan producto interno (coseno con embeddings normalizados).
+    Si el corpus es demasiado pequeño para entrenar IVF/PQ, cae a flat.
+
+    Returns:
+        Tupla (índice con los vectores añadidos, tipo efectivo).
+    """
+    import faiss
+
+    n, dim = embeddings.shape
+    index_type = vector_config.get("type", "flat")
+    if index_type not in VECTOR_INDEX_TYPES:
+        print(f"  [WARN] Tipo de índice desconocido '{index_type}'. Usando flat.")
+        index_type = "flat"
+
+    metric = faiss.METRIC_INNER_PRODUCT
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        # FAISS recomienda ≥ 39 puntos de entrenamiento por centroide
+        nlist = vector_config.get("nlist") or int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n // 39))
+        min_train = 39 * nlist
+        if index_type == "ivf_pq":
+            min_train = max(min_train, 39 * (1 << vector_config.get("pq_nbits", 8)))
+        if n < min_train or nlist < 2:
+            print(f"  [WARN] {n} vectores insuficientes para entrenar {index_type}. "
+                  "Usando flat.")
+            index_type = "flat"
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, vector_config.get("hnsw_m", 32), metric)
+        index.hnsw.efConstruction = vector_config.get("ef_construction", 200)
+    else:
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        else:
+            pq_m = vector_config.get("pq_m", 48)
+            if dim % pq_m:
+                print(f"  [ERROR] pq_m={pq_m} debe dividir la dimensión {dim}.")
+                sys.exit(1)
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m,
+                                     vector_config.get("pq_nbits", 8), metric)
+        print(f"  Entrenando {index_type} (nlist={nlist})...")
+        index.train(embeddings)
+
+    index.add(embeddings)
+    configure_vector_index(index, vector_config)
+    return index, index_type
+
+
+def configure_vector_index(index, vector_config: dict):
+    """Aplica los parámetros de búsqueda (nprobe / efSearch) a un índice cargado."""
+    import faiss
+
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = vector_config.get("ef_search", 64)
+        return
+    try:
+        faiss.extract_index_ivf(index).nprobe = vector_config.get("nprobe", 16)
+    except RuntimeError:
+        pass  # índice plano: sin parámetros de búsqueda
+
+
+def benchmark_vector_index(index, embeddings: np.ndarray, vector_config: dict) -> dict:
+    """
+    Mide recall@k y latencia del índice frente a la búsqueda exacta (flat).
+
+    Usa como consultas una muestra determinista de los propios embeddings.
     """
-    Construye índice FAISS con sentence-transformers.
+    import faiss
+
+    bench_config = vector_config.get("benchmark", {})
+    k = min(bench_config.get("k", 10), len(embeddings))
+    num_queries = min(bench_config.get("num_queries", 200), len(embeddings))
+    rng = np.random.default_rng(0)
+    queries = embeddings[rng.choice(len(embeddings), num_queries, replace=False)]
+
+    flat = faiss.IndexFlatIP(embeddings.shape[1])
+    flat.add(embeddings)
+
+    def _timed(idx):
+        t0 = time.perf_counter()
+        for q in queries:
+            idx.search(q[None, :], k)
+        per_query = (time.perf_counter() - t0) / num_queries
+        _, all_ids = idx.search(queries, k)
+        return all_ids, per_query
+
+    truth, flat_latency = _timed(flat)
+    found, ann_latency = _timed(index)
+    recall = np.mean([len(set(t) & set(f[f >= 0])) / k for t, f in zip(truth, found)])
+
+    return {
+        "k": k,
+        "num_queries": num_queries,
+        "recall_at_k": round(float(recall), 4),
+        "flat_latency_ms": round(flat_latency * 1000, 3),
+        "index_latency_ms": round(ann_latency * 1000, 3),
+        "speedup": round(flat_latency / max(ann_latency, 1e-9), 2),
+    }
+
+
+def write_vector_benchmark_report(stats: dict) -> Path:
+    """Escribe reports/vector_index_benchmark.md con recall y latencia."""
+    bench = stats["benchmark"]
+    reports_dir = ensure_dir(PROJECT_ROOT / "reports")
+    output = reports_dir / "vector_index_benchmark.md"
+    lines = [
+        "# Benchmark del índice vectorial\n\n",
+        f"- Tipo: `{stats['index_type']}`\n",
+        f"- Vectores: {stats['num_vectors']} × {stats['dimension']}\n",
+        f"- Tamaño del índice: **{stats['index_size_mb']} MB**\n",
+        f"- Consultas: {bench['num_queries']} (muestra del corpus), k={bench['k']}\n\n",
+        "| Índice | Recall@k | Latencia (ms/consulta) |\n",
+        "|--------|----------|------------------------|\n",
+        f"| flat (exacto) | 1.000 | {bench['flat_latency_ms']} |\n",
+        f"| {stats['index_type']} | {bench['recall_at_k']:.3f} | {bench['index_latency_ms']} |\n",
+        f"\nAceleración: **×{bench['speedup']}**\n",
+    ]
+    with open(output, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+    return output
+
+
+def build_vector_index(chunks: list[dict], config: dict, vector_dir: Path,
+                       vector_config: dict | None = None) -> dict:
+    """
+    Construye índice FAISS con sentence-transformers y lo guarda en `vector_dir`.
+
+    El tipo de índice (flat, ivf_flat, ivf_pq, hnsw) y sus parámetros se
+    leen de ``vector_config`` (retrieval.yml → vector_index).
 
     Returns:
         dict con estadísticas.
@@ -57,102 +209,565 @@ def build_vector_index(chunks: list[dict], config: dict) -> dict:
                                 "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
     device = emb_config.get("device", "cpu")
     batch_size = emb_config.get("batch_size", 64)
-    dimension = emb_config.get("dimension", 384)
+
+    normalize = emb_config.get("normalize", True)
 
     print(f"  Modelo: {model_name}")
     print(f"  Dispositivo: {device}")
     print(f"  Chunks a indexar: {len(chunks)}")
 
-    # Cargar modelo
-    print("  Cargando modelo de embeddings...")
-    t0 = time.time()
-    model = SentenceTransformer(model_name, device=device)
-    load_time = time.time() - t0
-    print(f"  Modelo cargado en {load_time:.1f}s")
-
-    # Generar embeddings
+    # Consultar caché de embeddings (SHA-256 del contenido)
     texts = [c["content"] for c in chunks]
-    print(f"  Generando embeddings (batch_size={batch_size})...")
-    t0 = time.time()
-    embeddings = model.encode(
-        texts,
-        batch_size=batch_size,
-        show_progress_bar=True,
-        normalize_embeddings=emb_config.get("normalize", True),
-    )
-    embed_time = time.time() - t0
-    print(f"  Embeddings generados en {embed_time:.1f}s")
+    keys = [EmbeddingCache.content_key(t) for t in texts]
+    cache = None
+    if emb_config.get("cache", True):
+        cache_root = PROJECT_ROOT / config["paths"].get("embedding_cache",
+                                                        "indexes/embedding_cache")
+        cache = EmbeddingCache(cache_root, model_name, normalize)
+        hit_positions, cached, missing = cache.lookup(keys)
+        print(f"  Caché de embeddings: {len(hit_positions)} reutilizado(s), "
+              f"{len(missing)} por codificar")
+    else:
+        hit_positions, cached, missing = [], None, list(range(len(texts)))
+
+    load_time = embed_time = 0.0
+    encoded = None
+    if missing:
+        # Cargar modelo
+        print("  Cargando modelo de embeddings...")
+        t0 = time.time()
+        model = SentenceTransformer(model_name, device=device)
+        load_time = time.time() - t0
+        print(f"  Modelo cargado en {load_time:.1f}s")
+
+        # Generar embeddings
+        print(f"  Generando embeddings (batch_size={batch_size})...")
+        t0 = time.time()
+        encoded = model.encode(
+            [texts[i] for i in missing],
+            batch_size=batch_size,
+            show_progress_bar=True,
+            normalize_embeddings=normalize,
+        )
+        embed_time = time.time() - t0
+        print(f"  Embeddings generados en {embed_time:.1f}s")
+
+    dim = encoded.shape[1] if encoded is not None else cached.shape[1]
+    embeddings = np.empty((len(texts), dim), dtype="float32")
+    if hit_positions:
+        embeddings[hit_positions] = cached
+    if missing:
+        embeddings[missing] = encoded
+
+    if cache is not None:
+        cache.save(keys, embeddings)
 
     # Construir índice FAISS
-    print("  Construyendo índice FAISS...")
-    embeddings_np = np.array(embeddings, dtype="float32")
-    index = faiss.IndexFlatIP(embeddings_np.shape[1])  # Inner product (coseno si normalizado)
-    index.add(embeddings_np)
+    vector_config = vector_config or {}
+    print(f"  Construyendo índice FAISS ({vector_config.get('type', 'flat')})...")
+    embeddings_np = np.ascontiguousarray(embeddings, dtype="float32")
+    t0 = time.time()
+    index, index_type = create_faiss_index(embeddings_np, vector_config)
+    build_time = time.time() - t0
 
     # Guardar
-    vector_dir = ensure_dir(PROJECT_ROOT / config["paths"]["vector_index"])
-    faiss.write_index(index, str(vector_dir / "index.faiss"))
+    ensure_dir(vector_dir)
+    tmp_index = vector_dir / "index.tmp.faiss"
+    faiss.write_index(index, str(tmp_index))
+    os.replace(tmp_index, vector_dir / "index.faiss")
 
     # Guardar mapping chunk_id → posición
-    chunk_ids = [c["chunk_id"] for c in chunks]
-    with open(vector_dir / "chunk_ids.pkl", "wb") as f:
-        pickle.dump(chunk_ids, f)
-
-    # Guardar metadatos de chunks
-    meta_dir = ensure_dir(PROJECT_ROOT / config["paths"]["metadata_store"])
-    chunk_metadata = {c["chunk_id"]: {k: v for k, v in c.items() if k != "content"}
-                      for c in chunks}
-    with open(meta_dir / "chunks_metadata.json", "w", encoding="utf-8") as f:
-        json.dump(chunk_metadata, f, indent=2, ensure_ascii=False)
+    save_chunk_ids(vector_dir / "chunk_ids.npy", [c["chunk_id"] for c in chunks])
 
     stats = {
         "model": model_name,
         "dimension": embeddings_np.shape[1],
         "num_vectors": index.ntotal,
+        "index_type": index_type,
         "load_time_s": round(load_time, 1),
         "embed_time_s": round(embed_time, 1),
+        "embeddings_cached": len(hit_positions),
+        "embeddings_encoded": len(missing),
+        "build_time_s": round(build_time, 1),
         "index_size_mb": round(
             (vector_dir / "index.faiss").stat().st_size / 1024 / 1024, 2
         ),
     }
 
+    if index_type != "flat" and vector_config.get("benchmark", {}).get("enabled", True):
+        print("  Evaluando recall/latencia frente a flat...")
+        stats["benchmark"] = benchmark_vector_index(index, embeddings_np, vector_config)
+        report = write_vector_benchmark_report(stats)
+        print(f"  Recall@{stats['benchmark']['k']}: {stats['benchmark']['recall_at_k']:.3f}, "
+              f"×{stats['benchmark']['speedup']} más rápido → {report.name}")
+
     return stats
 
 
-def build_bm25_index(chunks: list[dict], config: dict) -> dict | None:
-    """Construye índice BM25 (opcional)."""
+INDEX_FORMAT_VERSION = 1
+
+# Puntero a la build publicada (en paths.indexes)
+INDEX_POINTER = "current.json"
+INDEX_KINDS = ("vector_index", "bm25_index", "metadata_store")
+
+
+def save_npy(path: Path, arr: np.ndarray):
+    """
+    np.save atómico (tmp + os.replace): quien tenga mapeado el archivo
+    anterior conserva su inodo en lugar de verlo truncado.
+    """
+    tmp = path.with_name(f"{path.stem}.tmp.npy")
+    np.save(tmp, arr, allow_pickle=False)
+    os.replace(tmp, path)
+
+
+def save_json(path: Path, data: dict):
+    """json.dump atómico (tmp + os.replace)."""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def new_build_id() -> str:
+    return datetime.now().strftime("build-%Y%m%d-%H%M%S-%f")
+
+
+def read_index_pointer(config: dict) -> dict | None:
+    """Contenido de indexes/current.json, o None si no hay build publicada."""
+    path = PROJECT_ROOT / config["paths"].get("indexes", "indexes") / INDEX_POINTER
     try:
-        from rank_bm25 import BM25Okapi
-    except ImportError:
-        print("  [INFO] rank-bm25 no instalado. BM25 omitido.")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
         return None
 
+
+def build_dirs(config: dict, build_id: str | None) -> dict[str, Path]:
+    """
+    Directorio de cada índice (vector_index, bm25_index, metadata_store) para una build.
+    Sin build (índices anteriores a las builds versionadas) se usa la raíz.
+    """
+    dirs = {}
+    for kind in INDEX_KINDS:
+        root = PROJECT_ROOT / config["paths"][kind]
+        dirs[kind] = root / build_id if build_id else root
+    return dirs
+
+
+def current_index_dirs(config: dict) -> tuple[str | None, dict[str, Path]]:
+    """(build publicada, sus directorios) según indexes/current.json."""
+    pointer = read_index_pointer(config)
+    build_id = pointer.get("build_id") if pointer else None
+    return build_id, build_dirs(config, build_id)
+
+
+def publish_build(config: dict, build_id: str, info: dict | None = None):
+    """
+    Publica la build (reescritura atómica del puntero) y elimina las builds
+    antiguas salvo la anterior, que algún lector puede estar aún cargando
+    (y las posteriores a esta, que pueden estar construyéndose). Los lectores que ya tienen mapeados archivos borrados los conservan
+    (el inodo sigue vivo hasta que los cierran).
+    """
+    previous = read_index_pointer(config) or {}
+    pointer_path = ensure_dir(PROJECT_ROOT / config["paths"].get("indexes", "indexes")) / INDEX_POINTER
+    save_json(pointer_path, {"build_id": build_id,
+                             "published_at": datetime.now().isoformat(timespec="seconds"),
+                             **(info or {})})
+
+    keep = {build_id, previous.get("build_id")}
+    for kind in INDEX_KINDS:
+        root = PROJECT_ROOT / config["paths"][kind]
+        if not root.exists():
+            continue
+        for old in root.iterdir():
+            if (old.is_dir() and old.name.startswith("build-")
+                    and old.name < build_id and old.name not in keep):
+                shutil.rmtree(old, ignore_errors=True)
+        # Archivos del formato sin builds en la raíz: ya no los lee nadie nuevo
+        for legacy in root.iterdir():
+            if legacy.is_file() and legacy.suffix in (".npy", ".faiss", ".json", ".pkl"):
+                legacy.unlink(missing_ok=True)
+
+
+def tokenize(text: str) -> list[str]:
+    """Tokenización BM25 (minúsculas + espacios), compartida por índice y consultas."""
+    return text.lower().split()
+
+
+def save_chunk_ids(path: Path, chunk_ids: list[str]):
+    """Guarda el mapping posición → chunk_id como array .npy de ancho fijo."""
+    save_npy(path, np.array(chunk_ids, dtype=str))
+
+
+def load_chunk_ids(path: Path) -> np.ndarray:
+    """Abre el mapping posición → chunk_id en modo memory-mapped."""
+    return np.load(path, mmap_mode="r", allow_pickle=False)
+
+
+class SortedVocab:
+    """
+    Vocabulario BM25 en disco: términos UTF-8 ordenados en un blob + offsets.
+
+    El id de un término es su posición en el orden binario, así que la
+    búsqueda es binaria sobre el blob memory-mapped, sin construir un dict.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _term(self, i: int) -> bytes:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def get(self, term: str, default=None):
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self._term(lo) == key:
+            return lo
+        return default
+
+
+class BM25Index:
+    """
+    Índice BM25 (Okapi) sobre un índice invertido en formato CSR.
+
+    Los postings de cada término son los tramos
+    ``doc_ids[indptr[t]:indptr[t+1]]`` / ``tfs[...]``, de modo que una
+    consulta solo toca los documentos que contienen sus términos.
+    Reproduce las puntuaciones de ``rank_bm25.BM25Okapi``.
+
+    En disco se guarda como arrays .npy planos (ver ``save``/``load``),
+    abiertos con ``mmap_mode="r"``: sin pickle y con page cache compartida
+    entre procesos.
+    """
+
+    ARRAYS = ("indptr", "doc_ids", "tfs", "doc_len", "idf")
+    META_FILE = "bm25_meta.json"
+
+    def __init__(self, vocab, indptr: np.ndarray, doc_ids: np.ndarray,
+                 tfs: np.ndarray, doc_len: np.ndarray, idf: np.ndarray,
+                 k1: float = 1.5, b: float = 0.75, avgdl: float | None = None):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.idf = idf
+        self.k1 = k1
+        self.b = b
+        if avgdl is None:
+            avgdl = float(doc_len.mean()) if len(doc_len) else 0.0
+        self.avgdl = avgdl
+
+    @classmethod
+    def build(cls, corpus: list[list[str]], k1: float = 1.5, b: float = 0.75,
+              epsilon: float = 0.25) -> "BM25Index":
+        """Construye el índice a partir de documentos ya tokenizados."""
+        vocab: dict[str, int] = {}
+        term_col, doc_col, tf_col = [], [], []
+        doc_len = np.zeros(len(corpus), dtype=np.int32)
+
+        for doc_idx, tokens in enumerate(corpus):
+            doc_len[doc_idx] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_col.append(vocab.setdefault(term, len(vocab)))
+                doc_col.append(doc_idx)
+                tf_col.append(tf)
+
+        # Reasignar ids en orden binario UTF-8 (requisito de SortedVocab)
+        sorted_terms = sorted(vocab, key=lambda t: t.encode("utf-8"))
+        remap = np.empty(len(vocab), dtype=np.int64)
+        for new_id, term in enumerate(sorted_terms):
+            remap[vocab[term]] = new_id
+        vocab = {term: i for i, term in enumerate(sorted_terms)}
+
+        terms = remap[np.asarray(term_col, dtype=np.int64)]
+        order = np.argsort(terms, kind="stable")  # postings ordenados por doc
+        doc_ids = np.asarray(doc_col, dtype=np.int32)[order]
+        tfs = np.asarray(tf_col, dtype=np.float32)[order]
+        df = np.bincount(terms, minlength=len(vocab))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        # IDF de Okapi; los negativos se sustituyen por epsilon * idf medio
+        n_docs = len(corpus)
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = epsilon * idf.mean()
+
+        return cls(vocab, indptr, doc_ids, tfs, doc_len,
+                   idf.astype(np.float32), k1=k1, b=b)
+
+    def save(self, directory: Path):
+        """Guarda el índice como arrays .npy + bm25_meta.json versionado (escrituras atómicas)."""
+        ensure_dir(directory)
+        for name in self.ARRAYS:
+            save_npy(directory / f"{name}.npy", getattr(self, name))
+
+        encoded = [t.encode("utf-8") for t in sorted(self.vocab, key=self.vocab.get)]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in encoded], out=offsets[1:])
+        save_npy(directory / "vocab_blob.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        save_npy(directory / "vocab_offsets.npy", offsets)
+
+        meta = {
+            "format": "bm25-csr",
+            "version": INDEX_FORMAT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "avgdl": self.avgdl,
+            "num_documents": len(self),
+            "num_terms": len(self.vocab),
+            "num_postings": len(self.doc_ids),
+        }
+        # El meta se publica el último: sin él el índice no se considera presente
+        save_json(directory / self.META_FILE, meta)
+
+    @classmethod
+    def load(cls, directory: Path) -> "BM25Index":
+        """Abre un índice guardado con ``save`` en modo memory-mapped."""
+        with open(directory / cls.META_FILE, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != "bm25-csr" or meta.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Formato BM25 no soportado: {meta.get('format')} "
+                             f"v{meta.get('version')}. Ejecute: make index")
+
+        def _open(name):
+            return np.load(directory / f"{name}.npy", mmap_mode="r", allow_pickle=False)
+
+        vocab = SortedVocab(_open("vocab_blob"), _open("vocab_offsets"))
+        return cls(vocab, *(_open(name) for name in cls.ARRAYS),
+                   k1=meta["k1"], b=meta["b"], avgdl=meta["avgdl"])
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def _term_postings(self, term_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """(documentos, contribución BM25 del término en cada uno)."""
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        d = self.doc_ids[start:end]
+        tf = self.tfs[start:end]
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[d] / self.avgdl)
+        return d, self.idf[term_id] * tf * (self.k1 + 1) / (tf + norm)
+
+    def search(self, tokens: list[str], top_k: int = 8) -> list[tuple[int, float]]:
+        """
+        Puntúa solo los documentos que contienen algún término de la consulta.
+
+        Returns:
+            Lista de (posición del documento, score) con score > 0, ordenada.
+        """
+        return self.search_batch([tokens], top_k)[0]
+
+    def search_batch(self, queries: list[list[str]],
+                     top_k: int = 8) -> list[list[tuple[int, float]]]:
+        """
+        Puntúa varias consultas a la vez: los postings de cada término se leen
+        y puntúan una sola vez aunque aparezca en varias consultas, y la suma
+        por (consulta, documento) se hace con un único bincount.
+
+        Returns:
+            Una lista por consulta, como en ``search``.
+        """
+        results: list[list[tuple[int, float]]] = [[] for _ in queries]
+        if top_k <= 0:
+            return results
+
+        postings: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+        keys, contribs = [], []
+        n_docs = len(self)
+        for q, tokens in enumerate(queries):
+            for term_id in (self.vocab.get(t) for t in tokens):
+                if term_id is None:
+                    continue
+                if term_id not in postings:
+                    postings[term_id] = self._term_postings(term_id)
+                d, contrib = postings[term_id]
+                # Clave única por (consulta, documento)
+                keys.append(d.astype(np.int64) + q * n_docs)
+                contribs.append(contrib)
+        if not keys:
+            return results
+
+        touched, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contribs))
+        # touched está ordenado: los documentos de cada consulta son un tramo contiguo
+        bounds = np.searchsorted(touched, np.arange(len(queries) + 1, dtype=np.int64) * n_docs)
+
+        for q in range(len(queries)):
+            lo, hi = bounds[q], bounds[q + 1]
+            if lo == hi:
+                continue
+            q_scores = scores[lo:hi]
+            if len(q_scores) > top_k:
+                top = np.argpartition(-q_scores, top_k - 1)[:top_k]
+            else:
+                top = np.arange(len(q_scores))
+            top = top[np.argsort(-q_scores[top], kind="stable")]
+            results[q] = [(int(touched[lo + i] - q * n_docs), float(q_scores[i]))
+                          for i in top if q_scores[i] > 0]
+        return results
+
+
+def build_bm25_index(chunks: list[dict], bm25_dir: Path) -> dict | None:
+    """Construye el índice BM25 invertido y lo guarda en formato .npy en `bm25_dir`."""
     print("  Construyendo índice BM25...")
     t0 = time.time()
 
-    # Tokenizar por espacios (simple)
-    corpus = [c["content"].lower().split() for c in chunks]
-    bm25 = BM25Okapi(corpus)
-
-    bm25_dir = ensure_dir(PROJECT_ROOT / config["paths"]["bm25_index"])
-    with open(bm25_dir / "bm25_index.pkl", "wb") as f:
-        pickle.dump(bm25, f)
+    bm25 = BM25Index.build([tokenize(c["content"]) for c in chunks])
 
-    # Guardar chunk_ids en orden
-    chunk_ids = [c["chunk_id"] for c in chunks]
-    with open(bm25_dir / "chunk_ids.pkl", "wb") as f:
-        pickle.dump(chunk_ids, f)
+    ensure_dir(bm25_dir)
+    # chunk_ids antes que bm25_meta.json (que marca el índice como completo)
+    save_chunk_ids(bm25_dir / "chunk_ids.npy", [c["chunk_id"] for c in chunks])
+    bm25.save(bm25_dir)
 
     bm25_time = time.time() - t0
-    print(f"  BM25 construido en {bm25_time:.1f}s")
+    print(f"  BM25 construido en {bm25_time:.1f}s "
+          f"({len(bm25.vocab)} términos, {len(bm25.doc_ids)} postings)")
 
     return {
         "num_documents": len(chunks),
+        "num_terms": len(bm25.vocab),
+        "num_postings": len(bm25.doc_ids),
         "build_time_s": round(bm25_time, 1),
     }
 
 
-def main():
+class ChunkStore:
+    """
+    Almacén columnar de chunks indexado por fila (misma posición que FAISS/BM25).
+
+    El contenido y los metadatos (JSON compacto) de cada chunk viven en
+    blobs UTF-8 con arrays de offsets, abiertos en modo memory-mapped, de
+    modo que solo se decodifican las filas que se consultan. Con small-to-big
+    los chunks padre (no indexados) ocupan las filas posteriores.
+    """
+
+    META_FILE = "chunk_store.json"
+
+    def __init__(self, directory: Path):
+        with open(directory / self.META_FILE, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != "chunk-store" or meta.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Formato de chunk store no soportado: {meta.get('format')} "
+                             f"v{meta.get('version')}. Ejecute: make index")
+
+        def _open(name):
+            return np.load(directory / f"{name}.npy", mmap_mode="r", allow_pickle=False)
+
+        self.content_blob = _open("content_blob")
+        self.content_offsets = _open("content_offsets")
+        self.meta_blob = _open("meta_blob")
+        self.meta_offsets = _open("meta_offsets")
+        self.chunk_ids = _open("chunk_ids")
+        self.sorted_ids = _open("sorted_ids")
+        self.sorted_rows = _open("sorted_rows")
+
+    @classmethod
+    def write(cls, chunks: list[dict], directory: Path) -> dict:
+        """
+        Escribe el almacén a partir de la lista de chunks (en orden de índice).
+        Cada array se reemplaza de forma atómica y chunk_store.json, que marca
+        el almacén como completo, se escribe el último.
+        """
+        ensure_dir(directory)
+
+        def _save_blob(name, parts):
+            offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+            np.cumsum([len(p) for p in parts], out=offsets[1:])
+            save_npy(directory / f"{name}_blob.npy", np.frombuffer(b"".join(parts), dtype=np.uint8))
+            save_npy(directory / f"{name}_offsets.npy", offsets)
+            return int(offsets[-1])
+
+        content_bytes = _save_blob("content", [c["content"].encode("utf-8") for c in chunks])
+        meta_bytes = _save_blob("meta", [
+            json.dumps({k: v for k, v in c.items() if k != "content"},
+                       ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            for c in chunks
+        ])
+
+        ids = np.array([c["chunk_id"] for c in chunks], dtype=str)
+        order = np.argsort(ids, kind="stable")
+        save_npy(directory / "chunk_ids.npy", ids)
+        save_npy(directory / "sorted_ids.npy", ids[order])
+        save_npy(directory / "sorted_rows.npy", order.astype(np.int64))
+
+        meta = {
+            "format": "chunk-store",
+            "version": INDEX_FORMAT_VERSION,
+            "num_chunks": len(chunks),
+            "content_bytes": content_bytes,
+            "metadata_bytes": meta_bytes,
+        }
+        save_json(directory / cls.META_FILE, meta)
+        return meta
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def row(self, chunk_id: str) -> int | None:
+        """Devuelve la fila de un chunk_id (búsqueda binaria) o None."""
+        pos = int(np.searchsorted(self.sorted_ids, chunk_id))
+        if pos < len(self.sorted_ids) and self.sorted_ids[pos] == chunk_id:
+            return int(self.sorted_rows[pos])
+        return None
+
+    def content(self, row: int) -> str:
+        start, end = self.content_offsets[row], self.content_offsets[row + 1]
+        return self.content_blob[start:end].tobytes().decode("utf-8")
+
+    def metadata(self, row: int) -> dict:
+        start, end = self.meta_offsets[row], self.meta_offsets[row + 1]
+        return json.loads(self.meta_blob[start:end].tobytes())
+
+    def get(self, chunk_id: str) -> tuple[str, dict]:
+        """Contenido y metadatos de un chunk; ("", {}) si no existe."""
+        row = self.row(chunk_id)
+        if row is None:
+            return "", {}
+        return self.content(row), self.metadata(row)
+
+    def get_expanded(self, chunk_id: str) -> tuple[str, str, dict]:
+        """
+        (chunk_id, contenido, metadatos) del chunk o, si es un micro-chunk
+        de small-to-big, de su chunk padre.
+        """
+        content, meta = self.get(chunk_id)
+        parent_id = meta.get("parent_id")
+        if parent_id:
+            parent_content, parent_meta = self.get(parent_id)
+            if parent_meta:
+                return parent_id, parent_content, parent_meta
+        return chunk_id, content, meta
+
+
+def build_chunk_store(chunks: list[dict], meta_dir: Path) -> dict:
+    """Construye el almacén columnar de contenido y metadatos de chunks en `meta_dir`."""
+    return ChunkStore.write(chunks, meta_dir)
+
+
+def main(full: bool = False):
+    """
+    Indexa chunks.jsonl (FAISS + chunk store + BM25).
+
+    Los índices se reconstruyen enteros en cada build; la parte incremental
+    es la caché de embeddings: los chunks sin cambios no se vuelven a
+    codificar, así que reindexar tras añadir un documento solo codifica sus
+    chunks nuevos.
+
+    Args:
+        full: Si True, reindexa aunque chunks.jsonl no haya cambiado.
+    """
     print_header("INDEXACIÓN VECTORIAL + BM25")
     require_pdfs("indexación")
 
@@ -164,34 +779,82 @@ def main():
         print("  Ejecute primero: make chunk")
         return
 
+    retrieval_config_path = PROJECT_ROOT / "configs" / "retrieval.yml"
+    import yaml
+    with open(retrieval_config_path, "r") as f:
+        retrieval_config = yaml.safe_load(f)
+
+    # Incremental: si chunks.jsonl y la configuración no cambiaron, no hay nada que hacer
+    ledger = PipelineLedger()
+    chunks_hash = sha256_file(chunks_path)
+    index_rules = config_hash({
+        "embeddings": config.get("embeddings", {}),
+        "vector_index": retrieval_config.get("vector_index", {}),
+        "mode": retrieval_config.get("search", {}).get("mode", "vector"),
+    })
+    _, current_dirs = current_index_dirs(config)
+    vector_path = current_dirs["vector_index"] / "index.faiss"
+    store_path = current_dirs["metadata_store"] / ChunkStore.META_FILE
+    if (not full and ledger.index.get("chunks_hash") == chunks_hash
+            and ledger.index.get("index_rules") == index_rules
+            and vector_path.exists() and store_path.exists()):
+        print("  chunks.jsonl sin cambios desde la última indexación. Nada que hacer.")
+        print("  (use --full para forzar la reindexación)")
+        return
+
     chunks = load_chunks(chunks_path)
     if not chunks:
         print("  chunks.jsonl está vacío.")
         return
 
-    print(f"  Cargados {len(chunks)} chunks.\n")
+    # Small-to-big: los padres solo van al chunk store (tras las filas indexadas);
+    # FAISS y BM25 indexan los micro-chunks
+    parents = [c for c in chunks if c.get("chunk_type") == "parent"]
+    if parents:
+        chunks = [c for c in chunks if c.get("chunk_type") != "parent"]
+        print(f"  Cargados {len(chunks)} micro-chunks + {len(parents)} chunks padre.\n")
+    else:
+        print(f"  Cargados {len(chunks)} chunks.\n")
+
+    # Build nueva: los lectores siguen con la publicada hasta publish_build
+    build_id = new_build_id()
+    dirs = build_dirs(config, build_id)
+    print(f"  Build: {build_id}")
 
     # Vector index
-    vector_stats = build_vector_index(chunks, config)
-    print(f"\n  ✓ Índice vectorial: {vector_stats['num_vectors']} vectores, "
-          f"{vector_stats['index_size_mb']} MB")
+    vector_stats = build_vector_index(chunks, config, dirs["vector_index"],
+                                      retrieval_config.get("vector_index", {}))
+    print(f"\n  ✓ Índice vectorial ({vector_stats['index_type']}): "
+          f"{vector_stats['num_vectors']} vectores, {vector_stats['index_size_mb']} MB")
 
-    # BM25 (opcional)
-    retrieval_config_path = PROJECT_ROOT / "configs" / "retrieval.yml"
-    import yaml
-    with open(retrieval_config_path, "r") as f:
-        retrieval_config = yaml.safe_load(f)
+    store_stats = build_chunk_store(chunks + parents, dirs["metadata_store"])
+    print(f"  ✓ Chunk store: {store_stats['num_chunks']} chunks, "
+          f"{store_stats['content_bytes'] / 1024 / 1024:.2f} MB de contenido")
 
+    # BM25 (opcional)
     mode = retrieval_config.get("search", {}).get("mode", "vector")
     bm25_stats = None
     if mode in ("bm25", "hybrid"):
-        bm25_stats = build_bm25_index(chunks, config)
+        bm25_stats = build_bm25_index(chunks, dirs["bm25_index"])
         if bm25_stats:
             print(f"  ✓ Índice BM25: {bm25_stats['num_documents']} documentos")
 
+    for entry in ledger.documents.values():
+        entry.pop("vector_rows", None)  # campo de ledgers anteriores, sin uso
+    publish_build(config, build_id, {"chunks_hash": chunks_hash,
+                                     "num_vectors": vector_stats["num_vectors"]})
+    ledger.index.update({
+        "chunks_hash": chunks_hash,
+        "index_rules": index_rules,
+        "num_vectors": vector_stats["num_vectors"],
+        "build_id": build_id,
+    })
+    ledger.save()
+    save_hash_cache()
+
     print("\n  Indexación completada.")
     print("  Siguiente paso: make reports  (o  make serve  para usar)")
 
 
 if __name__ == "__main__":
-    main()
+    main(full="--full" in sys.argv[1:])
@@ -5,11 +5,27 @@ app/ingest.py — Pipeline de ingesta de PDFs
 Detecta PDFs nuevos en data/incoming_pdfs/, los valida y mueve
 a data/01_raw_pdfs/ para su procesamiento.
 
+Los duplicados se detectan por contenido (SHA-256) contra un registro de
+todos los PDFs ingeridos, no por nombre: una copia renombrada del mismo
+archivo se descarta aunque su nombre no coincida con ninguno existente.
+
+Descargas:
+    <nombre>.pdf.tmp.hdr   marcador de descarga parcial → el PDF se omite
+    <nombre>.pdf.sha256    hash del PDF ("<hex>  ruta") → se usa como hash del
+                           registro sin releer el PDF o, con
+                           ingest.verify_sidecar, se verifica con el mismo
+                           hash que usa el registro (una sola lectura)
+
+Al ingerir o descartar un PDF sus archivos acompañantes se borran de
+incoming_pdfs/.
+
 Uso:
     python -m app.ingest
     make ingest
 """
 
+import json
+import os
 import shutil
 import sys
 from pathlib import Path
@@ -17,6 +33,8 @@ from pathlib import Path
 from app.utils import (
     load_config,
     require_pdfs,
+    register_file_hash,
+    save_hash_cache,
     sha256_file,
     timestamp,
     ensure_dir,
@@ -25,6 +43,38 @@ from app.utils import (
 )
 
 
+PARTIAL_MARKER_SUFFIX = ".tmp.hdr"
+SIDECAR_SUFFIX = ".sha256"
+
+
+def is_partial_download(filepath: Path) -> bool:
+    """True si la descarga del PDF aún no ha terminado (existe su .tmp.hdr)."""
+    return filepath.with_name(filepath.name + PARTIAL_MARKER_SUFFIX).exists()
+
+
+def read_sidecar_hash(filepath: Path) -> str | None:
+    """Hash SHA-256 esperado según <nombre>.pdf.sha256 (formato sha256sum), o None."""
+    sidecar = filepath.with_name(filepath.name + SIDECAR_SUFFIX)
+    if not sidecar.exists():
+        return None
+    try:
+        with open(sidecar, "r", encoding="utf-8") as f:
+            fields = f.read().split()
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"  [WARN] No se pudo leer {sidecar.name}: {e}")
+        return None
+    if not fields or len(fields[0]) != 64:
+        print(f"  [WARN] Formato inválido en {sidecar.name}. Se ignora.")
+        return None
+    return fields[0].lower()
+
+
+def remove_companions(filepath: Path):
+    """Borra el .sha256 y el .tmp.hdr de un PDF que ya salió de incoming_pdfs/."""
+    for suffix in (SIDECAR_SUFFIX, PARTIAL_MARKER_SUFFIX):
+        filepath.with_name(filepath.name + suffix).unlink(missing_ok=True)
+
+
 def validate_pdf(filepath: Path) -> bool:
     """Valida que un archivo sea un PDF válido (magic bytes)."""
     try:
@@ -36,6 +86,47 @@ def validate_pdf(filepath: Path) -> bool:
         return False
 
 
+def load_registry(registry_path: Path, raw_dir: Path) -> dict:
+    """
+    Carga el registro de contenido {sha256: {"file", "ingested_at", "aliases"}}
+    reconciliado con los PDFs presentes en 01_raw_pdfs/.
+
+    El mapa hash → archivo se reconstruye siempre desde disco (los hashes
+    salen de la caché de sha256_file), de modo que archivos borrados o
+    sustituidos a mano nunca dejan entradas obsoletas; del registro guardado
+    solo se conservan la fecha de ingesta y los alias descartados.
+    """
+    stored = {}
+    if registry_path.exists():
+        with open(registry_path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+
+    registry = {}
+    raw_pdfs = sorted(list(raw_dir.glob("*.pdf")) + list(raw_dir.glob("*.PDF")))
+    for pdf in raw_pdfs:
+        file_hash = sha256_file(pdf)
+        previous = stored.get(file_hash, {})
+        if file_hash in registry:
+            # Duplicado ya presente en 01_raw_pdfs/ (ingerido antes del registro)
+            registry[file_hash]["aliases"].append(pdf.name)
+            continue
+        registry[file_hash] = {
+            "file": pdf.name,
+            "ingested_at": previous.get("ingested_at"),
+            "aliases": list(previous.get("aliases", [])),
+        }
+    return registry
+
+
+def save_registry(registry_path: Path, registry: dict):
+    """Guarda el registro de contenido de forma atómica."""
+    ensure_dir(registry_path.parent)
+    tmp = registry_path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(registry, f, indent=1, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp, registry_path)
+
+
 def ingest_pdfs() -> list[dict]:
     """
     Procesa PDFs desde incoming_pdfs/ hacia 01_raw_pdfs/.
@@ -47,6 +138,7 @@ def ingest_pdfs() -> list[dict]:
     incoming = PROJECT_ROOT / config["paths"]["incoming_pdfs"]
     raw_dir = PROJECT_ROOT / config["paths"]["raw_pdfs"]
     ensure_dir(raw_dir)
+    verify_sidecar = (config.get("ingest") or {}).get("verify_sidecar", False)
 
     pdfs = sorted(
         list(incoming.glob("*.pdf")) + list(incoming.glob("*.PDF"))
@@ -56,12 +148,25 @@ def ingest_pdfs() -> list[dict]:
         print("  No hay PDFs nuevos en incoming_pdfs/.")
         return []
 
+    registry_path = PROJECT_ROOT / config["paths"].get("ingest_registry",
+                                                       "data/ingest_registry.json")
+    registry = load_registry(registry_path, raw_dir)
+
     results = []
     print(f"  Encontrados {len(pdfs)} PDF(s) nuevos.\n")
 
     for pdf in pdfs:
         print(f"  📄 {pdf.name}")
 
+        if is_partial_download(pdf):
+            print(f"    ⏳ Descarga en curso ({pdf.name}{PARTIAL_MARKER_SUFFIX}). Omitido.")
+            results.append({
+                "file": pdf.name,
+                "status": "partial",
+                "reason": "Descarga incompleta",
+            })
+            continue
+
         # Validar
         if not validate_pdf(pdf):
             print(f"    ✗ No es un PDF válido. Omitido.")
@@ -72,44 +177,80 @@ def ingest_pdfs() -> list[dict]:
             })
             continue
 
-        # Calcular hash
-        file_hash = sha256_file(pdf)
+        # Hash del .sha256 si lo hay; si no (o al verificarlo), una lectura
+        # que queda en la caché para extract
+        expected_hash = read_sidecar_hash(pdf)
+        if expected_hash and not verify_sidecar:
+            file_hash = expected_hash
+        else:
+            file_hash = sha256_file(pdf)
         dest = raw_dir / pdf.name
 
-        # Comprobar duplicados
+        if expected_hash and expected_hash != file_hash:
+            print(f"    ✗ Hash distinto al de {pdf.name}{SIDECAR_SUFFIX} "
+                  f"(esperado {expected_hash[:12]}..., real {file_hash[:12]}...). Omitido.")
+            results.append({
+                "file": pdf.name,
+                "status": "corrupt",
+                "reason": "No coincide con el hash .sha256",
+                "hash": file_hash,
+                "expected_hash": expected_hash,
+            })
+            continue
+
+        # Comprobar duplicados por contenido, con independencia del nombre
+        original = registry.get(file_hash)
+        if original:
+            print(f"    ⚠ Contenido idéntico a {original['file']}. Omitido.")
+            # Eliminar de incoming para no reprocesar
+            pdf.unlink()
+            remove_companions(pdf)
+            if pdf.name != original["file"] and pdf.name not in original["aliases"]:
+                original["aliases"].append(pdf.name)
+            results.append({
+                "file": pdf.name,
+                "status": "duplicate",
+                "hash": file_hash,
+                "duplicate_of": original["file"],
+            })
+            continue
+
         if dest.exists():
-            existing_hash = sha256_file(dest)
-            if existing_hash == file_hash:
-                print(f"    ⚠ Ya existe (mismo hash). Omitido.")
-                # Eliminar de incoming para no reprocesar
-                pdf.unlink()
-                results.append({
-                    "file": pdf.name,
-                    "status": "duplicate",
-                    "hash": file_hash,
-                })
-                continue
-            else:
-                # Archivo con mismo nombre pero contenido diferente
-                stem = pdf.stem
-                suffix = pdf.suffix
-                ts = timestamp()
-                dest = raw_dir / f"{stem}_{ts}{suffix}"
-                print(f"    ℹ Nombre duplicado, renombrado a: {dest.name}")
+            # Archivo con mismo nombre pero contenido diferente
+            stem = pdf.stem
+            suffix = pdf.suffix
+            ts = timestamp()
+            dest = raw_dir / f"{stem}_{ts}{suffix}"
+            print(f"    ℹ Nombre duplicado, renombrado a: {dest.name}")
 
         # Mover
         shutil.move(str(pdf), str(dest))
+        remove_companions(pdf)
+        # Si el movimiento cruzó de sistema de archivos (copia), el inodo
+        # cambia: registrar el hash evita que extract vuelva a leer el PDF
+        register_file_hash(dest, file_hash)
         size_kb = dest.stat().st_size / 1024
-        print(f"    ✓ Movido a 01_raw_pdfs/ ({size_kb:.1f} KB, hash: {file_hash[:12]}...)")
+        verified = ""
+        if expected_hash:
+            verified = " ✓ .sha256" if verify_sidecar else " de .sha256"
+        print(f"    ✓ Movido a 01_raw_pdfs/ ({size_kb:.1f} KB, hash: {file_hash[:12]}...{verified})")
 
+        registry[file_hash] = {
+            "file": dest.name,
+            "ingested_at": timestamp(),
+            "aliases": [],
+        }
         results.append({
             "file": dest.name,
             "status": "ingested",
             "hash": file_hash,
+            "sidecar_verified": expected_hash is not None and verify_sidecar,
+            "hash_from_sidecar": expected_hash is not None and not verify_sidecar,
             "size_bytes": dest.stat().st_size,
             "destination": str(dest.relative_to(PROJECT_ROOT)),
         })
 
+    save_registry(registry_path, registry)
     return results
 
 
@@ -117,11 +258,17 @@ def main():
     print_header("INGESTA DE PDFs")
     require_pdfs("ingesta")
     results = ingest_pdfs()
+    save_hash_cache()
 
     # Resumen
     ingested = sum(1 for r in results if r["status"] == "ingested")
     skipped = sum(1 for r in results if r["status"] != "ingested")
     print(f"\n  Resultado: {ingested} ingresado(s), {skipped} omitido(s).")
+    for status, label in (("partial", "descarga incompleta"),
+                          ("corrupt", "hash .sha256 no coincide")):
+        count = sum(1 for r in results if r["status"] == status)
+        if count:
+            print(f"    {count} por {label} (se reintentarán en la próxima ingesta)")
     print("  Siguiente paso: make extract")
 
 
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+app/ledger.py — Ledger de estado por documento del pipeline
+
+Registra, para cada documento (clave: stem del PDF), la cadena de hashes
+de cada etapa para que el pipeline solo reprocese lo que cambió:
+
+    source_hash (PDF) → extracted_hash (02_extracted_md)
+      → cleaned_from / cleaned_hash (03_clean_md)
+      → chunked_from / chunk_ids (chunks.jsonl)
+
+Los índices se registran a nivel de corpus (chunks_hash de chunks.jsonl):
+se reconstruyen enteros y solo la caché de embeddings evita recodificar
+los chunks sin cambios.
+
+Las decisiones de omitir una etapa siempre comparan el hash real del
+archivo de entrada con el registrado, de modo que un ledger desfasado
+(p. ej. tras restaurar un backup) solo provoca reprocesado, nunca
+resultados incorrectos.
+"""
+
+import json
+import os
+from pathlib import Path
+
+from app.utils import load_config, ensure_dir, sha256_text, PROJECT_ROOT
+
+LEDGER_VERSION = 1
+
+
+def config_hash(config: dict) -> str:
+    """Hash estable de un bloque de configuración (para invalidar etapas)."""
+    return sha256_text(json.dumps(config, sort_keys=True, ensure_ascii=False))[:16]
+
+
+class PipelineLedger:
+    """Ledger JSON con el estado por documento y de los índices."""
+
+    def __init__(self, path: Path | None = None):
+        if path is None:
+            config = load_config()
+            path = PROJECT_ROOT / config["paths"].get("pipeline_state",
+                                                      "data/pipeline_state.json")
+        self.path = path
+        self.data = {"version": LEDGER_VERSION, "documents": {}, "index": {}}
+
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == LEDGER_VERSION:
+                self.data = data
+            else:
+                print("  [INFO] Ledger de pipeline con versión distinta. Se regenera.")
+
+    @property
+    def documents(self) -> dict:
+        return self.data["documents"]
+
+    @property
+    def index(self) -> dict:
+        return self.data.setdefault("index", {})
+
+    def doc(self, name: str) -> dict:
+        """Entrada del documento (se crea si no existe)."""
+        return self.documents.setdefault(name, {})
+
+    def prune(self, current: set[str], stage_dirs: list[Path]) -> list[str]:
+        """
+        Elimina del ledger los documentos que ya no existen en origen y borra
+        sus artefactos derivados (<stem>.md) de los directorios indicados.
+
+        Returns:
+            Lista de documentos eliminados.
+        """
+        removed = sorted(set(self.documents) - current)
+        for name in removed:
+            for directory in stage_dirs:
+                (directory / f"{name}.md").unlink(missing_ok=True)
+            del self.documents[name]
+        return removed
+
+    def save(self):
+        """Guarda el ledger de forma atómica."""
+        ensure_dir(self.path.parent)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=1, ensure_ascii=False)
+        os.replace(tmp, self.path)
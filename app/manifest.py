@@ -17,6 +17,7 @@ from pathlib import Path
 from app.utils import (
     load_config,
     require_pdfs,
+    save_hash_cache,
     sha256_file,
     timestamp,
     ensure_dir,
@@ -96,8 +97,11 @@ def generate_manifest() -> dict:
             "num_chunks": num_chunks,
         }
 
-    # Índices
-    vector_path = PROJECT_ROOT / config["paths"]["vector_index"] / "index.faiss"
+    # Índices (build publicada)
+    from app.index import current_index_dirs
+    build_id, index_dirs = current_index_dirs(config)
+    manifest["indexes"]["build_id"] = build_id
+    vector_path = index_dirs["vector_index"] / "index.faiss"
     if vector_path.exists():
         manifest["indexes"]["vector"] = {
             "file": "index.faiss",
@@ -105,12 +109,15 @@ def generate_manifest() -> dict:
             "hash": sha256_file(vector_path),
         }
 
-    bm25_path = PROJECT_ROOT / config["paths"]["bm25_index"] / "bm25_index.pkl"
+    bm25_dir = index_dirs["bm25_index"]
+    bm25_path = bm25_dir / "bm25_meta.json"
     if bm25_path.exists():
+        bm25_files = sorted(bm25_dir.glob("*.npy"))
         manifest["indexes"]["bm25"] = {
-            "file": "bm25_index.pkl",
-            "size_bytes": bm25_path.stat().st_size,
+            "file": "bm25_meta.json",
+            "size_bytes": sum(p.stat().st_size for p in bm25_files),
             "hash": sha256_file(bm25_path),
+            "arrays": {p.name: sha256_file(p) for p in bm25_files},
         }
 
     # Hashes de configuración
@@ -133,6 +140,7 @@ def main():
     require_pdfs("generación de manifiesto")
 
     manifest = generate_manifest()
+    save_hash_cache()
     ts = manifest["timestamp"]
 
     # Guardar
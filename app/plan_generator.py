@@ -11,113 +11,46 @@ Uso:
 """
 
 import json
-import pickle
 import sys
 from pathlib import Path
 from collections import defaultdict
 
-import numpy as np
-import yaml
-
-from app.utils import load_config, print_header, PROJECT_ROOT
+from app.retrieval import get_retriever
+from app.utils import print_header, PROJECT_ROOT
 
 
 class CorpusRetriever:
-    """Retriever ligero sin LLM — solo búsqueda vectorial + BM25."""
+    """Retriever ligero sin LLM sobre el núcleo compartido de app/retrieval.py."""
 
     def __init__(self):
-        self.config = load_config()
-        self._load_retrieval_config()
-        self._load_indexes()
-        self._load_embedder()
-
-    def _load_retrieval_config(self):
-        path = PROJECT_ROOT / "configs" / "retrieval.yml"
-        with open(path, "r", encoding="utf-8") as f:
-            self.retrieval_config = yaml.safe_load(f)
-
-    def _load_indexes(self):
-        import faiss
-        vector_dir = PROJECT_ROOT / self.config["paths"]["vector_index"]
-        self.vector_index = faiss.read_index(str(vector_dir / "index.faiss"))
-        with open(vector_dir / "chunk_ids.pkl", "rb") as f:
-            self.chunk_ids_vector = pickle.load(f)
-
-        bm25_dir = PROJECT_ROOT / self.config["paths"]["bm25_index"]
-        bm25_path = bm25_dir / "bm25_index.pkl"
-        self.bm25_index = None
-        self.chunk_ids_bm25 = None
-        if bm25_path.exists():
-            with open(bm25_path, "rb") as f:
-                self.bm25_index = pickle.load(f)
-            with open(bm25_dir / "chunk_ids.pkl", "rb") as f:
-                self.chunk_ids_bm25 = pickle.load(f)
-
-        meta_dir = PROJECT_ROOT / self.config["paths"]["metadata_store"]
-        with open(meta_dir / "chunks_metadata.json", "r", encoding="utf-8") as f:
-            self.chunks_metadata = json.load(f)
-
-        self.chunks_content = {}
-        chunks_path = PROJECT_ROOT / self.config["paths"]["chunks"] / "chunks.jsonl"
-        with open(chunks_path, "r", encoding="utf-8") as f:
-            for line in f:
-                c = json.loads(line.strip())
-                self.chunks_content[c["chunk_id"]] = c["content"]
-
-    def _load_embedder(self):
-        from sentence_transformers import SentenceTransformer
-        emb = self.config.get("embeddings", {})
-        self.embedder = SentenceTransformer(
-            emb.get("model_name", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"),
-            device=emb.get("device", "cpu"),
-        )
+        self.core = get_retriever()
+        self.core.load_indexes()
+        self.core.load_embedder()
 
     def search(self, query: str, top_k: int = 10) -> list[dict]:
         """Búsqueda híbrida RRF."""
-        # Vector
-        qe = self.embedder.encode([query], normalize_embeddings=True)
-        qnp = np.array(qe, dtype="float32")
-        scores_v, indices_v = self.vector_index.search(qnp, top_k * 2)
-        vector_results = []
-        for s, i in zip(scores_v[0], indices_v[0]):
-            if i < len(self.chunk_ids_vector):
-                vector_results.append((self.chunk_ids_vector[i], float(s)))
-
-        # BM25
-        bm25_results = []
-        if self.bm25_index and self.chunk_ids_bm25:
-            tokens = query.lower().split()
-            bm25_scores = self.bm25_index.get_scores(tokens)
-            top_idx = np.argsort(bm25_scores)[::-1][:top_k * 2]
-            for idx in top_idx:
-                if bm25_scores[idx] > 0 and idx < len(self.chunk_ids_bm25):
-                    bm25_results.append((self.chunk_ids_bm25[idx], float(bm25_scores[idx])))
-
-        # RRF
-        k = 60
-        rrf = {}
-        for rank, (cid, _) in enumerate(vector_results):
-            rrf[cid] = rrf.get(cid, 0) + 1.0 / (k + rank + 1)
-        for rank, (cid, _) in enumerate(bm25_results):
-            rrf[cid] = rrf.get(cid, 0) + 1.0 / (k + rank + 1)
-
-        sorted_r = sorted(rrf.items(), key=lambda x: x[1], reverse=True)[:top_k]
-
-        results = []
-        for cid, score in sorted_r:
-            meta = self.chunks_metadata.get(cid, {})
-            results.append({
-                "chunk_id": cid,
-                "score": round(score, 4),
-                "content": self.chunks_content.get(cid, ""),
-                "source_file": meta.get("source_file", "n/d"),
-                "section_path": meta.get("section_path", ""),
-                "page_start": meta.get("page_start", "n/d"),
-                "page_end": meta.get("page_end", "n/d"),
-                "doc_type": meta.get("doc_type", ""),
-                "frameworks": meta.get("frameworks", []),
-            })
-        return results
+        return self.search_batch([query], top_k)[0]
+
+    def search_batch(self, queries: list[str], top_k: int = 10) -> list[list[dict]]:
+        """Búsqueda híbrida RRF de varias consultas (un encode y una búsqueda por índice)."""
+        batch = self.core.hybrid_search_batch(queries, top_k=top_k * 2, final_k=top_k,
+                                              mode="hybrid")
+        return [[self._flatten(r) for r in results] for results in batch]
+
+    @staticmethod
+    def _flatten(result: dict) -> dict:
+        meta = result["metadata"]
+        return {
+            "chunk_id": result["chunk_id"],
+            "score": result["score"],
+            "content": result["content"],
+            "source_file": meta.get("source_file", "n/d"),
+            "section_path": meta.get("section_path", ""),
+            "page_start": meta.get("page_start", "n/d"),
+            "page_end": meta.get("page_end", "n/d"),
+            "doc_type": meta.get("doc_type", ""),
+            "frameworks": meta.get("frameworks", []),
+        }
 
 
 # Queries por dominio de seguridad
@@ -227,12 +160,15 @@ def generate_plan(retriever: CorpusRetriever) -> str:
     all_sources = set()
     sections = []
 
+    # Todas las consultas de todos los dominios en un solo lote
+    all_queries = [q for queries in DOMAINS.values() for q in queries]
+    batch = iter(retriever.search_batch(all_queries, top_k=6))
+
     for domain_name, queries in DOMAINS.items():
         domain_results = []
         seen_chunks = set()
 
-        for q in queries:
-            results = retriever.search(q, top_k=6)
+        for results in (next(batch) for _ in queries):
             for r in results:
                 if r["chunk_id"] not in seen_chunks:
                     domain_results.append(r)
@@ -249,7 +185,7 @@ def main():
     print("  Cargando índices y modelo de embeddings...")
 
     retriever = CorpusRetriever()
-    print(f"  ✓ {retriever.vector_index.ntotal} chunks indexados")
+    print(f"  ✓ {retriever.core.vector_index.ntotal} chunks indexados")
     print(f"  Consultando {len(DOMAINS)} dominios de seguridad...\n")
 
     sections, all_sources = generate_plan(retriever)
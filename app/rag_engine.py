@@ -2,7 +2,8 @@
 """
 app/rag_engine.py — Motor RAG principal
 
-Retrieval híbrido (FAISS vector + BM25) con generación local via llama.cpp.
+Retrieval híbrido (FAISS vector + BM25, ver app/retrieval.py) con generación
+local via llama.cpp.
 Implementa los modos: consulta, diseño y auditoría.
 
 Uso:
@@ -13,10 +14,12 @@ Uso:
 
 import argparse
 import json
-import pickle
 import sys
+import threading
 from pathlib import Path
 
+from app.retrieval import get_retriever, refresh_retriever
+from app.tokenizer import get_token_counter, llama_counter
 from app.utils import (
     load_config,
     require_pdfs,
@@ -24,90 +27,62 @@ from app.utils import (
     PROJECT_ROOT,
 )
 
+# Tokens de la plantilla de chat (BOS, marcas de rol) no incluidos en los textos
+CHAT_TEMPLATE_OVERHEAD = 32
+# Un fragmento que no cabe entero solo se recorta si quedan al menos estos tokens
+MIN_FRAGMENT_TOKENS = 64
+
 
 class RAGEngine:
     """Motor RAG con retrieval híbrido y generación local."""
 
     def __init__(self):
         self.config = load_config()
-        self.retrieval_config = self._load_retrieval_config()
-        self.vector_index = None
-        self.bm25_index = None
-        self.chunk_ids_vector = None
-        self.chunk_ids_bm25 = None
-        self.chunks_metadata = None
-        self.chunks_content = {}
-        self.embedder = None
+        self.retrieval_config = self.retriever.retrieval_config
         self.llm = None
-
-    def _load_retrieval_config(self) -> dict:
-        import yaml
-        path = PROJECT_ROOT / "configs" / "retrieval.yml"
-        with open(path, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f)
+        # llama.cpp no es thread-safe: una generación a la vez (la búsqueda no espera)
+        self.llm_lock = threading.Lock()
+        # Estimación hasta cargar el LLM; después, su tokenizador GGUF
+        self.token_counter = get_token_counter()
+        self._prompts: dict[str, tuple[str, str]] = {}
+
+    @property
+    def retriever(self):
+        # Índices y embedder compartidos con el resto del proceso (plan_generator);
+        # se resuelve en cada uso para ver las recargas de refresh_indexes
+        return get_retriever()
+
+    @property
+    def build_id(self):
+        return self.retriever.build_id
+
+    @property
+    def vector_index(self):
+        return self.retriever.vector_index
+
+    @property
+    def bm25_index(self):
+        return self.retriever.bm25_index
+
+    @property
+    def chunk_store(self):
+        return self.retriever.chunk_store
+
+    @property
+    def embedder(self):
+        return self.retriever.embedder
 
     def load_indexes(self):
         """Carga índices vectorial y BM25 desde disco."""
-        try:
-            import faiss
-        except ImportError:
-            print("[ERROR] faiss-cpu no instalado.")
-            sys.exit(1)
-
-        vector_dir = PROJECT_ROOT / self.config["paths"]["vector_index"]
-        index_path = vector_dir / "index.faiss"
-
-        if not index_path.exists():
-            print("[ERROR] Índice vectorial no encontrado. Ejecute: make index")
-            sys.exit(1)
-
-        self.vector_index = faiss.read_index(str(index_path))
-
-        with open(vector_dir / "chunk_ids.pkl", "rb") as f:
-            self.chunk_ids_vector = pickle.load(f)
-
-        # BM25 (opcional)
-        bm25_dir = PROJECT_ROOT / self.config["paths"]["bm25_index"]
-        bm25_path = bm25_dir / "bm25_index.pkl"
-        if bm25_path.exists():
-            with open(bm25_path, "rb") as f:
-                self.bm25_index = pickle.load(f)
-            with open(bm25_dir / "chunk_ids.pkl", "rb") as f:
-                self.chunk_ids_bm25 = pickle.load(f)
-
-        # Metadatos
-        meta_dir = PROJECT_ROOT / self.config["paths"]["metadata_store"]
-        meta_path = meta_dir / "chunks_metadata.json"
-        if meta_path.exists():
-            with open(meta_path, "r", encoding="utf-8") as f:
-                self.chunks_metadata = json.load(f)
-
-        # Contenido de chunks
-        chunks_path = PROJECT_ROOT / self.config["paths"]["chunks"] / "chunks.jsonl"
-        if chunks_path.exists():
-            with open(chunks_path, "r", encoding="utf-8") as f:
-                for line in f:
-                    chunk = json.loads(line.strip())
-                    self.chunks_content[chunk["chunk_id"]] = chunk["content"]
-
-        print(f"  Índices cargados: {self.vector_index.ntotal} vectores")
-        if self.bm25_index:
-            print(f"  BM25 cargado: {len(self.chunk_ids_bm25)} documentos")
+        self.retriever.load_indexes()
 
     def load_embedder(self):
         """Carga modelo de embeddings."""
-        try:
-            from sentence_transformers import SentenceTransformer
-        except ImportError:
-            print("[ERROR] sentence-transformers no instalado.")
-            sys.exit(1)
-
-        emb_config = self.config.get("embeddings", {})
-        model_name = emb_config.get("model_name",
-                                    "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-        device = emb_config.get("device", "cpu")
+        self.retriever.load_embedder()
 
-        self.embedder = SentenceTransformer(model_name, device=device)
+    def refresh_indexes(self) -> bool:
+        """Recarga los índices si se publicó una build nueva (ver refresh_retriever)."""
+        return refresh_retriever()
 
     def load_llm(self):
         """Carga LLM local via llama-cpp-python."""
@@ -133,122 +108,77 @@ class RAGEngine:
             n_threads=llm_config.get("n_threads", 4),
             verbose=False,
         )
-
-    def search_vector(self, query: str, top_k: int = 8) -> list[tuple[str, float]]:
-        """Búsqueda vectorial por similitud."""
-        if self.embedder is None:
-            self.load_embedder()
-
-        query_embedding = self.embedder.encode(
-            [query],
-            normalize_embeddings=self.config.get("embeddings", {}).get("normalize", True),
-        )
-        import numpy as np
-        query_np = np.array(query_embedding, dtype="float32")
-
-        scores, indices = self.vector_index.search(query_np, top_k)
-
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < len(self.chunk_ids_vector):
-                chunk_id = self.chunk_ids_vector[idx]
-                results.append((chunk_id, float(score)))
-
-        return results
-
-    def search_bm25(self, query: str, top_k: int = 8) -> list[tuple[str, float]]:
-        """Búsqueda BM25."""
-        if self.bm25_index is None:
-            return []
-
-        tokens = query.lower().split()
-        scores = self.bm25_index.get_scores(tokens)
-
-        # Top-K
-        import numpy as np
-        top_indices = np.argsort(scores)[::-1][:top_k]
-        results = []
-        for idx in top_indices:
-            if scores[idx] > 0 and idx < len(self.chunk_ids_bm25):
-                chunk_id = self.chunk_ids_bm25[idx]
-                results.append((chunk_id, float(scores[idx])))
-
-        return results
+        self.token_counter = llama_counter(self.llm)
 
     def hybrid_search(self, query: str) -> list[dict]:
         """
         Búsqueda híbrida con Reciprocal Rank Fusion (RRF).
         """
-        search_config = self.retrieval_config.get("search", {})
-        hybrid_config = self.retrieval_config.get("hybrid", {})
-        top_k = search_config.get("top_k", 8)
-        final_k = search_config.get("final_k", 5)
-        min_score = search_config.get("min_score", 0.25)
-        mode = search_config.get("mode", "hybrid")
-
-        vector_results = []
-        bm25_results = []
-
-        if mode in ("vector", "hybrid"):
-            vector_results = self.search_vector(query, top_k)
-        if mode in ("bm25", "hybrid") and self.bm25_index:
-            bm25_results = self.search_bm25(query, top_k)
-
-        if mode == "vector":
-            combined = {cid: score for cid, score in vector_results}
-        elif mode == "bm25":
-            combined = {cid: score for cid, score in bm25_results}
-        else:
-            # RRF fusion
-            k = 60  # RRF constant
-            rrf_scores = {}
-
-            for rank, (cid, _) in enumerate(vector_results):
-                rrf_scores[cid] = rrf_scores.get(cid, 0) + 1.0 / (k + rank + 1)
-            for rank, (cid, _) in enumerate(bm25_results):
-                rrf_scores[cid] = rrf_scores.get(cid, 0) + 1.0 / (k + rank + 1)
-
-            combined = rrf_scores
-
-        # Ordenar y filtrar
-        sorted_results = sorted(combined.items(), key=lambda x: x[1], reverse=True)
+        return self.retriever.hybrid_search(query)
 
-        results = []
-        for chunk_id, score in sorted_results[:final_k]:
-            if score < min_score and mode == "vector":
-                continue
-
-            content = self.chunks_content.get(chunk_id, "")
-            metadata = self.chunks_metadata.get(chunk_id, {}) if self.chunks_metadata else {}
-
-            results.append({
-                "chunk_id": chunk_id,
-                "score": round(score, 4),
-                "content": content,
-                "metadata": metadata,
-            })
+    def hybrid_search_batch(self, queries: list[str]) -> list[list[dict]]:
+        """
+        Búsqueda híbrida de varias consultas a la vez (evals): embeddings,
+        FAISS y BM25 se resuelven por lotes.
+        """
+        return self.retriever.hybrid_search_batch(queries)
 
-        return results
+    def _fragment_header(self, i: int, result: dict) -> str:
+        header = f"[Fragmento {i}]"
+        if self.retrieval_config.get("context", {}).get("include_metadata", True):
+            meta = result.get("metadata", {})
+            source = meta.get("source_file", "n/d")
+            section = meta.get("section_path", "")
+            pages = f"pp. {meta.get('page_start', 'n/d')}-{meta.get('page_end', 'n/d')}"
+            header += f" Fuente: {source} | {section} | {pages}"
+        return header
 
     def format_context(self, results: list[dict]) -> str:
         """Formatea resultados de búsqueda como contexto para el LLM."""
-        ctx_config = self.retrieval_config.get("context", {})
-        separator = ctx_config.get("separator", "\n---\n")
-        include_meta = ctx_config.get("include_metadata", True)
+        separator = self.retrieval_config.get("context", {}).get("separator", "\n---\n")
+        return separator.join(f"{self._fragment_header(i, r)}\n{r['content']}"
+                              for i, r in enumerate(results, 1))
 
-        parts = []
-        for i, r in enumerate(results, 1):
-            meta = r.get("metadata", {})
-            header = f"[Fragmento {i}]"
-            if include_meta:
-                source = meta.get("source_file", "n/d")
-                section = meta.get("section_path", "")
-                pages = f"pp. {meta.get('page_start', 'n/d')}-{meta.get('page_end', 'n/d')}"
-                header += f" Fuente: {source} | {section} | {pages}"
-
-            parts.append(f"{header}\n{r['content']}")
-
-        return separator.join(parts)
+    def context_budget(self, query: str, mode: str = "query") -> int:
+        """
+        Tokens disponibles para el contexto: max_context_tokens, acotado para que
+        system + prompt + contexto + respuesta (llm.max_tokens) quepan en n_ctx.
+        """
+        llm_config = self.config.get("llm", {})
+        system_prompt, prompt = self._render_prompt(query, "", mode)
+        prompt_tokens = sum(self.token_counter.count_batch([system_prompt, prompt]))
+        available = (llm_config.get("context_length", 4096) - llm_config.get("max_tokens", 1024)
+                     - prompt_tokens - CHAT_TEMPLATE_OVERHEAD)
+        max_context = self.retrieval_config.get("context", {}).get("max_context_tokens", 3000)
+        return max(0, min(max_context, available))
+
+    def fit_context(self, results: list[dict], budget: int) -> list[dict]:
+        """
+        Fragmentos, en orden de relevancia, que caben en `budget` tokens una vez
+        formateados. El primero que no cabe entero se recorta (marcado con
+        "truncated") si quedan al menos MIN_FRAGMENT_TOKENS; el resto se descarta.
+        """
+        counter = self.token_counter
+        separator = self.retrieval_config.get("context", {}).get("separator", "\n---\n")
+        sep_tokens = counter.count(separator)
+        headers = [self._fragment_header(i, r) for i, r in enumerate(results, 1)]
+        costs = counter.count_batch([f"{h}\n{r['content']}" for h, r in zip(headers, results)])
+
+        fitted, used = [], 0
+        for header, result, cost in zip(headers, results, costs):
+            if fitted:
+                cost += sep_tokens
+            if used + cost <= budget:
+                fitted.append(result)
+                used += cost
+                continue
+            remaining = (budget - used - (sep_tokens if fitted else 0)
+                         - counter.count(f"{header}\n"))
+            if remaining >= MIN_FRAGMENT_TOKENS:
+                fitted.append({**result, "truncated": True,
+                               "content": counter.truncate(result["content"], remaining)})
+            break
+        return fitted
 
     def format_citations(self, results: list[dict]) -> str:
         """Formatea las citas en formato Markdown según §7."""
@@ -262,41 +192,61 @@ class RAGEngine:
             lines.append(f"* `{source}` — `{section}` — páginas `{page_start}-{page_end}`")
         return "\n".join(lines)
 
+    def _load_prompts(self, mode: str) -> tuple[str, str]:
+        """(system prompt, plantilla del modo), leídos de prompts/ una sola vez."""
+        if mode not in self._prompts:
+            prompt_files = {
+                "query": "rag_answer.md",
+                "audit": "audit_mode.md",
+                "design": "design_mode.md",
+            }
+            prompt_file = PROJECT_ROOT / "prompts" / prompt_files.get(mode, "rag_answer.md")
+            system_prompt_file = PROJECT_ROOT / "prompts" / "system.md"
+
+            system_prompt = ""
+            if system_prompt_file.exists():
+                system_prompt = system_prompt_file.read_text(encoding="utf-8")
+
+            template = ""
+            if prompt_file.exists():
+                template = prompt_file.read_text(encoding="utf-8")
+
+            self._prompts[mode] = (system_prompt, template)
+        return self._prompts[mode]
+
+    def _render_prompt(self, query: str, context: str, mode: str) -> tuple[str, str]:
+        """(system prompt, prompt de usuario con los placeholders sustituidos)."""
+        system_prompt, template = self._load_prompts(mode)
+        return system_prompt, template.replace("{context}", context).replace("{query}", query)
+
     def generate_answer(self, query: str, context: str, mode: str = "query") -> str:
         """Genera respuesta con el LLM local."""
         if self.llm is None:
             self.load_llm()
 
-        # Cargar prompt template
-        prompt_files = {
-            "query": "rag_answer.md",
-            "audit": "audit_mode.md",
-            "design": "design_mode.md",
-        }
-        prompt_file = PROJECT_ROOT / "prompts" / prompt_files.get(mode, "rag_answer.md")
-        system_prompt_file = PROJECT_ROOT / "prompts" / "system.md"
-
-        system_prompt = ""
-        if system_prompt_file.exists():
-            system_prompt = system_prompt_file.read_text(encoding="utf-8")
-
-        template = ""
-        if prompt_file.exists():
-            template = prompt_file.read_text(encoding="utf-8")
-
-        # Sustituir placeholders
-        prompt = template.replace("{context}", context).replace("{query}", query)
+        system_prompt, prompt = self._render_prompt(query, context, mode)
 
+        # Nunca pedir más tokens de los que quedan en n_ctx: llama.cpp fallaría
+        # tras evaluar todo el prompt
         llm_config = self.config.get("llm", {})
-        response = self.llm.create_chat_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=llm_config.get("max_tokens", 1024),
-            temperature=llm_config.get("temperature", 0.1),
-            top_p=llm_config.get("top_p", 0.9),
-        )
+        n_ctx = llm_config.get("context_length", 4096)
+        prompt_tokens = (sum(self.token_counter.count_batch([system_prompt, prompt]))
+                         + CHAT_TEMPLATE_OVERHEAD)
+        max_tokens = min(llm_config.get("max_tokens", 1024), n_ctx - prompt_tokens)
+        if max_tokens <= 0:
+            raise ValueError(f"El prompt ({prompt_tokens} tokens) no cabe en el contexto "
+                             f"del LLM (n_ctx={n_ctx}).")
+
+        with self.llm_lock:
+            response = self.llm.create_chat_completion(
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt},
+                ],
+                max_tokens=max_tokens,
+                temperature=llm_config.get("temperature", 0.1),
+                top_p=llm_config.get("top_p", 0.9),
+            )
 
         return response["choices"][0]["message"]["content"]
 
@@ -304,8 +254,12 @@ class RAGEngine:
         """
         Pipeline completo: búsqueda → contexto → generación → citación.
         """
-        # 1. Búsqueda
+        # 1. Búsqueda, recortada al presupuesto de tokens del LLM
         results = self.hybrid_search(question)
+        if results:
+            if self.llm is None:
+                self.load_llm()
+            results = self.fit_context(results, self.context_budget(question, mode))
 
         if not results:
             return {
@@ -349,6 +303,8 @@ def main():
     if args.action == "status":
         print_header("ESTADO DEL SISTEMA RAG")
         config = load_config()
+        from app.index import BM25Index, current_index_dirs
+        _, index_dirs = current_index_dirs(config)
 
         # Comprobar componentes
         checks = {
@@ -357,8 +313,8 @@ def main():
             "Markdown extraído": len(list((PROJECT_ROOT / config["paths"]["extracted_md"]).glob("*.md"))),
             "Markdown limpio": len(list((PROJECT_ROOT / config["paths"]["clean_md"]).glob("*.md"))),
             "Chunks JSONL": (PROJECT_ROOT / config["paths"]["chunks"] / "chunks.jsonl").exists(),
-            "Índice vectorial": (PROJECT_ROOT / config["paths"]["vector_index"] / "index.faiss").exists(),
-            "Índice BM25": (PROJECT_ROOT / config["paths"]["bm25_index"] / "bm25_index.pkl").exists(),
+            "Índice vectorial": (index_dirs["vector_index"] / "index.faiss").exists(),
+            "Índice BM25": (index_dirs["bm25_index"] / BM25Index.META_FILE).exists(),
             "Modelo LLM": Path(PROJECT_ROOT / config["llm"]["model_path"]).exists(),
         }
 
@@ -20,6 +20,7 @@ from pathlib import Path
 from app.utils import (
     load_config,
     require_pdfs,
+    save_hash_cache,
     sha256_file,
     ensure_dir,
     print_header,
@@ -80,11 +81,16 @@ def generate_chunking_report() -> str:
                 if line.strip():
                     chunks.append(json.loads(line))
 
+        # Small-to-big: las métricas son de los micro-chunks (lo indexado)
+        num_parents = sum(1 for c in chunks if c.get("chunk_type") == "parent")
+        chunks = [c for c in chunks if c.get("chunk_type") != "parent"]
         token_counts = [c.get("tokens_est", 0) for c in chunks]
 
         lines.append(f"**Fecha**: generado automáticamente\n")
         lines.append(f"## Resumen\n")
         lines.append(f"- Total de chunks: **{len(chunks)}**\n")
+        if num_parents:
+            lines.append(f"- Chunks padre (small-to-big, no indexados): **{num_parents}**\n")
         lines.append(f"- Tokens promedio: **{sum(token_counts) // max(len(token_counts), 1)}**\n")
         lines.append(f"- Tokens mínimo: **{min(token_counts, default=0)}**\n")
         lines.append(f"- Tokens máximo: **{max(token_counts, default=0)}**\n")
@@ -133,9 +139,14 @@ def generate_index_report() -> str:
 
     lines = ["# Reporte de Indexación\n"]
 
-    vector_path = PROJECT_ROOT / config["paths"]["vector_index"] / "index.faiss"
-    bm25_path = PROJECT_ROOT / config["paths"]["bm25_index"] / "bm25_index.pkl"
+    from app.index import current_index_dirs
+    build_id, index_dirs = current_index_dirs(config)
+    vector_path = index_dirs["vector_index"] / "index.faiss"
+    bm25_dir = index_dirs["bm25_index"]
+    bm25_path = bm25_dir / "bm25_meta.json"
 
+    if build_id:
+        lines.append(f"- Build publicada: `{build_id}`\n\n")
     if not vector_path.exists():
         lines.append("No hay índices generados todavía.\n")
         lines.append("Ejecute: `make index`\n")
@@ -151,10 +162,15 @@ def generate_index_report() -> str:
         lines.append(f"- Dimensión: {emb_config.get('dimension', 'n/d')}\n")
 
     if bm25_path.exists():
-        size_mb = bm25_path.stat().st_size / 1024 / 1024
+        with open(bm25_path, "r", encoding="utf-8") as f:
+            bm25_meta = json.load(f)
+        size_mb = sum(p.stat().st_size for p in bm25_dir.glob("*.npy")) / 1024 / 1024
         lines.append(f"\n## Índice BM25\n")
-        lines.append(f"- Archivo: `bm25_index.pkl`\n")
+        lines.append(f"- Formato: `{bm25_meta.get('format')}` v{bm25_meta.get('version')} "
+                     f"(arrays `.npy` memory-mapped)\n")
         lines.append(f"- Tamaño: **{size_mb:.2f} MB**\n")
+        lines.append(f"- Términos: {bm25_meta.get('num_terms', 'n/d')}, "
+                     f"postings: {bm25_meta.get('num_postings', 'n/d')}\n")
 
     # Configuración de retrieval
     import yaml
@@ -167,6 +183,10 @@ def generate_index_report() -> str:
         lines.append(f"- Modo: `{search.get('mode', 'n/d')}`\n")
         lines.append(f"- Top-K: {search.get('top_k', 'n/d')}\n")
         lines.append(f"- Umbral mínimo: {search.get('min_score', 'n/d')}\n")
+        vector = retrieval.get("vector_index", {})
+        lines.append(f"- Índice vectorial: `{vector.get('type', 'flat')}` "
+                     f"(nprobe={vector.get('nprobe', 'n/d')}, "
+                     f"efSearch={vector.get('ef_search', 'n/d')})\n")
 
     with open(output, "w", encoding="utf-8") as f:
         f.writelines(lines)
@@ -186,6 +206,7 @@ def main():
 
     idx_rpt = generate_index_report()
     print(f"  ✓ Indexación: {idx_rpt}")
+    save_hash_cache()
 
     print("\n  Reportes generados en reports/")
 
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+app/retrieval.py — Núcleo de retrieval híbrido compartido
+
+Carga una sola vez por proceso el índice FAISS, el BM25, el ChunkStore y el
+modelo de embeddings, y resuelve búsquedas híbridas (vector + BM25 con
+fusión RRF y expansión small-to-big). RAGEngine y el generador de planes
+usan la misma instancia (get_retriever): el coste de carga y la memoria se
+pagan una vez y las optimizaciones de búsqueda viven en un único sitio.
+
+Cuando `make index` (o el daemon de watch) publica una build nueva,
+refresh_retriever carga sus índices en un Retriever nuevo y lo sustituye
+de forma atómica; las búsquedas en curso terminan con el anterior.
+"""
+
+import sys
+import threading
+
+import numpy as np
+import yaml
+
+from app.index import (
+    BM25Index,
+    ChunkStore,
+    configure_vector_index,
+    current_index_dirs,
+    load_chunk_ids,
+    read_index_pointer,
+    tokenize,
+)
+from app.utils import load_config, PROJECT_ROOT
+
+RRF_K = 60
+
+
+def load_retrieval_config() -> dict:
+    path = PROJECT_ROOT / "configs" / "retrieval.yml"
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+class Retriever:
+    """Índices, embedder y búsqueda híbrida RRF."""
+
+    def __init__(self, config: dict | None = None, retrieval_config: dict | None = None):
+        self.config = config or load_config()
+        self.retrieval_config = retrieval_config or load_retrieval_config()
+        self.build_id = None
+        self.vector_index = None
+        self.bm25_index = None
+        self.chunk_ids_vector = None
+        self.chunk_ids_bm25 = None
+        self.chunk_store = None
+        self.embedder = None
+
+    def load_indexes(self):
+        """Carga índices vectorial y BM25 desde disco (solo la primera vez)."""
+        if self.vector_index is not None:
+            return
+        try:
+            import faiss
+        except ImportError:
+            print("[ERROR] faiss-cpu no instalado.")
+            sys.exit(1)
+
+        # Todos los índices de la misma build publicada (indexes/current.json)
+        build_id, dirs = current_index_dirs(self.config)
+        vector_dir = dirs["vector_index"]
+        index_path = vector_dir / "index.faiss"
+
+        if not index_path.exists():
+            print("[ERROR] Índice vectorial no encontrado. Ejecute: make index")
+            sys.exit(1)
+        if not (vector_dir / "chunk_ids.npy").exists():
+            # Formato antiguo (chunk_ids.pkl): no se carga pickle
+            print("[ERROR] Índice vectorial en un formato anterior. Ejecute: make index")
+            sys.exit(1)
+
+        vector_index = faiss.read_index(str(index_path))
+        configure_vector_index(vector_index, self.retrieval_config.get("vector_index", {}))
+        self.chunk_ids_vector = load_chunk_ids(vector_dir / "chunk_ids.npy")
+
+        # BM25 (opcional)
+        bm25_dir = dirs["bm25_index"]
+        if (bm25_dir / BM25Index.META_FILE).exists():
+            self.bm25_index = BM25Index.load(bm25_dir)
+            self.chunk_ids_bm25 = load_chunk_ids(bm25_dir / "chunk_ids.npy")
+
+        # Contenido y metadatos de chunks (memory-mapped, por fila)
+        meta_dir = dirs["metadata_store"]
+        if (meta_dir / ChunkStore.META_FILE).exists():
+            self.chunk_store = ChunkStore(meta_dir)
+
+        # Al final: marca los índices como cargados
+        self.build_id = build_id
+        self.vector_index = vector_index
+        print(f"  Índices cargados: {self.vector_index.ntotal} vectores"
+              f"{f' ({build_id})' if build_id else ''}")
+        if self.bm25_index:
+            print(f"  BM25 cargado: {len(self.chunk_ids_bm25)} documentos")
+
+    def load_embedder(self):
+        """Carga modelo de embeddings (solo la primera vez)."""
+        if self.embedder is not None:
+            return
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            print("[ERROR] sentence-transformers no instalado.")
+            sys.exit(1)
+
+        emb_config = self.config.get("embeddings", {})
+        model_name = emb_config.get("model_name",
+                                    "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+        device = emb_config.get("device", "cpu")
+
+        self.embedder = SentenceTransformer(model_name, device=device)
+
+    def search_vector_batch(self, queries: list[str],
+                            top_k: int = 8) -> list[list[tuple[str, float]]]:
+        """
+        Búsqueda vectorial de varias consultas: un solo encode por lotes y
+        una sola búsqueda FAISS sobre la matriz de consultas.
+        """
+        self.load_embedder()
+        if not queries:
+            return []
+
+        emb_config = self.config.get("embeddings", {})
+        query_embeddings = self.embedder.encode(
+            queries,
+            batch_size=emb_config.get("batch_size", 64),
+            normalize_embeddings=emb_config.get("normalize", True),
+        )
+        query_np = np.ascontiguousarray(query_embeddings, dtype="float32")
+
+        scores, indices = self.vector_index.search(query_np, top_k)
+
+        all_results = []
+        for row_scores, row_indices in zip(scores, indices):
+            results = []
+            for score, idx in zip(row_scores, row_indices):
+                if 0 <= idx < len(self.chunk_ids_vector):
+                    results.append((self.chunk_ids_vector[idx], float(score)))
+            all_results.append(results)
+
+        return all_results
+
+    def search_bm25_batch(self, queries: list[str],
+                          top_k: int = 8) -> list[list[tuple[str, float]]]:
+        """Búsqueda BM25 de varias consultas con una sola pasada por el índice."""
+        if self.bm25_index is None:
+            return [[] for _ in queries]
+
+        all_results = []
+        for hits in self.bm25_index.search_batch([tokenize(q) for q in queries], top_k):
+            all_results.append([(self.chunk_ids_bm25[idx], score)
+                                for idx, score in hits if idx < len(self.chunk_ids_bm25)])
+
+        return all_results
+
+    def hybrid_search(self, query: str, **kwargs) -> list[dict]:
+        """Búsqueda híbrida de una consulta (ver ``hybrid_search_batch``)."""
+        return self.hybrid_search_batch([query], **kwargs)[0]
+
+    def hybrid_search_batch(self, queries: list[str], top_k: int | None = None,
+                            final_k: int | None = None,
+                            mode: str | None = None) -> list[list[dict]]:
+        """
+        Búsqueda híbrida con Reciprocal Rank Fusion (RRF) de varias consultas
+        a la vez: embeddings, FAISS y BM25 se resuelven por lotes y la fusión
+        se hace por consulta.
+
+        Args:
+            top_k: Candidatos por índice (por defecto search.top_k de retrieval.yml).
+            final_k: Resultados por consulta (por defecto search.final_k).
+            mode: hybrid | vector | bm25 (por defecto search.mode).
+
+        Returns:
+            Una lista por consulta de dicts con chunk_id, score, content,
+            metadata y, si hubo expansión a un padre, matched_chunk_ids.
+        """
+        search_config = self.retrieval_config.get("search", {})
+        top_k = top_k or search_config.get("top_k", 8)
+        final_k = final_k or search_config.get("final_k", 5)
+        mode = mode or search_config.get("mode", "hybrid")
+
+        no_results = [[] for _ in queries]
+        vector_batch = no_results
+        bm25_batch = no_results
+
+        if mode in ("vector", "hybrid"):
+            vector_batch = self.search_vector_batch(queries, top_k)
+        if mode in ("bm25", "hybrid") and self.bm25_index:
+            bm25_batch = self.search_bm25_batch(queries, top_k)
+
+        return [self._fuse_results(vector_results, bm25_results, final_k, mode)
+                for vector_results, bm25_results in zip(vector_batch, bm25_batch)]
+
+    def _fuse_results(self, vector_results: list[tuple[str, float]],
+                      bm25_results: list[tuple[str, float]],
+                      final_k: int, mode: str) -> list[dict]:
+        """Fusiona (RRF) los resultados de una consulta y expande los micro-chunks."""
+        min_score = self.retrieval_config.get("search", {}).get("min_score", 0.25)
+
+        if mode == "vector":
+            combined = {cid: score for cid, score in vector_results}
+        elif mode == "bm25":
+            combined = {cid: score for cid, score in bm25_results}
+        else:
+            combined = {}
+            for rank, (cid, _) in enumerate(vector_results):
+                combined[cid] = combined.get(cid, 0) + 1.0 / (RRF_K + rank + 1)
+            for rank, (cid, _) in enumerate(bm25_results):
+                combined[cid] = combined.get(cid, 0) + 1.0 / (RRF_K + rank + 1)
+
+        # Ordenar y filtrar
+        sorted_results = sorted(combined.items(), key=lambda x: x[1], reverse=True)
+
+        # Small-to-big: cada micro-chunk se expande a su padre; varios aciertos
+        # del mismo padre cuentan una vez (con la mejor puntuación)
+        results = []
+        by_id = {}
+        for chunk_id, score in sorted_results:
+            if score < min_score and mode == "vector":
+                continue
+
+            if self.chunk_store:
+                result_id, content, metadata = self.chunk_store.get_expanded(chunk_id)
+            else:
+                result_id, content, metadata = chunk_id, "", {}
+
+            if result_id in by_id:
+                by_id[result_id].setdefault("matched_chunk_ids", []).append(chunk_id)
+                continue
+            if len(results) == final_k:
+                continue
+
+            result = {
+                "chunk_id": result_id,
+                "score": round(score, 4),
+                "content": content,
+                "metadata": metadata,
+            }
+            if result_id != chunk_id:
+                result["matched_chunk_ids"] = [chunk_id]
+            by_id[result_id] = result
+            results.append(result)
+
+        return results
+
+
+_retriever: Retriever | None = None
+_reload_lock = threading.Lock()
+
+
+def get_retriever() -> Retriever:
+    """Retriever compartido del proceso (índices y embedder se cargan una vez)."""
+    global _retriever
+    if _retriever is None:
+        _retriever = Retriever()
+    return _retriever
+
+
+def refresh_retriever() -> bool:
+    """
+    Si indexes/current.json apunta a una build distinta de la cargada,
+    carga la nueva en otro Retriever (reutilizando el embedder) y lo
+    publica como compartido. Solo un hilo recarga a la vez; el resto sigue
+    usando los índices anteriores mientras tanto.
+
+    Returns:
+        True si se sustituyeron los índices.
+    """
+    global _retriever
+    current = get_retriever()
+    if current.vector_index is None:
+        return False  # aún no cargado: load_indexes leerá la build publicada
+    pointer = read_index_pointer(current.config) or {}
+    build_id = pointer.get("build_id")
+    if not build_id or build_id == current.build_id:
+        return False
+    if not _reload_lock.acquire(blocking=False):
+        return False
+    try:
+        if _retriever is not current:
+            return False
+        fresh = Retriever(current.config, current.retrieval_config)
+        fresh.embedder = current.embedder
+        try:
+            fresh.load_indexes()
+        except (Exception, SystemExit) as e:
+            print(f"  [WARN] No se pudo cargar la build {build_id}: {e}. "
+                  f"Se mantiene {current.build_id or 'la anterior'}.")
+            return False
+        _retriever = fresh
+        return True
+    finally:
+        _reload_lock.release()
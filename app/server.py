@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+app/server.py — Servidor de consultas RAG persistente
+
+Carga RAGEngine una sola vez (índices, embeddings y LLM) y atiende
+consultas por HTTP local o socket Unix, evitando el arranque en frío
+de cada `python -m app.cli query`.
+
+Tras `make index` o una reindexación del daemon de watch, el servidor
+detecta la build publicada en indexes/current.json (como mucho cada
+`--reload-check` segundos, al llegar una petición) y recarga los índices
+sin reiniciarse.
+
+Endpoints:
+    GET  /health   → estado del servidor
+    POST /search   → {"query": "..."}                → fragmentos recuperados
+    POST /query    → {"question": "...", "mode": "query|audit|design"}
+
+Uso:
+    python -m app.server --port 8765
+    python -m app.server --socket /tmp/rag.sock
+    make serve
+"""
+
+import argparse
+import json
+import os
+import socketserver
+import stat
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.utils import require_pdfs, print_header
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 64 * 1024
+VALID_MODES = ("query", "audit", "design")
+RELOAD_CHECK_S = 2.0
+
+
+class RAGRequestHandler(BaseHTTPRequestHandler):
+    """Manejador HTTP que delega en el RAGEngine compartido del servidor."""
+
+    server_version = "RAGSeguridad/0.1"
+
+    def log_message(self, format, *args):
+        print(f"  [{self.log_date_time_string()}] {format % args}")
+
+    def address_string(self):
+        # En sockets Unix client_address es una cadena vacía
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict | None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self._send_json(400, {"error": "Cuerpo JSON vacío o demasiado grande"})
+            return None
+        try:
+            data = json.loads(self.rfile.read(length).decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            self._send_json(400, {"error": f"JSON inválido: {e}"})
+            return None
+        if not isinstance(data, dict):
+            self._send_json(400, {"error": "Se esperaba un objeto JSON"})
+            return None
+        return data
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": "Ruta no encontrada"})
+            return
+        self.server.refresh_indexes()
+        engine = self.server.engine
+        self._send_json(200, {
+            "status": "ok",
+            "build": engine.build_id,
+            "vectors": engine.vector_index.ntotal,
+            "bm25": engine.bm25_index is not None,
+            "llm": engine.llm is not None,
+            "uptime_s": round(time.time() - self.server.started_at, 1),
+        })
+
+    def do_POST(self):
+        if self.path not in ("/search", "/query"):
+            self._send_json(404, {"error": "Ruta no encontrada"})
+            return
+
+        data = self._read_json()
+        if data is None:
+            return
+
+        self.server.refresh_indexes()
+        engine = self.server.engine
+        t0 = time.time()
+
+        try:
+            if self.path == "/search":
+                query = str(data.get("query", "")).strip()
+                if not query:
+                    self._send_json(400, {"error": "Falta 'query'"})
+                    return
+                results = engine.hybrid_search(query)
+                payload = {"results": results}
+            else:
+                question = str(data.get("question", "")).strip()
+                mode = data.get("mode", "query")
+                if not question:
+                    self._send_json(400, {"error": "Falta 'question'"})
+                    return
+                if mode not in VALID_MODES:
+                    self._send_json(400, {"error": f"Modo inválido: {mode}"})
+                    return
+                if engine.llm is None:
+                    self._send_json(503, {"error": "LLM no cargado (servidor en modo --no-llm). "
+                                                   "Use /search."})
+                    return
+                # Solo la generación se serializa (RAGEngine.llm_lock)
+                payload = engine.query(question, mode)
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+
+        payload["elapsed_s"] = round(time.time() - t0, 3)
+        self._send_json(200, payload)
+
+
+class EngineServerMixin:
+    """Estado compartido por los servidores: motor y recarga de índices."""
+
+    def _init_engine(self, engine, reload_check_s: float):
+        self.engine = engine
+        self.started_at = time.time()
+        self.reload_check_s = reload_check_s
+        self._next_reload_check = time.monotonic() + reload_check_s
+
+    def refresh_indexes(self):
+        """Comprueba (como mucho cada reload_check_s) si hay una build nueva y la carga."""
+        if self.reload_check_s <= 0 or time.monotonic() < self._next_reload_check:
+            return
+        self._next_reload_check = time.monotonic() + self.reload_check_s
+        if self.engine.refresh_indexes():
+            print(f"  ↻ Índices recargados: build {self.engine.build_id} "
+                  f"({self.engine.vector_index.ntotal} vectores)")
+
+
+class RAGHTTPServer(EngineServerMixin, ThreadingHTTPServer):
+    """Servidor HTTP TCP con un RAGEngine compartido entre peticiones."""
+
+    daemon_threads = True
+
+    def __init__(self, address, engine, reload_check_s: float = RELOAD_CHECK_S):
+        super().__init__(address, RAGRequestHandler)
+        self._init_engine(engine, reload_check_s)
+
+
+class RAGUnixServer(EngineServerMixin, socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    """Servidor HTTP sobre socket Unix con un RAGEngine compartido."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, engine, reload_check_s: float = RELOAD_CHECK_S):
+        super().__init__(socket_path, RAGRequestHandler)
+        self._init_engine(engine, reload_check_s)
+
+
+def load_engine(with_llm: bool = True):
+    """Carga RAGEngine con índices, embeddings y (opcionalmente) LLM."""
+    from app.rag_engine import RAGEngine
+
+    t0 = time.time()
+    engine = RAGEngine()
+    engine.load_indexes()
+    engine.load_embedder()
+    if with_llm:
+        engine.load_llm()
+    print(f"  Motor cargado en {time.time() - t0:.1f}s")
+    return engine
+
+
+def remove_stale_socket(socket_path: str):
+    """Borra un socket Unix anterior; cualquier otro archivo en esa ruta aborta."""
+    try:
+        mode = os.lstat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        print(f"[ERROR] {socket_path} existe y no es un socket Unix. No se sobrescribe.")
+        sys.exit(1)
+    os.unlink(socket_path)
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+          socket_path: str | None = None, with_llm: bool = True,
+          reload_check_s: float = RELOAD_CHECK_S):
+    """Arranca el servidor y atiende peticiones hasta Ctrl+C."""
+    print_header("SERVIDOR RAG")
+    require_pdfs("el servidor RAG")
+
+    engine = load_engine(with_llm)
+
+    if socket_path:
+        remove_stale_socket(socket_path)
+        server = RAGUnixServer(socket_path, engine, reload_check_s)
+        print(f"  Escuchando en unix:{socket_path}")
+    else:
+        server = RAGHTTPServer((host, port), engine, reload_check_s)
+        print(f"  Escuchando en http://{host}:{port}")
+    print("  Endpoints: GET /health, POST /search, POST /query")
+    print("  Ctrl+C para detener.\n")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n  Deteniendo servidor...")
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor RAG persistente")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Host de escucha")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Puerto TCP")
+    parser.add_argument("--socket", default=None,
+                        help="Ruta de socket Unix (sustituye a host/puerto)")
+    parser.add_argument("--no-llm", action="store_true",
+                        help="No cargar el LLM (solo /search)")
+    parser.add_argument("--reload-check", type=float, default=RELOAD_CHECK_S,
+                        help="Segundos entre comprobaciones de build nueva (0 = no recargar)")
+    args = parser.parse_args()
+
+    if args.socket and not hasattr(socketserver, "UnixStreamServer"):
+        print("[ERROR] Sockets Unix no disponibles en esta plataforma.")
+        sys.exit(1)
+
+    serve(args.host, args.port, args.socket, with_llm=not args.no_llm,
+          reload_check_s=args.reload_check)
+
+
+if __name__ == "__main__":
+    main()
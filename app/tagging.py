@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+app/tagging.py — Etiquetado de metadatos de seguridad en una sola pasada
+
+Todos los patrones (marcos, CVE, técnicas ATT&CK e identificadores de
+control) se combinan en una única expresión regular compilada con un
+grupo con nombre por patrón; cada chunk se recorre una sola vez y el
+grupo que casa indica qué etiqueta produce.
+
+El tipo de documento se infiere con otra expresión combinada sobre el
+inicio del texto y el nombre del archivo.
+
+Marcos y controles adicionales se declaran en configs/chunking.yml:
+
+    tagging:
+      frameworks:
+        DORA: '\\bDORA\\b'
+      controls:
+        PCI DSS: '\\bReq(?:uirement)?\\s*\\d{1,2}(?:\\.\\d{1,2}){1,2}\\b'
+
+Los patrones solo casan al inicio de una palabra y no deben usar grupos
+con nombre (usar (?:...)).
+"""
+
+import re
+
+try:
+    from re import _parser as sre_parse  # Python ≥ 3.11
+except ImportError:
+    import sre_parse
+
+from app.ledger import config_hash
+
+# Marcos de seguridad (sin distinguir mayúsculas)
+FRAMEWORK_PATTERNS = {
+    "ENS": r"\bENS\b",
+    "CCN-STIC": r"\bCCN[-\s]?STIC\b",
+    "NIST": r"\bNIST\b",
+    "CIS": r"\bCIS\b",
+    "OWASP": r"\bOWASP\b",
+    "ISO 27001": r"\bISO\s*27001\b",
+    "ISO 27002": r"\bISO\s*27002\b",
+    "ENISA": r"\bENISA\b",
+    "RGPD": r"\bRGPD\b|GDPR",
+    "NIS2": r"\bNIS\s*2\b",
+    "CISA": r"\bCISA\b",
+}
+
+# Identificadores de control (distinguiendo mayúsculas): la etiqueta es
+# "<marco> <id>", p. ej. "NIST AC-2", "ENS op.acc.1", "ISO 27001 A.5.15"
+CONTROL_PATTERNS = {
+    "NIST": r"\b(?:AC|AT|AU|CA|CM|CP|IA|IR|MA|MP|PE|PL|PM|PS|PT|RA|SA|SC|SI|SR)"
+            r"-\d{1,2}(?:\(\d{1,2}\))?(?![\w-])",
+    "ENS": r"\b(?:org\.\d|(?:op|mp)\.[a-z]{2,4}\.\d{1,2})\b",
+    "ISO 27001": r"\bA\.(?:[5-9]|1[0-8])(?:\.\d{1,2}){1,2}\b",
+}
+
+CVE_PATTERN = r"CVE-\d{4}-\d{4,}"
+ATTACK_PATTERN = r"T\d{4}(?:\.\d{3})?"
+
+# Palabra clave → tipo; ante varias coincidencias gana la primera de la lista
+DOC_TYPE_HINTS = {
+    "política": "politica",
+    "policy": "politica",
+    "runbook": "runbook",
+    "procedimiento": "procedimiento",
+    "procedure": "procedimiento",
+    "guía": "guia",
+    "guide": "guia",
+    "manual": "guia",
+    "norma": "normativa",
+    "reglamento": "normativa",
+    "regulation": "normativa",
+    "estándar": "normativa",
+    "standard": "normativa",
+    "informe": "reporte",
+    "report": "reporte",
+}
+DEFAULT_DOC_TYPE = "guia"
+
+
+def _first_chars(items) -> set[str] | None:
+    """
+    Caracteres con los que puede empezar una coincidencia del patrón ya
+    analizado por sre_parse, o None si no se pueden acotar.
+    """
+    for op, av in items:
+        name = op.name
+        if name in ("AT", "ASSERT", "ASSERT_NOT"):
+            continue  # ancho cero: decide el siguiente elemento
+        if name == "LITERAL":
+            return {chr(av)}
+        if name == "IN":
+            chars = set()
+            for item_op, item_av in av:
+                if item_op.name == "LITERAL":
+                    chars.add(chr(item_av))
+                elif item_op.name == "RANGE" and item_av[1] - item_av[0] < 256:
+                    chars.update(map(chr, range(item_av[0], item_av[1] + 1)))
+                else:
+                    return None
+            return chars
+        if name == "SUBPATTERN":
+            return _first_chars(av[-1])
+        if name == "BRANCH":
+            chars = set()
+            for branch in av[1]:
+                first = _first_chars(branch)
+                if first is None:
+                    return None
+                chars |= first
+            return chars
+        if name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") and av[0] >= 1:
+            return _first_chars(av[2])
+        return None
+    return None
+
+
+def _prefilter(case_sensitive: list[str], ignore_case: list[str]) -> str:
+    """
+    Lookahead con los posibles primeros caracteres de todas las alternativas:
+    el motor de re descarta así casi todas las posiciones sin probarlas una a
+    una. Cadena vacía si algún patrón no permite acotarlos.
+    """
+    classes = []
+    for patterns, flags in ((case_sensitive, ""), (ignore_case, "(?i:")):
+        chars = set()
+        for pattern in patterns:
+            first = _first_chars(sre_parse.parse(pattern))
+            if first is None:
+                return ""
+            chars |= first
+        if chars:
+            cls = "[" + "".join(re.escape(c) for c in sorted(chars)) + "]"
+            classes.append(f"{flags}{cls})" if flags else cls)
+    return f"(?={'|'.join(classes)})" if classes else ""
+
+
+class MetadataTagger:
+    """Autómata combinado (una regex con grupos con nombre) para marcos, CVE, ATT&CK y controles."""
+
+    def __init__(self, frameworks: dict[str, str] | None = None,
+                 controls: dict[str, str] | None = None):
+        self.frameworks = list({**FRAMEWORK_PATTERNS, **(frameworks or {})}.items())
+        controls = list({**CONTROL_PATTERNS, **(controls or {})}.items())
+
+        # grupo → (tipo, etiqueta)
+        self._groups: dict[str, tuple[str, str | None]] = {"cve": ("tag", None),
+                                                           "attack": ("tag", None)}
+        alternatives = [f"(?P<cve>{CVE_PATTERN})", f"(?P<attack>{ATTACK_PATTERN})"]
+        for i, (name, pattern) in enumerate(self.frameworks):
+            self._groups[f"f{i}"] = ("framework", name)
+            alternatives.append(f"(?P<f{i}>(?i:{pattern}))")
+        for i, (name, pattern) in enumerate(controls):
+            self._groups[f"c{i}"] = ("control", name)
+            alternatives.append(f"(?P<c{i}>{pattern})")
+        # Todas las etiquetas empiezan al inicio de una palabra
+        prefilter = _prefilter([CVE_PATTERN, ATTACK_PATTERN] + [p for _, p in controls],
+                               [p for _, p in self.frameworks])
+        self._pattern = re.compile(rf"{prefilter}(?<!\w)(?:{'|'.join(alternatives)})")
+        self._framework_order = {name: i for i, (name, _) in enumerate(self.frameworks)}
+
+        # Lookahead: detecta palabras clave solapadas en cualquier posición
+        self._hint_priority = {kw: i for i, kw in enumerate(DOC_TYPE_HINTS)}
+        hints = "|".join(re.escape(kw) for kw in DOC_TYPE_HINTS)
+        self._doc_type_pattern = re.compile(f"(?=({hints}))")
+
+    def tag(self, text: str) -> tuple[list[str], list[str]]:
+        """
+        Recorre `text` una vez.
+
+        Returns:
+            Tupla (marcos en orden de declaración, security_tags ordenados y
+            sin duplicados: CVE, técnicas ATT&CK e identificadores de control).
+        """
+        frameworks = set()
+        tags = set()
+        groups = self._groups
+        for match in self._pattern.finditer(text):
+            kind, name = groups[match.lastgroup]
+            if kind == "framework":
+                frameworks.add(name)
+            elif kind == "control":
+                tags.add(f"{name} {match.group()}")
+            else:
+                tags.add(match.group())
+        return sorted(frameworks, key=self._framework_order.__getitem__), sorted(tags)
+
+    def order_frameworks(self, frameworks) -> list[str]:
+        """Marcos en el orden de declaración (para unir los de varios chunks)."""
+        return sorted(set(frameworks), key=self._framework_order.__getitem__)
+
+    def doc_type(self, text: str, filename: str) -> str:
+        """Tipo de documento según las palabras clave del inicio del texto y el nombre."""
+        lower = (text[:2000] + filename).lower()
+        found = {m.group(1) for m in self._doc_type_pattern.finditer(lower)}
+        if not found:
+            return DEFAULT_DOC_TYPE
+        return DOC_TYPE_HINTS[min(found, key=self._hint_priority.__getitem__)]
+
+
+_taggers: dict[str, MetadataTagger] = {}
+
+
+def get_tagger(chunking_config: dict | None = None) -> MetadataTagger:
+    """
+    Tagger para la sección `tagging` de chunking.yml, compilado una vez
+    por proceso (los workers del pool lo reutilizan entre documentos).
+    """
+    tagging = (chunking_config or {}).get("tagging") or {}
+    key = config_hash(tagging)
+    tagger = _taggers.get(key)
+    if tagger is None:
+        tagger = MetadataTagger(tagging.get("frameworks"), tagging.get("controls"))
+        _taggers[key] = tagger
+    return tagger
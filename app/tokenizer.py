@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+app/tokenizer.py — Conteo de tokens con los tokenizadores reales
+
+Los límites de chunking.yml (max_tokens) y retrieval.yml (max_context_tokens)
+se expresan en tokens, pero 1 token ≈ 4 caracteres es solo una aproximación:
+con el tokenizador del embedder un chunk puede superar su ventana (y
+truncarse en silencio al indexar), y con el del LLM el prompt puede
+desbordar n_ctx.
+
+TokenCounter envuelve un tokenizador (el del embedder vía transformers o el
+del modelo GGUF vía llama.cpp) con codificación por lotes y una caché LRU
+por texto. Si el tokenizador no está disponible se usa la estimación.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Callable
+
+from app.ledger import config_hash
+
+CHARS_PER_TOKEN = 4
+CACHE_SIZE = 16384
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida de tokens (1 token ≈ 4 chars para español)."""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class TokenCounter:
+    """Cuenta tokens por lotes, con caché LRU de textos repetidos."""
+
+    def __init__(self, name: str, encode_batch: Callable[[list[str]], list[int]] | None = None,
+                 window: int | None = None, cache_size: int = CACHE_SIZE):
+        """
+        Args:
+            name: Identificador del tokenizador (para logs y métricas QA).
+            encode_batch: Textos → número de tokens de cada uno. None = estimación.
+            window: Tokens de contenido que admite el modelo (None = sin límite conocido).
+        """
+        self.name = name
+        self.window = window
+        self._encode_batch = encode_batch
+        self._cache: OrderedDict[str, int] = OrderedDict()
+        self._cache_size = cache_size
+
+    @property
+    def exact(self) -> bool:
+        return self._encode_batch is not None
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        if self._encode_batch is None:
+            return [estimate_tokens(t) for t in texts]
+
+        cache = self._cache
+        counts = [0] * len(texts)
+        missing: dict[str, list[int]] = {}
+        for i, text in enumerate(texts):
+            n = cache.get(text)
+            if n is None:
+                missing.setdefault(text, []).append(i)
+            else:
+                cache.move_to_end(text)
+                counts[i] = n
+
+        if missing:
+            pending = list(missing)
+            for text, n in zip(pending, self._encode_batch(pending)):
+                for i in missing[text]:
+                    counts[i] = n
+                cache[text] = n
+            while len(cache) > self._cache_size:
+                cache.popitem(last=False)
+        return counts
+
+    def count(self, text: str) -> int:
+        return self.count_batch([text])[0]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Prefijo de `text` (cortado en un espacio) con como máximo `max_tokens` tokens."""
+        n = self.count(text)
+        end = len(text)
+        while n > max_tokens and end > 0:
+            end = int(end * max_tokens / n * 0.95)
+            cut = text.rfind(" ", 0, end)
+            if cut > 0:
+                end = cut
+            n = self.count(text[:end])
+        return text[:end].rstrip()
+
+
+def embedder_counter(model_name: str, max_seq_length: int | None = None) -> TokenCounter | None:
+    """
+    Tokenizador del modelo de embeddings (el mismo que usa sentence-transformers).
+
+    Returns:
+        TokenCounter, o None si transformers o el modelo no están disponibles.
+    """
+    # Los workers del pool ya paralelizan: evitar hilos extra (y el aviso tras fork)
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+    except Exception:
+        return None
+
+    def encode_batch(texts: list[str]) -> list[int]:
+        encoded = tokenizer(texts, add_special_tokens=False, truncation=False, verbose=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    window = max_seq_length
+    if window is None and tokenizer.model_max_length < 100_000:
+        window = tokenizer.model_max_length
+    if window is not None:
+        # [CLS]/[SEP] (o equivalentes) ocupan parte de la ventana
+        window -= tokenizer.num_special_tokens_to_add()
+    return TokenCounter(f"embedder:{model_name}", encode_batch, window)
+
+
+def llama_counter(llm) -> TokenCounter:
+    """Tokenizador del modelo GGUF ya cargado (llama_cpp.Llama)."""
+
+    def encode_batch(texts: list[str]) -> list[int]:
+        return [len(llm.tokenize(t.encode("utf-8"), add_bos=False)) for t in texts]
+
+    return TokenCounter("llm", encode_batch, llm.n_ctx())
+
+
+_counters: dict[str, TokenCounter] = {}
+
+
+def get_token_counter(tokenizer_config: dict | None = None) -> TokenCounter:
+    """
+    TokenCounter para la sección `tokenizer` de chunking.yml (completada con
+    model_name/max_seq_length del embedder), creado una vez por proceso.
+    """
+    tokenizer_config = tokenizer_config or {}
+    key = config_hash(tokenizer_config)
+    counter = _counters.get(key)
+    if counter is None:
+        if tokenizer_config.get("backend") == "embedder":
+            counter = embedder_counter(tokenizer_config.get("model_name"),
+                                       tokenizer_config.get("max_seq_length"))
+        if counter is None:
+            counter = TokenCounter("estimate", window=tokenizer_config.get("max_seq_length"))
+        _counters[key] = counter
+    return counter
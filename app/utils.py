@@ -5,7 +5,9 @@ app/utils.py — Utilidades compartidas
 Funciones auxiliares usadas por múltiples módulos del pipeline.
 """
 
+import atexit
 import hashlib
+import json
 import os
 import sys
 from pathlib import Path
@@ -60,20 +62,179 @@ def require_pdfs(action: str = "esta acción"):
         sys.exit(0)
 
 
-def sha256_file(filepath: str | Path) -> str:
-    """Calcula el hash SHA-256 de un archivo."""
+# ── Hash de archivos con caché persistente ─────────────────
+
+HASH_BUFFER_SIZE = 1 << 20  # 1 MiB por lectura
+
+_hash_cache: dict | None = None
+_hash_cache_dirty = False
+
+
+def _hash_cache_path() -> Path:
+    paths = load_config().get("paths", {})
+    return PROJECT_ROOT / paths.get("hash_cache", "data/hash_cache.json")
+
+
+def _load_hash_cache() -> dict:
+    global _hash_cache
+    if _hash_cache is None:
+        _hash_cache = {}
+        path = _hash_cache_path()
+        if path.exists():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    _hash_cache = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                _hash_cache = {}
+        atexit.register(save_hash_cache)
+    return _hash_cache
+
+
+def _hash_cache_key(st: os.stat_result, path: Path) -> str:
+    # dev:inode sobrevive a renombrados/movimientos (ingesta) sin rehashear
+    if st.st_ino:
+        return f"{st.st_dev}:{st.st_ino}"
+    return f"path:{path.resolve()}"
+
+
+def register_file_hash(filepath: str | Path, digest: str):
+    """Registra en la caché el hash de un archivo recién escrito."""
+    global _hash_cache_dirty
+    path = Path(filepath)
+    st = path.stat()
+    _load_hash_cache()[_hash_cache_key(st, path)] = {
+        "path": str(path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha256": digest,
+    }
+    _hash_cache_dirty = True
+
+
+def save_hash_cache():
+    """
+    Guarda la caché de hashes.
+
+    Cada etapa la llama al terminar (y el daemon de watch tras cada ciclo);
+    el registro con atexit solo cubre salidas tempranas. Fusiona con la versión en disco por si otro proceso la actualizó y
+    descarta entradas cuyo archivo ya no existe.
+    """
+    global _hash_cache_dirty
+    if not _hash_cache_dirty or _hash_cache is None:
+        return
+    path = _hash_cache_path()
+    merged = {}
+    if path.exists():
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                merged = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            merged = {}
+    merged.update(_hash_cache)
+    merged = {k: v for k, v in merged.items() if os.path.exists(v["path"])}
+
+    ensure_dir(path.parent)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(merged, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    _hash_cache_dirty = False
+
+
+def _sha256_stream(path: Path) -> str:
     h = hashlib.sha256()
-    with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buffer):
+            h.update(view[:n])
     return h.hexdigest()
 
 
+def sha256_file(filepath: str | Path, use_cache: bool = True) -> str:
+    """
+    Calcula el hash SHA-256 de un archivo.
+
+    Consulta una caché persistente (data/hash_cache.json) indexada por
+    dispositivo+inodo y validada por tamaño y mtime_ns, de modo que ingesta,
+    extracción, reportes, manifiesto y backups hashean cada PDF una sola vez.
+    """
+    global _hash_cache_dirty
+    path = Path(filepath)
+    if not use_cache:
+        return _sha256_stream(path)
+
+    st = path.stat()
+    key = _hash_cache_key(st, path)
+    cache = _load_hash_cache()
+    entry = cache.get(key)
+    if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+        if entry["path"] != str(path):
+            entry["path"] = str(path)
+            _hash_cache_dirty = True
+        return entry["sha256"]
+
+    # stat tomado antes de leer: si el archivo cambia durante el hash,
+    # su mtime ya no coincidirá y se recalculará la próxima vez
+    digest = _sha256_stream(path)
+    cache[key] = {
+        "path": str(path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha256": digest,
+    }
+    _hash_cache_dirty = True
+    return digest
+
+
 def sha256_text(text: str) -> str:
     """Calcula el hash SHA-256 de un string."""
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 
+class HashingWriter:
+    """
+    Escritor de texto UTF-8 que calcula SHA-256 y nº de caracteres al vuelo.
+
+    Escribe en un archivo temporal y lo renombra al cerrar sin errores, de
+    modo que nunca queda un archivo a medio escribir con el nombre final.
+
+    Uso:
+        with HashingWriter(path) as w:
+            w.write(texto)
+        w.hexdigest(), w.characters
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self._hash = hashlib.sha256()
+        self._file = None
+        self.characters = 0
+
+    def __enter__(self):
+        self._file = open(self.tmp_path, "wb")
+        return self
+
+    def write(self, text: str):
+        data = text.encode("utf-8")
+        self._file.write(data)
+        self._hash.update(data)
+        self.characters += len(text)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+            register_file_hash(self.path, self.hexdigest())
+        else:
+            self.tmp_path.unlink(missing_ok=True)
+        return False
+
+
 def timestamp() -> str:
     """Genera un timestamp en formato YYYYMMDD-HHMMSS."""
     return datetime.now().strftime("%Y%m%d-%H%M%S")
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+app/watch.py — Daemon de ingesta continua sobre data/incoming_pdfs/
+
+Vigila incoming_pdfs/ (inotify en Linux, sondeo periódico en otros
+sistemas) y, cuando llegan PDFs completos, ejecuta el pipeline incremental
+ingest → extract → clean → chunk → index para que el corpus consultable
+se mantenga al día sin reconstrucciones completas.
+
+Un PDF se considera completo cuando:
+    - no existe su marcador de descarga parcial <nombre>.pdf.tmp.hdr, y
+    - su tamaño y mtime no cambian durante `settle_s` segundos.
+
+Las ráfagas de archivos se agrupan: el pipeline arranca tras `debounce_s`
+segundos sin cambios en los PDFs pendientes (la actividad en otros archivos
+del directorio no retrasa el procesado).
+
+La indexación publica una build nueva en indexes/current.json; los
+servidores en marcha (app/server.py) la detectan y recargan sus índices.
+
+Uso:
+    python -m app.watch
+    python -m app.cli watch --poll
+    make watch
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+from app.index import read_index_pointer
+from app.ingest import is_partial_download
+from app.utils import load_config, ensure_dir, print_header, save_hash_cache, PROJECT_ROOT
+
+# Constantes de <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class PollingWatcher:
+    """Detecta cambios comparando instantáneas del directorio cada `interval` s."""
+
+    name = "polling"
+
+    def __init__(self, directory: Path, interval: float = 2.0):
+        self.directory = directory
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict:
+        snapshot = {}
+        for entry in os.scandir(self.directory):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            snapshot[entry.name] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout: float | None) -> bool:
+        """Bloquea hasta un cambio o hasta `timeout`. Devuelve True si hubo cambios."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = self.interval if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.interval, remaining))
+            snapshot = self._scan()
+            if snapshot != self._snapshot:
+                self._snapshot = snapshot
+                return True
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Watcher basado en inotify vía ctypes (solo Linux, sin dependencias)."""
+
+    name = "inotify"
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_MODIFY
+
+    def __init__(self, directory: Path):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError("inotify no disponible en esta plataforma")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falló")
+        wd = libc.inotify_add_watch(self.fd, str(directory).encode(), self.MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch falló")
+        self.directory = directory
+
+    def wait(self, timeout: float | None) -> bool:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        # Vaciar la cola: solo interesa que hubo actividad, no el detalle
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if len(data) < _EVENT_HEADER.size:
+                break
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(directory: Path, force_poll: bool = False, interval: float = 2.0):
+    """inotify si está disponible; si no, sondeo periódico."""
+    if not force_poll:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            print(f"  [INFO] {e}. Se usa sondeo cada {interval}s.")
+    return PollingWatcher(directory, interval)
+
+
+def pending_pdfs(incoming: Path) -> dict[str, tuple[int, int]]:
+    """PDFs de incoming/ sin marcador de descarga parcial → (tamaño, mtime_ns)."""
+    pending = {}
+    for pdf in list(incoming.glob("*.pdf")) + list(incoming.glob("*.PDF")):
+        if is_partial_download(pdf):
+            continue
+        try:
+            st = pdf.stat()
+        except FileNotFoundError:
+            continue
+        pending[pdf.name] = (st.st_size, st.st_mtime_ns)
+    return pending
+
+
+def run_incremental_pipeline():
+    """
+    ingest → extract → clean → chunk → index, todos incrementales.
+
+    Returns:
+        Build de índices publicada tras el pipeline (None si no hay ninguna).
+    """
+    from app.ingest import main as ingest_main
+    from app.extract import main as extract_main
+    from app.clean import main as clean_main
+    from app.chunk import main as chunk_main
+    from app.index import main as index_main
+
+    try:
+        ingest_main()
+        extract_main()
+        clean_main()
+        chunk_main()
+        index_main()
+    finally:
+        # El daemon no sale entre ciclos: no esperar a atexit
+        save_hash_cache()
+
+    return (read_index_pointer(load_config()) or {}).get("build_id")
+
+
+def watch(force_poll: bool = False, debounce_s: float | None = None,
+          settle_s: float | None = None, once: bool = False):
+    """
+    Bucle principal del daemon.
+
+    Args:
+        force_poll: Usar sondeo aunque inotify esté disponible.
+        debounce_s: Segundos sin eventos antes de lanzar el pipeline.
+        settle_s: Segundos que un PDF debe mantener tamaño/mtime para darlo por completo.
+        once: Procesar lo pendiente una vez y salir (útil en cron/CI).
+    """
+    print_header("WATCH: INGESTA CONTINUA")
+
+    config = load_config()
+    watch_config = config.get("watch", {})
+    if debounce_s is None:
+        debounce_s = watch_config.get("debounce_s", 5.0)
+    if settle_s is None:
+        settle_s = watch_config.get("settle_s", 3.0)
+    poll_interval = watch_config.get("poll_interval_s", 2.0)
+
+    incoming = ensure_dir(PROJECT_ROOT / config["paths"]["incoming_pdfs"])
+    watcher = create_watcher(incoming, force_poll, poll_interval)
+    print(f"  Vigilando {incoming.relative_to(PROJECT_ROOT)}/ ({watcher.name}, "
+          f"debounce={debounce_s}s, settle={settle_s}s). Ctrl+C para detener.\n")
+
+    # Nombre → (tamaño, mtime_ns, instante desde el que no cambia)
+    observed: dict[str, tuple[int, int, float]] = {}
+    # PDFs que la ingesta dejó en incoming/ (inválidos, hash .sha256 erróneo):
+    # no se reprocesan hasta que cambien
+    handled: dict[str, tuple[int, int]] = {}
+    last_event = time.monotonic()
+
+    try:
+        while True:
+            now = time.monotonic()
+            current = pending_pdfs(incoming)
+            for name, stat in current.items():
+                if handled.get(name) == stat:
+                    continue
+                prev = observed.get(name)
+                if prev is None or prev[:2] != stat:
+                    observed[name] = (*stat, now)
+                    last_event = now
+            for name in set(observed) - set(current):
+                del observed[name]
+            for name in set(handled) - set(current):
+                del handled[name]
+
+            ready = [n for n, (_, _, since) in observed.items() if now - since >= settle_s]
+            quiet = now - last_event >= debounce_s
+
+            if observed and len(ready) == len(observed) and quiet:
+                print(f"  ▶ {len(ready)} PDF(s) completos: {', '.join(sorted(ready)[:5])}"
+                      f"{'...' if len(ready) > 5 else ''}")
+                t0 = time.time()
+                previous_build = (read_index_pointer(config) or {}).get("build_id")
+                build_id = previous_build
+                try:
+                    build_id = run_incremental_pipeline()
+                except SystemExit as e:
+                    print(f"  [WARN] El pipeline terminó con código {e.code}.")
+                except Exception as e:
+                    print(f"  [ERROR] Fallo en el pipeline: {e}")
+                if build_id and build_id != previous_build:
+                    print(f"\n  ✓ Build publicada: {build_id} (los servidores en marcha la recargan)")
+                print(f"\n  ✓ Corpus actualizado en {time.time() - t0:.1f}s. Vigilando...\n")
+                observed.clear()
+                handled = pending_pdfs(incoming)
+                last_event = time.monotonic()
+                if once:
+                    break
+                continue
+
+            if once and not observed:
+                print("  No hay PDFs pendientes.")
+                break
+
+            if observed:
+                # Hay archivos esperando a estabilizarse: revisar aunque no haya eventos
+                timeout = max(min(settle_s, debounce_s) / 2, 0.2)
+            else:
+                timeout = None
+            # Un evento solo despierta el bucle: el debounce lo reinician los
+            # cambios de tamaño/mtime de los PDFs pendientes (arriba), no la
+            # actividad de otros archivos del directorio
+            watcher.wait(timeout)
+    except KeyboardInterrupt:
+        print("\n  Deteniendo watch...")
+    finally:
+        watcher.close()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Ingesta continua de incoming_pdfs/")
+    parser.add_argument("--poll", action="store_true", help="Forzar sondeo en lugar de inotify")
+    parser.add_argument("--debounce", type=float, default=None,
+                        help="Segundos sin eventos antes de procesar")
+    parser.add_argument("--settle", type=float, default=None,
+                        help="Segundos de tamaño estable para dar un PDF por completo")
+    parser.add_argument("--once", action="store_true",
+                        help="Procesar lo pendiente y salir")
+    args = parser.parse_args(argv)
+    watch(args.poll, args.debounce, args.settle, args.once)
+
+
+if __name__ == "__main__":
+    main()